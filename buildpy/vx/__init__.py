@@ -1,22 +1,29 @@
 import _thread
 import argparse
+import array
 import asyncio
 import collections
 import concurrent.futures
+import contextlib
+import copy
 import datetime
 import functools
+import heapq
 import itertools
 import io
 import json
 import logging
 import math
+import multiprocessing
 import os
 import queue
 import shutil
+import signal
 import sys
 import threading
 import time
 import traceback
+import types
 import typing
 import uuid
 
@@ -24,6 +31,7 @@ import psutil
 
 from ._log import logger
 from . import _convenience
+from . import _remote
 from . import _tval
 from . import exception
 from . import resource
@@ -36,7 +44,11 @@ TK = typing.TypeVar("TK")
 TV = typing.TypeVar("TV")
 CLOSED = object()
 _PRIORITY_DEFAULT = 0
+_MEMORY = object()  # Name of the memory in the reservation of `_ThreadPoolExecutor`.
 _CDOTS = "…"
+_NO_METADATA = types.MappingProxyType(dict())
+# Guards the lazy creation of `_Job.done`.
+_DONE_LOCK = threading.Lock()
 
 # Main
 
@@ -67,25 +79,86 @@ class DSL:
         assert self.args.load_average > 0
 
         logger.setLevel(getattr(logging, self.args.log))
+        self.hash_time_cache = None
+        if self.args.resource_hash_backend == "sqlite":
+            self.hash_time_cache = resource.SQLiteHashTimeCache(
+                resource.sqlite_path_of(self.args.resource_hash_dir)
+            )
+            resource.register_hash_time_cache(
+                self.args.resource_hash_dir, self.hash_time_cache
+            )
         self.job_of_target = _tval.NonOverwritableDict()
         self.jobs_of_key = _tval.TListOf()
+        # `jobs` is set to a list while `files` declares jobs in the thread.
+        self._bulk = threading.local()
+        self.rules = []
+        self._rule_lock = threading.Lock()
+        # Job declared by a rule -> `(rules, targets)` of the chain of rules that declared it.
+        self._rule_chain_of_job = dict()
+        # Jobs of the targets of `--cut`, which are set by `run`.
+        self._cut_jobs = set()
         self.time_of_dep_cache = _tval.Cache()
         self.metadata = _tval.TDefaultDict()
         self.event_loop = _event_loop_of()
-        self.executor = _ThreadPoolExecutor(
+        self.pressure_monitor = _PressureMonitor(
+            load_average=self.args.load_average,
+            pressure_cpu=self.args.pressure_cpu,
+            pressure_memory=self.args.pressure_memory,
+            pressure_io=self.args.pressure_io,
+            interval=self.args.pressure_interval,
+        )
+        # The peak RSS is sampled only for `--memory_admission`, but the running jobs are tracked for `_cleanup`.
+        self.rss_sampler = _RSSSampler(
+            interval=self.args.rss_interval if self.args.memory_admission else None
+        )
+        # Limits the number of running subprocesses of `ash` independently of `--jobs`.
+        self.subprocess_semaphore = asyncio.Semaphore(self.args.async_subprocesses)
+        self.executor = (
+            _WorkStealingExecutor if self.args.work_stealing else _ThreadPoolExecutor
+        )(
             n_max=self.args.jobs,
             n_serial_max=self.args.n_serial,
-            load_average=self.args.load_average,
+            pressure_monitor=self.pressure_monitor,
+            idle_timeout=self.args.worker_idle_timeout,
+            resource_capacities=self.args.resource,
+            memory_margin=self.args.memory_margin,
+            fair_share=self.args.fair_share,
+            key_weights=self.args.key_weight,
+            key_caps=self.args.key_cap,
+        )
+        self.process_pool = _ProcessPool(n_max=self.args.jobs)
+        self.batcher = _Batcher(self.event_loop, self.executor)
+        self.counter_scheduler = (
+            _CounterScheduler(self) if self.args.engine == "counter" else None
+        )
+        self.coordinator = (
+            _remote.Coordinator(
+                self.event_loop,
+                *_remote.address_of(self.args.coordinator),
+                token=_remote.token_of(self.args.coordinator_token_file),
+                env_names=self.args.remote_env,
+            )
+            if self.args.coordinator
+            else None
         )
+        self.n_speculated = 0
+        self.n_speculation_won = 0
         self.deferred_errors = queue.Queue()
         self.got_error = False
         self._cleanuped = False
+        self._cleanup_lock = threading.Lock()
 
         self.execution_log_dir = (
             _convenience.jp(self.args.execution_log_dir, self.args.id)
             if self.args.execution_log_dir_append_id
             else self.args.execution_log_dir
         )
+        # The history should be loaded before `_ExecutionLogger`s truncate the logs of the previous run.
+        self.history = _ExecutionHistory(
+            _history_dirs_of(self.execution_log_dir, self.args.history_runs)
+            if _uses_history(self.args)
+            else []
+        )
         if self.execution_log_dir:
             _convenience.mkdir(self.execution_log_dir)
             with open(_convenience.jp(self.execution_log_dir, "meta.json"), "w") as fp:
@@ -134,12 +207,49 @@ class DSL:
         auto_prefix=None,
         auto_group="_",  # todo: Consider renaming.
         auto_use_ds_structure=False,
+        executor="thread",
+        resources=None,
+        memory=None,
+        remote=False,
+        batch=1,
+        batch_key=None,
+        timeout=None,
+        retries=0,
+        retry_on=(Exception,),
+        idempotent=False,
     ):
         """Declare a file job.
         Arguments:
             use_hash: Use the file checksum in addition to the modification time.
             serial: Jobs declared as `@file(serial=True)` runs exclusively to each other.
                 The argument maybe useful to declare tasks that require a GPU or large amount of memory.
+            executor: `"thread"` or `"process"`.
+                The function of a job declared as `@file(executor="process")` runs in a forked worker process to avoid the GIL.
+                `j.ts`, `j.ds`, and `j.data` should be picklable.
+                The worker processes are forked when the build starts, and such jobs cannot be declared by a running job.
+            resources: Amounts of resources the job consumes, e.g. `dict(mem_gb=60, db=1)`.
+                A job starts only if its resources fit into the capacities specified by `--resource mem_gb=256 --resource db=4`.
+                Resources without capacities are unlimited.
+            memory: Estimated peak RSS of the job in bytes.
+                With `--memory_admission True`, a job starts only if the available memory covers its peak RSS in the previous runs (or `memory` if it has not been recorded) plus `--memory_margin`.
+            remote: Run shell commands of `sh` in the job on workers connected to `--coordinator`.
+                Targets and dependencies should be on a file system shared with the workers.
+            batch: Maximum number of ready jobs to run serially in a single work item.
+                Batching reduces the scheduling overhead of a large number of short jobs.
+            batch_key: Jobs with the same `batch_key` are batched together.
+                Defaults to the code of the job function.
+            timeout: Seconds after which the process groups started by `sh` in the job are killed and the attempt fails with `TimeoutError`.
+                An `async def` job is cancelled instead.
+            retries: Number of times to run the job again after a failed attempt.
+                The targets are removed before each retry, which starts after `--retry_backoff * 2**(attempt - 1)` seconds without occupying a worker thread.
+            retry_on: Exception classes to retry.
+            idempotent: The job can be run twice concurrently.
+                With `--speculate True`, the job writes its local targets to private temporary paths, and a second copy is started if the job runs `--speculate_factor` times longer than its median duration in the previous runs and a worker thread is idle.
+                The targets of the first copy to succeed are renamed into place and the other copy is killed.
+
+        A job function defined with `async def` runs as a coroutine in the event loop without occupying a thread of `--jobs`.
+        It should not block the event loop; use `await dsl.ash(...)` instead of `sh(...)`.
+        `executor="process"`, `serial`, `resources`, `memory`, and `remote` are not supported for such jobs.
         """
 
         if cut:
@@ -171,9 +281,62 @@ class DSL:
             data=data,
             key=key,
             ts_prefix=ts_prefix,
+            executor=executor,
+            resources=_coalesce(resources, dict()),
+            memory=_coalesce(memory, 0),
+            remote=remote,
+            batch=batch,
+            batch_key=batch_key,
+            timeout=timeout,
+            retries=retries,
+            retry_on=retry_on,
+            idempotent=idempotent,
         )
         return j
 
+    def files(self, specs, f=None):
+        """Declare file jobs in bulk.
+        Arguments:
+            specs: Iterable of dicts of the arguments of `file`, e.g. `[dict(targets=["a"], deps=["b"]), ...]`.
+            f: Job function of the declared jobs.
+
+        The jobs are registered with a single acquisition of the locks of the job tables, which is much faster than calling `file` for each job in a large graph.
+        Return: List of the declared jobs (`None` for `cut=True`).
+        """
+        jobs_old = getattr(self._bulk, "jobs", None)
+        self._bulk.jobs = jobs = []
+        try:
+            ret = [self.file(**spec) for spec in specs]
+        finally:
+            self._bulk.jobs = jobs_old
+        self._register(jobs)
+        if f is not None:
+            for j in jobs:
+                j(f)
+        return ret
+
+    def rule(self, targets, deps, **kwargs):
+        """Declare a pattern rule like `%.o: %.c` of Make.
+        Arguments:
+            targets: Target patterns, each of which contains a single `%`.
+            deps: Dependencies, in which `%` is replaced by the stem.
+            kwargs: Arguments of `file` except `cut` and `auto`.
+
+        A rule is consulted only when a target or a dependency without a declared job is needed, so that only the jobs reachable from the targets are declared.
+        Among the rules whose target pattern matches, the one with the shortest stem is used (ties by the order of declaration) if its dependencies exist or can be made by the declared jobs or other rules.
+        A rule is used at most once in a chain of rules, and a rule is not used if one of its dependencies is a target of the chain, e.g. `%.y` of `%.x` is not used for `a.x` from `a.y` by `%.x` of `%.y`.
+
+            @dsl.rule("%.o", ["%.c"])
+            def _(j):
+                dsl.sh(f"cc -c -o {j.ts[0]} {j.ds[0]}")
+        """
+        for k in ("cut", "auto"):
+            if kwargs.get(k):
+                raise ValueError(f"{k} is not supported for a rule: {targets}")
+        rule = _Rule(targets, deps, kwargs)
+        self.rules.append(rule)
+        return rule
+
     def phony(
         self,
         target,
@@ -193,23 +356,95 @@ class DSL:
         return j
 
     def run(self):
+        try:
+            self._run()
+        finally:
+            # Buffered hash caches would be lost if the process is killed or lives long after the run.
+            if self.hash_time_cache is not None:
+                self.hash_time_cache.flush()
+
+    def _run(self):
+        for rule in self.rules:
+            if rule.f is None:
+                raise exception.Err(f"No function is given to {rule}")
+        self._cut_jobs = set(
+            self.job_of_target[t] for t in self.args.cut if t in self.job_of_target
+        )
         if self.args.descriptions:
             _print_descriptions(set(self.job_of_target.values()))
         elif self.args.dependencies:
             _print_dependencies(set(self.job_of_target.values()))
         elif self.args.dependencies_dot:
-            print(self.dependencies_dot())
+            with _output_of(self.args.dependencies_dot) as fp:
+                self.write_dependencies_dot(fp)
+                print(file=fp)
         elif self.args.dependencies_json:
-            print(self.dependencies_json())
+            with _output_of(self.args.dependencies_json) as fp:
+                self.write_dependencies_json(fp)
+                print(file=fp)
+        elif self.args.dependencies_ndjson:
+            with _output_of(self.args.dependencies_ndjson) as fp:
+                self.write_dependencies_ndjson(fp)
+        elif self.args.check_graph:
+            cycles = self.cycles()
+            if cycles:
+                raise exception.Err(_str_of_cycles(cycles))
+            print(f"No circular dependency in {len(self.job_of_target)} targets.")
+        elif self.args.affected_by:
+            for t in self.affected_by(self.args.affected_by):
+                print(t)
+        elif self.args.why:
+            target = self._declared_target_of(self.args.why)
+            why = self.why(target)
+            if not why:
+                print(f"{target} is up to date")
+            for t, reason in why:
+                print(f"{t}: {reason}")
         else:
+            targets = []
+            for target in self.args.targets:
+                if self.is_cut(target):
+                    logger.warning("Skip %s cut by --cut", target)
+                    continue
+                if target not in self.job_of_target:
+                    self.job_of_rule(target)
+                targets.append(target)
+            # `_CounterScheduler` and `_Planner` detect circular dependencies while walking the graph, but the coroutines would wait for each other forever.
+            if self.counter_scheduler is None and not self.args.dry_run:
+                cycles = self.cycles(targets)
+                if cycles:
+                    raise exception.Err(_str_of_cycles(cycles))
+            if self.args.prefetch_mtimes:
+                self.prefetch_times_of_deps(targets)
+            if self.args.schedule == "critical-path":
+                _set_critical_paths(
+                    set(self.job_of_target.values()),
+                    self.history,
+                    self.args.schedule_fallback_duration,
+                )
             try:
-                for target in self.args.targets:
-                    self.job_of_target[target].invoke()
-                for target in self.args.targets:
-                    self.job_of_target[target].wait()
+                if self.args.dry_run:
+                    self._write_plan(targets)
+                else:
+                    if self.counter_scheduler is None:
+                        # All the jobs reachable from `targets` have been declared by `cycles`.
+                        self.process_pool.start()
+                        for target in targets:
+                            self.job_of_target[target].invoke()
+                    else:
+                        self.counter_scheduler.invoke(
+                            [self.job_of_target[target] for target in targets]
+                        )
+                    for target in targets:
+                        self.job_of_target[target].wait()
             except KeyboardInterrupt as e:
-                self._cleanup()
+                self._cleanup(forward_sigint=True)
                 raise
+            self.process_pool.shutdown()
+            self._dump_stats()
+            self._join_execution_loggers()
+            if self.coordinator is not None:
+                self.coordinator.close()
             if self.deferred_errors.qsize() > 0:
                 logger.error("Following errors have thrown during the execution")
                 for _ in range(self.deferred_errors.qsize()):
@@ -218,6 +453,251 @@ class DSL:
                     logger.error(j)
                 raise exception.Err("Execution failed.")
 
+    def plan(self, targets):
+        """
+        Decide the jobs that would run to make `targets` by checking the timestamps without running any job.
+        Return: `(plan, errors)` of `_Planner.plan`.
+        """
+        return _Planner(self, self.args.stat_threads).plan(
+            [self.job_of_target[t] for t in targets]
+        )
+
+    def _write_plan(self, targets):
+        plan, errors = self.plan(targets)
+        for j, reason in plan:
+            if self.args.explain:
+                print("#", reason)
+            j.write()
+        for j, e_str in errors:
+            self.deferred_errors.put((j, e_str))
+
+    def prefetch_times_of_deps(self, targets):
+        """
+        Fill `time_of_dep_cache` for the local files that the jobs reachable from `targets` depend on and that no job modifies: the targets of the single-target file jobs without dependencies, which are not remade if they exist, and the targets cut by `--cut`.
+        The files are grouped by directory, and the directories are listed in parallel by `--stat_threads` threads so that the latency of a network file system is paid per directory rather than per file.
+        """
+        job_of_target = dict(self.job_of_target.items())
+        cut = set(self.args.cut)
+        use_hash_of = dict()
+        seen = set()
+        stack = [job_of_target[t] for t in targets]
+        while stack:
+            j = stack.pop()
+            if j in seen:
+                continue
+            seen.add(j)
+            for d in j.ds_unique:
+                child = job_of_target.get(d)
+                if d in cut or child in self._cut_jobs:
+                    child = None
+                elif child is None and any(
+                    rule.stem_of(d) is not None for rule in self.rules
+                ):
+                    child = self.job_of_dep(d, j)
+                # Otherwise, a dependency without a job is a source file, whose job to fail if it is missing is declared later by `job_of_dep`.
+                if child is None:
+                    stable = True
+                else:
+                    stable = (
+                        isinstance(child, _FileJob)
+                        and not child.ds_unique
+                        and len(child.ts_unique) == 1
+                    )
+                    if child not in seen:
+                        stack.append(child)
+                # The first job to check `d` decides `use_hash` as in `_time_of_dep_from_cache`.
+                if stable and isinstance(j, _FileJob) and d not in use_hash_of:
+                    use_hash_of[d] = j._use_hash
+        paths_of = collections.defaultdict(list)
+        for d, use_hash in use_hash_of.items():
+            puri = _convenience.uriparse(d)
+            # Only plain paths, which `LocalFile.mtime_of` checks as they are.
+            if puri.scheme == resource.LocalFile.scheme and puri.path == d:
+                paths_of[(os.path.dirname(d), use_hash)].append(d)
+        logger.debug(
+            "Prefetch %s files in %s directories", len(use_hash_of), len(paths_of)
+        )
+        with concurrent.futures.ThreadPoolExecutor(self.args.stat_threads) as executor:
+            for t_of in executor.map(
+                lambda item: resource.LocalFile.mtimes_in_dir(
+                    item[1], item[0][1], self.args.resource_hash_dir
+                ),
+                paths_of.items(),
+            ):
+                for d, t in t_of.items():
+                    self.time_of_dep_cache.setdefault(d, t)
+
+    def reverse_dependencies(self):
+        """
+        Return: a dict from a resource to the jobs depending on it.
+        """
+        ret = collections.defaultdict(list)
+        for j in dict.fromkeys(self.job_of_target.values()):
+            for d in j.ds_unique:
+                ret[d].append(j)
+        return ret
+
+    def affected_by(self, paths):
+        """
+        Return: the sorted targets downstream of `paths`, which would be remade if `paths` were modified.
+        Only the declared jobs are followed, and the jobs cut by `--cut` stop the propagation.
+        """
+        parents_of = collections.defaultdict(list)
+        for d, js in self.reverse_dependencies().items():
+            parents_of[_path_key(d)].extend(js)
+        seen = set()
+        stack = [_path_key(path) for path in paths]
+        while stack:
+            for j in parents_of.get(stack.pop(), ()):
+                if j in seen or j in self._cut_jobs:
+                    continue
+                seen.add(j)
+                stack.extend(_path_key(t) for t in j.ts_unique)
+        return sorted(t for j in seen for t in j.ts_unique)
+
+    def why(self, target):
+        """
+        Explain why `target` would be remade by the stat-only pass of `--dry-run`.
+        Return: a list of `(target, reason)` starting from `target`, in which each target would be remade because the next one would be made.
+            The last one is the job that would run by its own timestamps.
+            The list is empty if `target` is up to date.
+        """
+        target = self._declared_target_of(target)
+        if target not in self.job_of_target and self.job_of_rule(target) is None:
+            if target in self.reverse_dependencies() or os.path.exists(target):
+                raise exception.Err(f"{target} is a source file")
+            raise exception.Err(f"No rule to make {target}")
+        plan, errors = self.plan([target])
+        if errors:
+            raise exception.Err("\n".join(e_str for _, e_str in errors))
+        reason_of = dict(plan)
+        ret = []
+        t = target
+        j = self.job_of_target[t]
+        while j in reason_of:
+            ret.append((t, reason_of[j]))
+            # The dependency `_Planner` blames, if any.
+            t = next(
+                (d for d in j.ds_unique if self.job_of_target.get(d) in reason_of),
+                None,
+            )
+            if t is None:
+                break
+            j = self.job_of_target[t]
+        return ret
+
+    def _declared_target_of(self, path):
+        """
+        Return: the declared target equal to `path` after the normalization by `_path_key`, or the normalized `path`.
+        """
+        if path in self.job_of_target:
+            return path
+        key = _path_key(path)
+        for t in self.job_of_target.keys():
+            if _path_key(t) == key:
+                return t
+        return key
+
+    def is_cut(self, d):
+        """
+        Return: `True` if `d` or another target of its job is specified by `--cut`.
+        """
+        return d in self.args.cut or self.job_of_target.get(d) in self._cut_jobs
+
+    def job_of_dep(self, d, parent=None):
+        """
+        Return: the job to make `d`, a dependency of the job `parent`, or `None` if `d` is cut by `--cut`.
+        If `d` is not declared, a job is declared by a pattern rule of `rule` or to fail if no rule can make `d`.
+        A cut dependency is a given leaf: its job and the jobs upstream of it are neither checked nor run.
+        """
+        if self.is_cut(d):
+            return None
+        try:
+            return self.job_of_target[d]
+        except KeyError:
+            j = self.job_of_rule(d, self._rule_chain_of(parent))
+            if j is not None:
+                return j
+
+            @_convenience.let
+            def _():
+                @self.file([self.meta(d, keep=True)], [])
+                def _(j):
+                    raise exception.Err(f"No rule to make {d}")
+
+            return self.job_of_target[d]
+
+    def job_of_rule(self, t, chain=((), frozenset())):
+        """
+        Declare a job to make `t` by the first applicable pattern rule.
+        Arguments:
+            chain: `(rules, targets)` of the chain of rules by which the job depending on `t` is declared.
+                The chain only stops the infinite recursion of the rules, and a cycle through declared jobs is found by `cycles` or the engines.
+        Return: the job or `None` if no rule can make `t`.
+        """
+        match = self._match_rule(t, chain)
+        if match is None:
+            return None
+        rule, stem = match
+        logger.debug("Make %s by %s with the stem %s", t, rule, stem)
+        with self._rule_lock:
+            j = self.job_of_target.get(t)
+            if j is None:
+                j = rule.declare(self, stem)
+                self._rule_chain_of_job[j] = _rule_chain_with(chain, rule, stem)
+        return j
+
+    def _rule_chain_of(self, parent):
+        """
+        Return: the chain of rules of the job `parent`, which starts with its targets if it is not declared by a rule.
+        """
+        if parent is None:
+            return ((), frozenset())
+        chain = self._rule_chain_of_job.get(parent)
+        if chain is None:
+            chain = ((), frozenset(parent.ts_unique))
+        return chain
+
+    def _match_rule(self, t, chain):
+        """
+        Return: `(rule, stem)` of the rule with the shortest stem of `t` whose dependencies exist or can be made, or `None`.
+        A rule in the rules of `chain` or with a dependency in the targets of `chain` or its own targets is not applicable to avoid a cycle.
+        """
+        rules, targets = chain
+        candidates = []
+        for i, rule in enumerate(self.rules):
+            if rule in rules:
+                continue
+            stem = rule.stem_of(t)
+            if stem is not None:
+                candidates.append((len(stem), i, rule, stem))
+        for _, _, rule, stem in sorted(candidates, key=lambda x: x[:2]):
+            chain_of_deps = _rule_chain_with(chain, rule, stem)
+            deps = _unique_of(rule.deps_of(stem))
+            if any(d in chain_of_deps[1] for d in deps):
+                continue
+            if all(
+                d in self.job_of_target
+                or _exists(d)
+                or self._match_rule(d, chain_of_deps) is not None
+                for d in deps
+            ):
+                return rule, stem
+        return None
+
+    def _register(self, jobs):
+        self.job_of_target.update_new((t, j) for j in jobs for t in j.ts_unique)
+        self.jobs_of_key.extend((j.key, j) for j in jobs)
+        self.execution_logger_defined.put_jobs(jobs)
+
+    async def ash(self, s, **kwargs):
+        """
+        Coroutine version of `sh` for `async def` jobs.
+        At most `--async_subprocesses` commands run at the same time.
+        """
+        async with self.subprocess_semaphore:
+            return await _convenience.ash(s, **kwargs)
+
     def meta(self, uri, **kwargs):
         self.metadata[uri] = kwargs
         return uri
@@ -238,20 +718,143 @@ class DSL:
             raise NotImplementedError(f"rm({repr(uri)}) is not supported")
 
     def dependencies_json(self):
-        return _dependencies_json_of(set(self.job_of_target.values()))
+        fp = io.StringIO()
+        self.write_dependencies_json(fp)
+        return fp.getvalue()
 
     def dependencies_dot(self):
-        return _dependencies_dot_of(set(self.job_of_target.values()))
+        fp = io.StringIO()
+        self.write_dependencies_dot(fp)
+        return fp.getvalue()
 
-    def _cleanup(self):
-        if self._cleanuped:
-            return
-        self._cleanuped = True
-        self.executor.shutdown(wait=False)
-        self.event_loop.call_soon_threadsafe(self.event_loop.stop)
-        # self.event_loop.call_soon_threadsafe(self.event_loop.close)
-        if self.args.terminate_subprocesses:
-            _terminate_subprocesses()
+    def write_dependencies_json(self, fp):
+        _write_dependencies_json(set(self.job_of_target.values()), fp)
+
+    def write_dependencies_ndjson(self, fp):
+        _write_dependencies_ndjson(set(self.job_of_target.values()), fp)
+
+    def write_dependencies_dot(self, fp):
+        _write_dependencies_dot(set(self.job_of_target.values()), fp)
+
+    def cycles(self, targets=None):
+        """
+        Find circular dependencies in linear time among the declared jobs, or among the jobs reachable from `targets`.
+        The jobs declared by the pattern rules on the way are included so that a cycle through both rules and declared jobs is found.
+        Return: a list of `dict(path=[t1, t2, ..., t1], targets=[...])` for each strongly connected component with a cycle.
+            `path` is a cycle of the targets in which each target depends on the next one, and `targets` are the targets of all jobs in the component.
+        """
+        if targets is None:
+            job_of_target = dict(self.job_of_target.items())
+            roots = job_of_target.values()
+            children_of_job = dict()
+
+            def children_of(j):
+                children = children_of_job.get(j)
+                if children is None:
+                    # Duplicated children do not affect the results.
+                    children = children_of_job[j] = [
+                        c
+                        for c in (
+                            job_of_target.get(d)
+                            or self.job_of_rule(d, self._rule_chain_of(j))
+                            for d in j.ds_unique
+                        )
+                        if c is not None
+                    ]
+                return children
+
+        else:
+            roots = [self.job_of_target[t] for t in targets]
+            children_of_job = dict()
+
+            def children_of(j):
+                children = children_of_job.get(j)
+                if children is None:
+                    children = children_of_job[j] = [
+                        c
+                        for c in (self.job_of_dep(d, j) for d in j.ds_unique)
+                        if c is not None
+                    ]
+                return children
+
+        ret = []
+        for component in _strongly_connected_components(
+            dict.fromkeys(roots), children_of
+        ):
+            if len(component) == 1 and component[0] not in children_of(component[0]):
+                continue
+            jobs = _cycle_in(component, children_of)
+            # The target of `jobs[i + 1]` that `jobs[i]` depends on.
+            ts = [
+                next(d for d in j.ds_unique if self.job_of_target.get(d) is child)
+                for j, child in zip(jobs, jobs[1:])
+            ]
+            # Start from the smallest target to make the report deterministic.
+            i = ts.index(min(ts))
+            ts = ts[i + 1 :] + ts[: i + 1]
+            ret.append(
+                dict(
+                    path=ts[-1:] + ts,
+                    targets=sorted(t for j in component for t in j.ts_unique),
+                )
+            )
+        return ret
+
+    def stats(self):
+        ret = dict(
+            executor=self.executor.stats(), pressure=self.pressure_monitor.stats()
+        )
+        if self.coordinator is not None:
+            ret["remote"] = self.coordinator.stats()
+        if self.batcher.n_batches:
+            ret["batch"] = self.batcher.stats()
+        if self.args.speculate:
+            ret["speculation"] = dict(
+                n_started=self.n_speculated, n_won=self.n_speculation_won
+            )
+        return ret
+
+    def _dump_stats(self):
+        stats = self.stats()
+        logger.info("%s", stats)
+        if self.execution_log_dir:
+            with open(_convenience.jp(self.execution_log_dir, "stats.json"), "w") as fp:
+                json.dump(stats, fp, ensure_ascii=False, indent=2, sort_keys=True)
+
+    def _join_execution_loggers(self):
+        for l in (
+            self.execution_logger_defined,
+            self.execution_logger_invoked,
+            self.execution_logger_enqueued,
+            self.execution_logger_executed,
+            self.execution_logger_done,
+        ):
+            l.join()
+
+    def _cleanup(self, forward_sigint=False):
+        # Other callers wait for the first one to kill the subprocesses.
+        with self._cleanup_lock:
+            if self._cleanuped:
+                return
+            self._cleanuped = True
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.process_pool.shutdown()
+            if self.coordinator is not None:
+                self.coordinator.close_soon()
+            self.event_loop.call_soon_threadsafe(self.event_loop.stop)
+            # self.event_loop.call_soon_threadsafe(self.event_loop.close)
+            processes = [
+                p for j in self.rss_sampler.running_jobs() for p in _processes_of(j)
+            ]
+            if forward_sigint:
+                # Ctrl-C of the terminal does not reach the process groups of `--process_group True`.
+                _convenience.signal_process_groups(processes, signal.SIGINT)
+            if self.args.terminate_subprocesses:
+                _convenience.kill_process_groups(
+                    processes, self.args.kill_grace_period
+                )
+                # Processes not started by `sh` or `ash`.
+                _terminate_subprocesses()
 
     def die(self, e: str):
         logger.critical(e)
@@ -272,31 +875,161 @@ class _ExecutionLogger:
             self.queue = queue.Queue()
             self.processor = threading.Thread(target=self._worker, daemon=True)
             self.processor.start()
-        else:
-            self.queue = queue.Queue(maxsize=0)  # to support `al.queue.put(x)`
 
     def _worker(self):
         while True:
-            x = self.queue.get(block=True)
-            x = _set_unique(x, "t", datetime.datetime.utcnow().isoformat())
-            x = _set_unique(x, "i", next(self.counter))
-            json.dump(x, self.fp, ensure_ascii=False, sort_keys=True)
-            self.fp.write("\n")
+            xs = self.queue.get(block=True)
+            # A list is a batch of records from `put_jobs`.
+            for x in xs if isinstance(xs, list) else [xs]:
+                x = _set_unique(x, "t", datetime.datetime.utcnow().isoformat())
+                x = _set_unique(x, "i", next(self.counter))
+                json.dump(x, self.fp, ensure_ascii=False, sort_keys=True)
+                self.fp.write("\n")
             self.fp.flush()
+            self.queue.task_done()
+
+    def put_job(self, j, **kwargs):
+        """
+        Queue the record of `j` updated by `kwargs`.
+        The record is not made if the logger is disabled.
+        """
+        if hasattr(self, "processor"):
+            self.queue.put(dict(j.to_execution_log_data(), **kwargs))
+
+    def put_jobs(self, jobs):
+        """
+        Queue the records of `jobs` as a single item.
+        """
+        if hasattr(self, "processor"):
+            self.queue.put([j.to_execution_log_data() for j in jobs])
+
+    def join(self):
+        """
+        Wait for the queued records to be written.
+        """
+        if hasattr(self, "processor"):
+            self.queue.join()
+
+
+class _ExecutionHistory:
+    """
+    Statistics of the jobs executed in the previous runs.
+    Jobs are identified by their unique targets.
+    """
+
+    def __init__(self, dirs):
+        self.dts_of_ts = collections.defaultdict(list)
+        self.peak_rsss_of_ts = collections.defaultdict(list)
+        for dir_ in dirs:
+            try:
+                with open(_convenience.jp(dir_, "meta.json")) as fp:
+                    if json.load(fp)["args"]["dry_run"]:
+                        continue
+                with open(_convenience.jp(dir_, "executed.jsonl")) as fp:
+                    for l in fp:
+                        self._add(json.loads(l))
+            except (OSError, KeyError, ValueError) as e:
+                logger.info("Failed to load the execution log in %s: %s", dir_, e)
+
+    def _add(self, x):
+        if x.get("error") is not None:
+            return
+        ts = tuple(_unique_of(x["ts"]))
+        if "dt" in x:
+            self.dts_of_ts[ts].append(x["dt"])
+        if x.get("peak_rss") is not None:
+            self.peak_rsss_of_ts[ts].append(x["peak_rss"])
+
+    def duration_of(self, j):
+        """
+        Return: the median of the past durations of `j` or `None`.
+        """
+        dts = self.dts_of_ts.get(tuple(j.ts_unique))
+        if not dts:
+            return None
+        return _median_of(dts)
+
+    def peak_rss_of(self, j):
+        """
+        Return: the maximum of the past peak RSSs of `j` in bytes or `None`.
+        """
+        peak_rsss = self.peak_rsss_of_ts.get(tuple(j.ts_unique))
+        if not peak_rsss:
+            return None
+        return max(peak_rsss)
 
 
 class _Job:
+    __slots__ = (
+        "_done",
+        "_adone",
+        "_is_done",
+        "_is_adone",
+        "executed",
+        "successed",
+        "serial",
+        "resources",
+        "batch",
+        "batch_key",
+        "memory",
+        "processes",
+        "rss",
+        "peak_rss",
+        "timeout",
+        "timed_out",
+        "retries",
+        "retry_on",
+        "attempt",
+        "idempotent",
+        "race",
+        "worker",
+        "critical_path",
+        "metadata",
+        "f",
+        "ts",
+        "ds",
+        "ts_unique",
+        "ds_unique",
+        "desc",
+        "priority",
+        "dsl",
+        "key",
+        "invoked",
+        "data",
+    )
+
     def __init__(self, f, ts, ds, desc, priority, dsl, data, key):
-        self.done = threading.Event()
-        self.adone = asyncio.Event()
+        # Completion events are created on demand since most jobs are never waited for.
+        self._done = None
+        self._adone = None
+        self._is_done = False
+        self._is_adone = False
         self.executed = False  # This flag is used to propagate dry-run.
         self.successed = False  # True if self.execute did not raise an error
         self.serial = False
-        self.metadata = _tval.TDefaultDict()
+        self.resources = dict()
+        self.batch = 1
+        self.batch_key = None
+        self.memory = 0
+        self.processes = ()  # Processes started by `sh`, which is a `set` during `execute`.
+        self.rss = 0  # Sum of the RSS of `self.processes` and their descendants.
+        self.peak_rss = None
+        self.timeout = None
+        self.timed_out = False
+        self.retries = 0
+        self.retry_on = (Exception,)
+        self.attempt = 0
+        self.idempotent = False
+        self.race = None  # `_Race` of the running speculative copies.
+        self.worker = None  # (Sequence number, index) of the last worker thread of `_WorkStealingExecutor` that ran the job.
+        # Estimated duration from the start of the job to the end of the run.
+        self.critical_path = 0.0
 
         self.f = f
-        self.ts = _de_with_meta(self.metadata, ts)
-        self.ds = _de_with_meta(self.metadata, ds)
+        metadata = dict()
+        self.ts = _de_with_meta(metadata, ts)
+        self.ds = _de_with_meta(metadata, ds)
+        self.metadata = metadata or _NO_METADATA
         self.ts_unique = _unique_of(self.ts)
         self.ds_unique = _unique_of(self.ds)
         self.desc = desc
@@ -305,26 +1038,14 @@ class _Job:
         self.key = key
 
         self.invoked = False
-        self.run_future = None
-
-        for t in self.ts_unique:
-            self.dsl.job_of_target[t] = self
-        self.dsl.jobs_of_key.append(key, self)
 
         # User data.
         self.data = data
-        self._execution_log_data = _convenience.dictify(
-            dict(
-                data=self.data,
-                desc=self.desc,
-                ds=self.ds,
-                priority=self.priority,
-                serial=self.serial,
-                ts=self.ts,
-                key=self.key,
-            )
-        )
-        dsl.execution_logger_defined.queue.put(self.to_execution_log_data())
+        jobs = getattr(dsl._bulk, "jobs", None)
+        if jobs is None:
+            dsl._register([self])
+        else:
+            jobs.append(self)
 
     def __repr__(self):
         return f"{type(self).__name__}({_cdotify(self.ts_unique)}, {_cdotify(self.ds_unique)})"
@@ -333,18 +1054,161 @@ class _Job:
         self.f = f
         return self
 
+    @property
+    def done(self):
+        if self._done is None:
+            with _DONE_LOCK:
+                if self._done is None:
+                    done = threading.Event()
+                    if self._is_done:
+                        done.set()
+                    self._done = done
+        return self._done
+
+    @property
+    def adone(self):
+        # This property is accessed only in `self.dsl.event_loop`.
+        if self._adone is None:
+            self._adone = asyncio.Event()
+            if self._is_adone:
+                self._adone.set()
+        return self._adone
+
+    def set_done(self):
+        with _DONE_LOCK:
+            self._is_done = True
+            done = self._done
+        if done is not None:
+            done.set()
+
+    def set_adone(self):
+        # This method runs in `self.dsl.event_loop`.
+        self._is_adone = True
+        if self._adone is not None:
+            self._adone.set()
+        if self.dsl.counter_scheduler is not None:
+            self.dsl.counter_scheduler.on_done(self)
+
     def __lt__(self, other):
-        return (self.serial and not other.serial) or self.priority < other.priority
+        return (self.serial and not other.serial) or (
+            self.priority,
+            -self.critical_path,
+        ) < (other.priority, -other.critical_path)
 
     def execute(self):
         logger.debug(self)
-        assert not self.done.is_set(), self
-        assert not self.adone.is_set(), self
-        if self.dsl.args.dry_run:
-            self.write()
+        assert not self._is_done, self
+        assert not self._is_adone, self
+        t1 = time.time()
+        error = None
+        self.timed_out = False
+        self.processes = set()
+        try:
+            try:
+                with self.dsl.rss_sampler.sampling(
+                    self
+                ), _convenience.observe_processes(
+                    self.processes, self.dsl.args.process_group
+                ), _Timeout(self):
+                    self._call_f()
+            except Exception as e:
+                if self.timed_out:
+                    raise self._timeout_error() from e
+                raise
+            if self.timed_out:
+                raise self._timeout_error()
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            self._log_executed(time.time() - t1, error)
+
+    async def aexecute(self):
+        logger.debug(self)
+        assert not self._is_done, self
+        assert not self._is_adone, self
+        t1 = time.time()
+        error = None
+        self.processes = set()
+        try:
+            with self.dsl.rss_sampler.sampling(
+                self
+            ), _convenience.observe_processes(
+                self.processes, self.dsl.args.process_group
+            ):
+                try:
+                    await asyncio.wait_for(self.f(self), self.timeout)
+                except asyncio.TimeoutError as e:
+                    raise self._timeout_error() from e
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            self._log_executed(time.time() - t1, error)
+
+    def _log_executed(self, dt, error):
+        self.dsl.execution_logger_executed.put_job(
+            self, dt=dt, peak_rss=self.peak_rss, attempt=self.attempt, error=error
+        )
+
+    def _time_out(self):
+        # This method runs in the thread of `_Timeout`.
+        logger.warning("%s timed out after %s seconds", self, self.timeout)
+        self.timed_out = True
+        _convenience.kill_process_groups(
+            _processes_of(self), self.dsl.args.kill_grace_period
+        )
+
+    def _timeout_error(self):
+        return TimeoutError(f"{self} timed out after {self.timeout} seconds")
+
+    def should_retry(self, e):
+        return (
+            self.attempt < self.retries
+            and isinstance(e, self.retry_on)
+            and not self.dsl.got_error
+        )
+
+    def schedule_retry(self):
+        """
+        Remove the targets and run the job again after an exponential backoff.
+        No worker thread is occupied during the backoff.
+        """
+        self.attempt += 1
+        delay = self.dsl.args.retry_backoff * 2 ** (self.attempt - 1)
+        logger.warning(
+            "Retry %s in %s seconds (attempt %s of %s)\n%s",
+            self,
+            delay,
+            self.attempt,
+            self.retries,
+            _str_of_exception(),
+        )
+        self.rm_targets()
+        self.dsl.event_loop.call_soon_threadsafe(
+            self.dsl.event_loop.call_later, delay, self._resubmit
+        )
+
+    def _resubmit(self):
+        # This method runs in `self.dsl.event_loop`.
+        if self.is_async():
+            self.dsl.event_loop.create_task(self._arun())
         else:
-            self.f(self)
-        self.dsl.execution_logger_executed.queue.put(self.to_execution_log_data())
+            self.dsl.event_loop.run_in_executor(self.dsl.executor, self._to_work_item())
+
+    def is_async(self):
+        return asyncio.iscoroutinefunction(self.f)
+
+    def memory_estimate(self):
+        """
+        Return: the estimated peak RSS in bytes for the memory-aware admission.
+        """
+        if not self.dsl.args.memory_admission:
+            return 0
+        return _coalesce(self.dsl.history.peak_rss_of(self), self.memory)
+
+    def _call_f(self):
+        self.f(self)
 
     def rm_targets(self):
         pass
@@ -352,6 +1216,12 @@ class _Job:
     def need_update(self):
         return True
 
+    def reason_to_update(self):
+        """
+        Return: why the job should run, or `None` if it is up to date.
+        """
+        return "phony"
+
     def write(self, file=sys.stdout):
         logger.debug(self)
         for t in self.ts_unique:
@@ -362,7 +1232,7 @@ class _Job:
 
     def invoke(self):
         self.dsl.event_loop.call_soon_threadsafe(
-            self.dsl.event_loop.create_task, self.ainvoke(())
+            self.dsl.event_loop.create_task, self.ainvoke()
         )
         return self
 
@@ -373,52 +1243,107 @@ class _Job:
             pass
 
     def to_execution_log_data(self):
-        return {"successed": self.successed, **self._execution_log_data}
+        return _convenience.dictify(
+            dict(
+                successed=self.successed,
+                data=self.data,
+                desc=self.desc,
+                ds=self.ds,
+                priority=self.priority,
+                serial=self.serial,
+                ts=self.ts,
+                key=self.key,
+            )
+        )
 
-    async def ainvoke(self, call_chain):
+    async def ainvoke(self):
         # This coroutine runs inside self.dsl.event_loop.
         logger.debug(self)
         if not self.invoked:
             self.invoked = True
-            self.dsl.execution_logger_invoked.queue.put(self.to_execution_log_data())
-            if _contains(self, call_chain):
-                raise exception.Err(
-                    f"A circular dependency detected: {self} for {call_chain}"
-                )
-            cc = (self, call_chain)
+            self.dsl.execution_logger_invoked.put_job(self)
             children = []
             for d in self.ds_unique:
-                try:
-                    child = self.dsl.job_of_target[d]
-                except KeyError:
-
-                    @_convenience.let
-                    def _(d=d):
-                        @self.dsl.file([self.dsl.meta(d, keep=True)], [])
-                        def _(j):
-                            raise exception.Err(f"No rule to make {d}")
-
-                    child = self.dsl.job_of_target[d]
-                self.dsl.event_loop.create_task(child.ainvoke(cc))
+                child = self.dsl.job_of_dep(d, self)
+                if child is None:
+                    continue
+                self.dsl.event_loop.create_task(child.ainvoke())
                 children.append(child)
             for child in children:
                 await child.adone.wait()
-            if all(child.successed for child in children):
-                self.dsl.event_loop.run_in_executor(
-                    self.dsl.executor, self._to_work_item()
-                )
-                self.dsl.execution_logger_enqueued.queue.put(
-                    self.to_execution_log_data()
-                )
+            self.start(
+                all(child.successed for child in children),
+                max(
+                    (child.worker for child in children if child.worker),
+                    default=(None, None),
+                )[1],
+            )
+
+    def start(self, children_successed, affinity):
+        """
+        Submit the job if all the dependencies have succeeded, or mark it done otherwise.
+        `affinity` is the index of the worker thread that ran the last dependency.
+        """
+        # This method runs inside self.dsl.event_loop.
+        if children_successed:
+            if self.is_async():
+                self.dsl.event_loop.create_task(self._arun())
             else:
-                # todo: Move the done calls into j._enq() or a function therein.
-                # Order matters.
-                self.done.set()
-                self.adone.set()
+                wi = self._to_work_item()
+                # Prefer the worker that ran the last dependency.
+                wi.affinity = affinity
+                if self.batch > 1:
+                    self.dsl.batcher.add(wi)
+                else:
+                    self.dsl.event_loop.run_in_executor(self.dsl.executor, wi)
+            self.dsl.execution_logger_enqueued.put_job(self)
+        else:
+            # Order matters.
+            self.set_done()
+            self.set_adone()
 
     def _to_work_item(self):
         return _WorkItem(self)
 
+    async def _arun(self):
+        # Counterpart of `_WorkItem._run` for `async def` jobs.
+        if self.dsl.got_error:
+            logger.debug("Early return by an error %s", self)
+            return
+        try:
+            logger.debug("Running %s", self)
+            try:
+                # `need_update` may hash files, so it runs in the default executor of the event loop.
+                need_update = (
+                    self.attempt > 0
+                    or await self.dsl.event_loop.run_in_executor(None, self.need_update)
+                )
+            except Exception:
+                need_update = None
+                self.post_exception()
+            if need_update:
+                try:
+                    await self.aexecute()
+                    self.executed = True
+                    self.successed = True
+                except Exception as e:
+                    if self.should_retry(e):
+                        self.schedule_retry()
+                        return
+                    self.post_exception()
+            else:
+                self.executed = False
+                if need_update is None:
+                    self.successed = False
+                else:
+                    self.successed = True
+            self.dsl.execution_logger_done.put_job(self)
+            self.set_done()
+            self.set_adone()
+        except Exception:  # Propagate Exception caused by a bug in buildpy code to the main thread.
+            e_str = _str_of_exception()
+            self.dsl.die(e_str)
+
     def post_exception(self):
         logger.error(self)
         e_str = _str_of_exception()
@@ -432,6 +1357,8 @@ class _Job:
 
 
 class _PhonyJob(_Job):
+    __slots__ = ()
+
     def __init__(self, f, ts, ds, desc, priority, dsl, data, key):
         if len(_unique_of(ts)) != 1:
             raise exception.Err(
@@ -441,17 +1368,136 @@ class _PhonyJob(_Job):
 
 
 class _FileJob(_Job):
+    __slots__ = ("_use_hash", "ts_prefix", "executor", "remote", "_process_job_id")
+
     def __init__(
-        self, f, ts, ds, desc, use_hash, serial, priority, dsl, data, key, ts_prefix
+        self,
+        f,
+        ts,
+        ds,
+        desc,
+        use_hash,
+        serial,
+        priority,
+        dsl,
+        data,
+        key,
+        ts_prefix,
+        executor,
+        resources,
+        memory,
+        remote,
+        batch,
+        batch_key,
+        timeout,
+        retries,
+        retry_on,
+        idempotent,
     ):
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unsupported executor: {executor}")
+        if batch < 1:
+            raise ValueError(f"batch = {batch} should be greater than 0")
+        if timeout is not None and timeout <= 0:
+            raise ValueError(f"timeout = {timeout} should be greater than 0")
+        if retries < 0:
+            raise ValueError(f"retries = {retries} should not be negative")
+        for k, v in resources.items():
+            if v < 0:
+                raise ValueError(f"Amount of resource {k} should not be negative: {v}")
         super().__init__(f, ts, ds, desc, priority, dsl=dsl, data=data, key=key)
         self._use_hash = use_hash
         self.serial = serial
         self.ts_prefix = ts_prefix
+        self.executor = executor
+        self.resources = resources
+        self.memory = memory
+        self.remote = remote
+        self.batch = batch
+        self.batch_key = batch_key
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_on = retry_on
+        self.idempotent = idempotent
+        if executor == "process":
+            self._process_job_id = dsl.process_pool.register(self)
 
     def __repr__(self):
         return f"{type(self).__name__}({_cdotify(self.ts_unique)}, {_cdotify(self.ds_unique)}, serial={self.serial})"
 
+    def __call__(self, f):
+        if asyncio.iscoroutinefunction(f) and (
+            self.executor != "thread"
+            or self.serial
+            or self.resources
+            or self.memory
+            or self.remote
+        ):
+            raise ValueError(
+                f"executor, serial, resources, memory, and remote are not supported for an async job: {self}"
+            )
+        return super().__call__(f)
+
+    def _call_f(self):
+        if self.executor == "process":
+            self.dsl.process_pool.run(self)
+        elif self.remote and self.dsl.coordinator is not None:
+            with _convenience.run_remotely(
+                functools.partial(self.dsl.coordinator.run, j=self)
+            ):
+                super()._call_f()
+        elif self._speculation_delay() is not None:
+            self._call_f_speculatively()
+        else:
+            super()._call_f()
+
+    def _speculation_delay(self):
+        """
+        Return: seconds after which a speculative copy may start or `None` if the job is not speculated.
+        """
+        if not (self.idempotent and self.dsl.args.speculate):
+            return None
+        if not all(
+            _convenience.uriparse(t).scheme == "file" and "://" not in t
+            for t in self.ts_unique
+        ):
+            return None
+        dt = self.dsl.history.duration_of(self)
+        if dt is None:
+            return None
+        return self.dsl.args.speculate_factor * dt
+
+    def _call_f_speculatively(self):
+        self.race = race = _Race(self)
+        self.dsl.event_loop.call_soon_threadsafe(
+            self.dsl.event_loop.call_later,
+            self._speculation_delay(),
+            self._speculate,
+            race,
+        )
+        try:
+            race.run_copy()
+            race.done.wait()
+        finally:
+            self.race = None
+        if race.winner is None:
+            raise race.errors[0]
+
+    def _speculate(self, race):
+        # This method runs in `self.dsl.event_loop`.
+        if race.done.is_set() or self.dsl.got_error:
+            return
+        if not self.dsl.executor.has_idle_slot():
+            self.dsl.event_loop.call_later(
+                self.dsl.args.speculate_interval, self._speculate, race
+            )
+            return
+        logger.warning("Start a speculative copy of %s", self)
+        self.dsl.n_speculated += 1
+        self.dsl.event_loop.run_in_executor(
+            self.dsl.executor, _SpeculativeWorkItem(race)
+        )
+
     def rm_targets(self):
         logger.info(f"rm_targets(%s)", self.ts)
         for t in self.ts_unique:
@@ -463,40 +1509,37 @@ class _FileJob(_Job):
                     logger.info("Failed to remove %s", t)
 
     def need_update(self):
-        if self.dsl.args.dry_run:
-            for d in self.ds_unique:
-                try:
-                    if self.dsl.job_of_target[d].executed:
-                        return True
-                except KeyError:
-                    pass
-        return self._need_update()
+        return self.reason_to_update() is not None
 
-    def _need_update(self):
+    def reason_to_update(self):
         # Intentionally create hash caches for the all set(self.ds).
         t_ds = -float("inf")
+        d_newest = None
         for d in self.ds_unique:
             t = self._time_of_dep_from_cache(d)
-            if (
-                "check_existence_only" in self.metadata[d]
-                and self.metadata[d]["check_existence_only"]
-            ):
+            if self.metadata.get(d, _NO_METADATA).get("check_existence_only"):
                 t = -float("inf")
             if t > t_ds:
                 t_ds = t
-        try:
-            t_ts = min(
-                _mtime_of(
+                d_newest = d
+        t_ts = float("inf")
+        t_oldest = None
+        for t in self.ts_unique:
+            try:
+                t_t = _mtime_of(
                     uri=t,
                     credential=self._credential_of(t),
                     use_hash=False,
                     resource_hash_dir=self.dsl.args.resource_hash_dir,
                 )
-                for t in self.ts_unique
-            )
-        except resource.exceptions:
-            return True
-        return t_ds > t_ts
+            except resource.exceptions:
+                return f"{t} does not exist"
+            if t_t < t_ts:
+                t_ts = t_t
+                t_oldest = t
+        if t_ds > t_ts:
+            return f"{d_newest} is newer than {t_oldest}"
+        return None
         # Use of `>` instead of `>=` is intentional.
         # In theory, t_deps < t_targets if targets were made from deps, and thus you might expect ≮ (>=).
         # However, t_deps > t_targets should hold if the deps have modified *after* the creation of the targets.
@@ -629,6 +1672,12 @@ class _WorkItem:
         self.future = concurrent.futures.Future()
         self.serial = j.serial
         self.priority = j.priority
+        self.resources = j.resources
+        self.memory = j.memory_estimate()
+        self.key = j.key
+        self.t_submitted = None
+        # Index of the preferred worker of `_WorkStealingExecutor`.
+        self.affinity = None
 
     def __repr__(self):
         return f"{self.__class__.__name__}({self.j})"
@@ -650,7 +1699,8 @@ class _WorkItem:
         try:
             logger.debug("Running %s", self.j)
             try:
-                need_update = self.j.need_update()
+                # Retries skip the check since the targets have been removed.
+                need_update = self.j.attempt > 0 or self.j.need_update()
             except Exception:
                 need_update = None
                 self.j.post_exception()
@@ -659,7 +1709,10 @@ class _WorkItem:
                     self.j.execute()
                     self.j.executed = True
                     self.j.successed = True
-                except Exception:
+                except Exception as e:
+                    if self.j.should_retry(e):
+                        self.j.schedule_retry()
+                        return
                     self.j.post_exception()
             else:
                 self.j.executed = False
@@ -667,9 +1720,10 @@ class _WorkItem:
                     self.j.successed = False
                 else:
                     self.j.successed = True
-            self.j.done.set()
-            self.j.dsl.event_loop.call_soon_threadsafe(self.j.adone.set)
-            self.j.dsl.execution_logger_done.queue.put(self.j.to_execution_log_data())
+            # Log before `done.set()` so that the record is written before `DSL.run` returns.
+            self.j.dsl.execution_logger_done.put_job(self.j)
+            self.j.set_done()
+            self.j.dsl.event_loop.call_soon_threadsafe(self.j.set_adone)
         except Exception:  # Propagate Exception caused by a bug in buildpy code to the main thread.
             e_str = _str_of_exception()
             self.j.dsl.die(e_str)
@@ -677,80 +1731,1347 @@ class _WorkItem:
     def __lt__(self, other):
         return self.j < other.j
 
+    def jobs(self):
+        return [self.j]
 
-class _ThreadPoolExecutor:
-    def __init__(self, n_max, n_serial_max, load_average):
-        if n_max < 1:
-            raise ValueError(f"n_max = {n_max} should be greater than 0")
-        if n_serial_max < 1:
-            raise ValueError(f"n_serial_max = {n_serial_max} should be greater than 0")
-        self._n_max = n_max
-        self._load_average = load_average
-        self._threads = set()
-        self._threads_lock = threading.Lock()
-        self._queue = queue.PriorityQueue()
-        self._serial_queue = queue.PriorityQueue()
-        self._serial_queue_lock = threading.Semaphore(n_serial_max)
-        self._n_running = _tval.TInt(0)
-        self._shutdown = False
 
-    def submit(self, wi: _WorkItem):
-        logger.debug(wi)
-        if self._shutdown:
-            return
-        if wi.serial:
-            self._serial_queue.put(wi)
-        else:
-            self._queue.put(wi)
-        with self._threads_lock:
-            if len(self._threads) < 1 or (
-                len(self._threads) < self._n_max
-                and os.getloadavg()[0] <= self._load_average
-            ):
-                t = threading.Thread(target=self._worker, daemon=True)
-                self._threads.add(t)
-                t.start()
-        return wi.future
+class _BatchWorkItem(_WorkItem):
+    """
+    Work items of jobs run serially in a single work item.
+    """
 
-    def shutdown(self, wait=True):
-        self._shutdown = True
+    def __init__(self, wis):
+        self.wis = wis
+        # `self.j` is the job with the highest priority for `__lt__` and then the running job.
+        self.j = min(wi.j for wi in wis)
+        self.future = concurrent.futures.Future()
+        self.serial = any(wi.serial for wi in wis)
+        self.priority = self.j.priority
+        self.key = self.j.key
+        self.t_submitted = None
+        self.resources = dict()
+        for wi in wis:
+            for k, v in wi.resources.items():
+                self.resources[k] = max(v, self.resources.get(k, v))
+        self.memory = max(wi.memory for wi in wis)
+        self.affinity = wis[0].affinity
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.wis})"
+
+    def jobs(self):
+        return [wi.j for wi in self.wis]
+
+    def _run(self):
+        for wi in self.wis:
+            self.j = wi.j
+            wi._run()
+
+
+class _SpeculativeWorkItem(_WorkItem):
+    """
+    Run a speculative copy of `race.j`.
+    """
+
+    def __init__(self, race):
+        super().__init__(race.j)
+        self.race = race
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.j})"
+
+    def jobs(self):
+        return []
+
+    def _run(self):
+        self.race.run_copy()
+
+
+class _Race:
+    """
+    Copies of an idempotent job that write their targets to private temporary paths.
+    The targets of the first copy to succeed are renamed into place and the other copies are killed.
+    """
+
+    def __init__(self, j):
+        self.j = j
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.copies = []
+        self.winner = None
+        self.errors = []
+        self._n_running = 0
+
+    def run_copy(self):
+        with self.lock:
+            if self.done.is_set() or self.winner is not None:
+                return
+            i = len(self.copies)
+            path_of = {t: _speculative_path_of(t, i) for t in self.j.ts_unique}
+            c = copy.copy(self.j)
+            c.ts = _map_leaves(path_of.get, self.j.ts)
+            c.ts_unique = _unique_of(c.ts)
+            c.processes = set()
+            self.copies.append(c)
+            self._n_running += 1
+        error = None
+        try:
+            with _convenience.observe_processes(
+                c.processes, self.j.dsl.args.process_group
+            ):
+                c.f(c)
+        except Exception as e:
+            error = e
+        with self.lock:
+            self._n_running -= 1
+            if error is None and self.winner is None:
+                try:
+                    for t, path in path_of.items():
+                        if os.path.lexists(t):
+                            _convenience.rm(t)
+                        os.replace(path, t)
+                except Exception as e:
+                    error = e
+                else:
+                    self.winner = c
+                    losers = [x for x in self.copies if x is not c]
+                    if i > 0:
+                        self.j.dsl.n_speculation_won += 1
+            if self.winner is not c:
+                if error is not None:
+                    logger.info("Copy %s of %s failed: %s", i, self.j, error)
+                    self.errors.append(error)
+                for path in path_of.values():
+                    try:
+                        if os.path.lexists(path):
+                            _convenience.rm(path)
+                    except OSError as e:
+                        logger.warning("Failed to remove %s: %s", path, e)
+                if self._n_running == 0:
+                    self.done.set()
+        if self.winner is c:
+            for x in losers:
+                _convenience.kill_process_groups(
+                    list(x.processes), self.j.dsl.args.kill_grace_period
+                )
+            # Set after the kill not to leave the processes behind at the end of the run.
+            self.done.set()
+
+
+class _Rule:
+    """
+    Pattern rule declared by `DSL.rule`.
+    """
+
+    def __init__(self, targets, deps, kwargs):
+        self.targets = targets
+        self.deps = deps
+        self.kwargs = kwargs
+        self.f = None
+        self._patterns = [
+            tuple(p.split("%"))
+            for p in _unique_of(_de_with_meta(dict(), targets))
+        ]
+        for p in self._patterns:
+            if len(p) != 2:
+                raise ValueError(f"A target pattern should contain a single %: {targets}")
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.targets}, {self.deps})"
+
+    def __call__(self, f):
+        self.f = f
+        return self
+
+    def stem_of(self, t):
+        """
+        Return: the shortest non-empty stem of `t` matched by the target patterns or `None`.
+
+        >>> _Rule(["%.tab.c", "%.c"], [], dict()).stem_of("a.tab.c")
+        'a'
+        >>> _Rule("%.c", [], dict()).stem_of(".c") is None
+        True
+        """
+        ret = None
+        for prefix, suffix in self._patterns:
+            if (
+                len(t) > len(prefix) + len(suffix)
+                and t.startswith(prefix)
+                and t.endswith(suffix)
+            ):
+                stem = t[len(prefix) : len(t) - len(suffix)]
+                if ret is None or len(stem) < len(ret):
+                    ret = stem
+        return ret
+
+    def deps_of(self, stem):
+        return _map_leaves(lambda x: x.replace("%", stem), self.deps)
+
+    def targets_of(self, stem):
+        """
+        >>> _Rule(["%.tab.c", "%.tab.h"], [], dict()).targets_of("a")
+        ['a.tab.c', 'a.tab.h']
+        """
+        return [prefix + stem + suffix for prefix, suffix in self._patterns]
+
+    def declare(self, dsl, stem):
+        assert self.f is not None, self
+        return dsl.file(
+            _map_leaves(lambda x: x.replace("%", stem), self.targets),
+            self.deps_of(stem),
+            **self.kwargs,
+        )(self.f)
+
+
+def _rule_chain_with(chain, rule, stem):
+    rules, targets = chain
+    return rules + (rule,), targets.union(rule.targets_of(stem))
+
+
+class _CounterScheduler:
+    """
+    Alternative to `_Job.ainvoke`, which runs a coroutine per edge.
+    The subgraph reachable from the targets is computed once, and a job is started when the counter of its unfinished dependencies reaches zero.
+    Jobs are numbered in the subgraph to keep the counters and the reverse edges in flat arrays.
+    """
+
+    def __init__(self, dsl):
+        self.dsl = dsl
+        self.i_of_job = dict()
+        self.jobs = []
+        self.n_pending = array.array("l")  # Number of unfinished dependencies.
+        self.failed = bytearray()  # 1 if a dependency has failed.
+        # Parents of `self.jobs[i]` are `self.jobs[k]` for `k` in `self.parents[self.parents_offsets[i]:self.parents_offsets[i + 1]]`.
+        self.parents_offsets = array.array("l")
+        self.parents = array.array("l")
+
+    def invoke(self, roots):
+        self.dsl.event_loop.call_soon_threadsafe(self._invoke, roots)
+
+    def _invoke(self, roots):
+        # This method runs in `self.dsl.event_loop`.
+        try:
+            children_of = self._reachable_from(roots)
+            # All the jobs reachable from `roots` have been declared.
+            self.dsl.process_pool.start()
+            n = len(self.jobs)
+            self.n_pending = array.array("l", (len(children_of[j]) for j in self.jobs))
+            self.failed = bytearray(n)
+            self.parents_offsets = array.array("l", [0] * (n + 1))
+            for children in children_of.values():
+                for child in children:
+                    self.parents_offsets[self.i_of_job[child] + 1] += 1
+            for i in range(n):
+                self.parents_offsets[i + 1] += self.parents_offsets[i]
+            self.parents = array.array("l", [0] * self.parents_offsets[n])
+            filled = array.array("l", self.parents_offsets[:n])
+            for j, children in children_of.items():
+                for child in children:
+                    k = self.i_of_job[child]
+                    self.parents[filled[k]] = self.i_of_job[j]
+                    filled[k] += 1
+            del children_of
+            for i, j in enumerate(self.jobs):
+                if self.n_pending[i] == 0:
+                    j.start(True, None)
+        except Exception:
+            self.dsl.die(_str_of_exception())
+
+    def _reachable_from(self, roots):
+        """
+        Number the jobs reachable from `roots` in the post order.
+        Return: a dict from a job to its unique dependencies.
+        """
+        children_of = dict()
+        path = dict()  # Jobs being visited, in the order of the visit.
+        for root in roots:
+            if root in children_of:
+                continue
+            stack = [(root, None, 0)]
+            while stack:
+                j, children, k = stack.pop()
+                if children is None:
+                    if j in children_of:
+                        continue
+                    if j in path:
+                        raise exception.Err(
+                            _str_of_cycles(
+                                self.dsl.cycles([root.ts_unique[0] for root in roots])
+                            )
+                        )
+                    j.invoked = True
+                    self.dsl.execution_logger_invoked.put_job(j)
+                    path[j] = None
+                    children = [
+                        child
+                        for child in dict.fromkeys(
+                            self.dsl.job_of_dep(d, j) for d in j.ds_unique
+                        )
+                        if child is not None
+                    ]
+                if k < len(children):
+                    stack.append((j, children, k + 1))
+                    if children[k] not in children_of:
+                        stack.append((children[k], None, 0))
+                else:
+                    del path[j]
+                    children_of[j] = children
+                    self.i_of_job[j] = len(self.jobs)
+                    self.jobs.append(j)
+        return children_of
+
+    def on_done(self, j):
+        # This method runs in `self.dsl.event_loop`.
+        i = self.i_of_job.get(j)
+        if i is None:
+            return
+        try:
+            for k in self.parents[self.parents_offsets[i] : self.parents_offsets[i + 1]]:
+                if not j.successed:
+                    self.failed[k] = 1
+                self.n_pending[k] -= 1
+                if self.n_pending[k] == 0:
+                    if self.failed[k]:
+                        # Not to recurse through `set_adone` along a long chain of failed jobs.
+                        self.dsl.event_loop.call_soon(self.jobs[k].start, False, None)
+                    else:
+                        self.jobs[k].start(True, j.worker[1] if j.worker else None)
+        except Exception:
+            self.dsl.die(_str_of_exception())
+
+
+class _Planner:
+    """
+    Stat-only pass of `--dry-run`, which uses neither the event loop nor the executors.
+    Jobs reachable from the targets are decided from the leaves: a job would run if one of its dependencies would be made, and otherwise `reason_to_update` of the job is evaluated in a thread pool so that the timestamps of independent jobs are checked in parallel.
+    """
+
+    _PENDING = 0
+    _UP_TO_DATE = 1
+    _RUN = 2
+    _FAILED = 3
+    _CHUNK_SIZE_MAX = 256
+
+    def __init__(self, dsl, n_threads):
+        self.dsl = dsl
+        self.n_threads = n_threads
+
+    def plan(self, roots):
+        """
+        Return: `(plan, errors)`.
+            `plan` is a list of `(job, reason)` for the jobs that would run in a topological order.
+            `errors` is a list of `(job, error)` for the jobs failed to be checked, whose dependents are not decided.
+        """
+        children_of = dict()
+
+        def children_of_job(j):
+            children = children_of.get(j)
+            if children is None:
+                children = children_of[j] = [
+                    child
+                    for child in dict.fromkeys(
+                        self.dsl.job_of_dep(d, j) for d in j.ds_unique
+                    )
+                    if child is not None
+                ]
+            return children
+
+        jobs = []
+        for component in _strongly_connected_components(
+            dict.fromkeys(roots), children_of_job
+        ):
+            if len(component) > 1 or component[0] in children_of_job(component[0]):
+                raise exception.Err(
+                    _str_of_cycles(self.dsl.cycles([root.ts_unique[0] for root in roots]))
+                )
+            jobs.extend(component)
+        i_of_job = {j: i for i, j in enumerate(jobs)}
+        n_pending = array.array("l", (len(children_of[j]) for j in jobs))
+        parents = [[] for _ in jobs]
+        for i, j in enumerate(jobs):
+            for child in children_of[j]:
+                parents[i_of_job[child]].append(i)
+        state = bytearray(len(jobs))
+        reasons = [None] * len(jobs)
+        errors = []
+        checked = queue.SimpleQueue()
+
+        def check(chunk):
+            # This function runs in the thread pool.
+            results = []
+            for i in chunk:
+                try:
+                    results.append((i, jobs[i].reason_to_update(), None))
+                except Exception:
+                    results.append((i, None, _str_of_exception()))
+            checked.put(results)
+
+        def decide(i, s):
+            state[i] = s
+            j = jobs[i]
+            j.executed = s == self._RUN
+            j.successed = s != self._FAILED
+            for k in parents[i]:
+                n_pending[k] -= 1
+                if n_pending[k] == 0:
+                    ready.append(k)
+
+        ready = [i for i in range(len(jobs)) if n_pending[i] == 0]
+        n_chunks = 0
+        with concurrent.futures.ThreadPoolExecutor(self.n_threads) as executor:
+            while True:
+                to_check = []
+                while ready:
+                    i = ready.pop()
+                    j = jobs[i]
+                    states = [state[i_of_job[child]] for child in children_of[j]]
+                    if self._FAILED in states:
+                        decide(i, self._FAILED)
+                    elif self._RUN in states:
+                        child = children_of[j][states.index(self._RUN)]
+                        d = next(
+                            d
+                            for d in j.ds_unique
+                            if self.dsl.job_of_target.get(d) is child
+                        )
+                        reasons[i] = f"{d} would be made"
+                        decide(i, self._RUN)
+                    else:
+                        to_check.append(i)
+                # Split into chunks to amortize the overhead of the thread pool while keeping all threads busy.
+                size = max(
+                    1,
+                    min(self._CHUNK_SIZE_MAX, -(-len(to_check) // self.n_threads)),
+                )
+                for k in range(0, len(to_check), size):
+                    executor.submit(check, to_check[k : k + size])
+                    n_chunks += 1
+                if n_chunks == 0:
+                    break
+                n_chunks -= 1
+                for i, reason, error in checked.get():
+                    if error is not None:
+                        errors.append((jobs[i], error))
+                        decide(i, self._FAILED)
+                    elif reason is None:
+                        decide(i, self._UP_TO_DATE)
+                    else:
+                        reasons[i] = reason
+                        decide(i, self._RUN)
+        return (
+            [(j, reasons[i]) for i, j in enumerate(jobs) if state[i] == self._RUN],
+            errors,
+        )
+
+
+class _Batcher:
+    """
+    Group `_WorkItem`s of the jobs with the same batch key that become ready in the same iteration of the event loop into `_BatchWorkItem`s.
+    Methods other than `stats` should be called in the event loop.
+    """
+
+    def __init__(self, loop, executor):
+        self._loop = loop
+        self._executor = executor
+        self._wis_of_key = dict()
+        self._flush_scheduled = False
+        self.n_batches = 0
+        self.n_jobs = 0
+
+    def add(self, wi):
+        j = wi.j
+        key = _coalesce(j.batch_key, getattr(j.f, "__code__", j.f))
+        wis = self._wis_of_key.setdefault(key, [])
+        wis.append(wi)
+        if len(wis) >= j.batch:
+            self._submit(self._wis_of_key.pop(key))
+        elif not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._loop.call_soon(self._flush)
+
+    def stats(self):
+        return dict(n_batches=self.n_batches, n_jobs=self.n_jobs)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        for wis in self._wis_of_key.values():
+            self._submit(wis)
+        self._wis_of_key.clear()
+
+    def _submit(self, wis):
+        self.n_batches += 1
+        self.n_jobs += len(wis)
+        self._loop.run_in_executor(
+            self._executor, wis[0] if len(wis) == 1 else _BatchWorkItem(wis)
+        )
+
+
+class _ThreadPoolExecutor:
+    def __init__(
+        self,
+        n_max,
+        n_serial_max,
+        pressure_monitor,
+        idle_timeout,
+        resource_capacities,
+        memory_margin,
+        fair_share=False,
+        key_weights=None,
+        key_caps=None,
+    ):
+        if n_max < 1:
+            raise ValueError(f"n_max = {n_max} should be greater than 0")
+        if n_serial_max < 1:
+            raise ValueError(f"n_serial_max = {n_serial_max} should be greater than 0")
+        if idle_timeout < 0:
+            raise ValueError(f"idle_timeout = {idle_timeout} should not be negative")
+        self._n_max = n_max
+        self._n_serial_max = n_serial_max
+        self._pressure_monitor = pressure_monitor
+        self._pressure_monitor.add_listener(self._wake)
+        self._idle_timeout = idle_timeout
+        self._resource_capacities = resource_capacities
+        self._memory_margin = memory_margin
+        self._fair_share = fair_share
+        self._key_weights = _coalesce(key_weights, dict())
+        self._key_caps = _coalesce(key_caps, dict())
+        # `_cv` protects all the attributes below.
+        self._cv = threading.Condition(threading.Lock())
+        self._threads = set()
+        self._queue = []  # Heap of `_WorkItem`s.
+        self._queues_of_key = dict()  # Heaps of `_WorkItem`s for `fair_share`.
+        self._stats_of_key = dict()
+        self._serial_queue = []
+        self._resource_queue = []  # Non-serial `_WorkItem`s with resources or memory.
+        self._resource_usages = collections.defaultdict(float)
+        self._memory_running = set()  # Running `_WorkItem`s with memory.
+        self._n_serial_running = 0
+        self._n_running = 0
+        self._n_idle = 0
+        self._n_starting = 0
+        self._n_threads_created = 0
+        self._n_threads_reused = 0
+        self._n_threads_retired = 0
+        self._shutdown = False
+
+    def submit(self, wi: _WorkItem):
+        logger.debug(wi)
+        for k, v in wi.resources.items():
+            if v > self._resource_capacities.get(k, v):
+                logger.warning(
+                    "%s requires %s of %s, which exceeds the capacity %s",
+                    wi,
+                    v,
+                    k,
+                    self._resource_capacities[k],
+                )
+                wi.resources = {**wi.resources, k: self._resource_capacities[k]}
+        self._pressure_monitor.start()
+        with self._cv:
+            if self._shutdown:
+                return
+            wi.t_submitted = time.time()
+            st = self._key_stats_of(wi.key)
+            st["queued"] += 1
+            st["max_queued"] = max(st["queued"], st["max_queued"])
+            if wi.serial:
+                heapq.heappush(self._serial_queue, wi)
+            elif wi.resources or wi.memory:
+                heapq.heappush(self._resource_queue, wi)
+            elif self._fair_share:
+                heapq.heappush(self._queues_of_key.setdefault(wi.key, []), wi)
+            else:
+                heapq.heappush(self._queue, wi)
+            if not self._spawn_if_needed():
+                self._cv.notify()
+        return wi.future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        with self._cv:
+            self._shutdown = True
+            if cancel_futures:
+                for q in [
+                    self._queue,
+                    self._serial_queue,
+                    self._resource_queue,
+                    *self._queues_of_key.values(),
+                ]:
+                    for wi in q:
+                        wi.future.cancel()
+                    q.clear()
+                self._queues_of_key.clear()
+            self._cv.notify_all()
+
+    def stats(self):
+        with self._cv:
+            return dict(
+                threads_alive=len(self._threads),
+                threads_created=self._n_threads_created,
+                threads_reused=self._n_threads_reused,
+                threads_retired=self._n_threads_retired,
+                keys={
+                    str(k): dict(
+                        st,
+                        wait_seconds_mean=(
+                            st["wait_seconds_total"] / st["n_started"]
+                            if st["n_started"]
+                            else 0.0
+                        ),
+                    )
+                    for k, st in self._stats_of_key.items()
+                },
+            )
+
+    def has_idle_slot(self):
+        with self._cv:
+            return self._n_queued() == 0 and self._n_running < self._n_max
+
+    def _key_stats_of(self, key):
+        # Call this method with `self._cv` held.
+        try:
+            return self._stats_of_key[key]
+        except KeyError:
+            st = self._stats_of_key[key] = dict(
+                queued=0,
+                max_queued=0,
+                running=0,
+                n_started=0,
+                wait_seconds_total=0.0,
+                wait_seconds_max=0.0,
+            )
+            return st
+
+    def _wake(self):
+        with self._cv:
+            while self._spawn_if_needed():
+                pass
+            self._cv.notify_all()
+
+    def _spawn_if_needed(self):
+        # Call this method with `self._cv` held.
+        if self._n_queued() > self._n_idle + self._n_starting and (
+            len(self._threads) < 1
+            or (len(self._threads) < self._n_max and self._pressure_monitor.is_low())
+        ):
+            t = self._new_thread()
+            self._threads.add(t)
+            self._n_threads_created += 1
+            self._n_starting += 1
+            t.start()
+            return True
+        return False
+
+    def _n_queued(self):
+        return (
+            len(self._queue)
+            + sum(len(q) for q in self._queues_of_key.values())
+            + len(self._serial_queue)
+            + len(self._resource_queue)
+        )
+
+    def _new_thread(self):
+        return threading.Thread(target=self._worker, daemon=True)
+
+    def _pop(self):
+        # Call this method with `self._cv` held.
+        if self._n_running > 0 and not self._pressure_monitor.is_low():
+            return None
+        wi = None
+        if self._serial_queue and self._n_serial_running < self._n_serial_max:
+            wi = self._pop_fitting(self._serial_queue)
+            if wi is not None:
+                self._n_serial_running += 1
+        if wi is None:
+            wi = self._pop_fitting(self._resource_queue)
+            q = self._fair_queue() if self._fair_share else self._queue
+            if q and (wi is None or q[0] < wi):
+                if wi is not None:
+                    heapq.heappush(self._resource_queue, wi)
+                wi = heapq.heappop(q)
+                if not q and self._fair_share:
+                    del self._queues_of_key[wi.key]
+        if wi is not None:
+            t_wait = time.time() - wi.t_submitted
+            st = self._key_stats_of(wi.key)
+            st["queued"] -= 1
+            st["running"] += 1
+            st["n_started"] += 1
+            st["wait_seconds_total"] += t_wait
+            st["wait_seconds_max"] = max(t_wait, st["wait_seconds_max"])
+            self._n_running += 1
+            for k, v in wi.resources.items():
+                self._resource_usages[k] += v
+            if wi.memory:
+                self._memory_running.add(wi)
+        return wi
+
+    def _fair_queue(self):
+        """
+        Return: the queue of the key with the least running `_WorkItem`s per weight among the keys under their caps or `None`.
+        Ties are broken by the first `_WorkItem`s of the queues.
+        """
+        best = None
+        for key, q in self._queues_of_key.items():
+            if self._is_capped(key):
+                continue
+            share = self._stats_of_key[key]["running"] / self._key_weight_of(key)
+            if best is None or (share, q[0]) < best[:2]:
+                best = (share, q[0], q)
+        return None if best is None else best[2]
+
+    def _key_weight_of(self, key):
+        return self._key_weights.get(str(key), 1.0)
+
+    def _is_capped(self, key):
+        # Call this method with `self._cv` held.
+        if not self._fair_share:
+            return False
+        cap = self._key_caps.get(str(key))
+        return cap is not None and self._stats_of_key[key]["running"] >= cap
+
+    def _pop_fitting(self, q):
+        """
+        Pop the first `_WorkItem` in `q` whose resources fit into the free capacities.
+        Resources required by a preceding `_WorkItem` that does not fit are reserved for it to avoid starvation.
+        The heap is walked in order only up to the `_WorkItem` to pop, which is removed in O(log n).
+        """
+        if not q:
+            return None
+        if not (q[0].resources or q[0].memory or self._is_capped(q[0].key)):
+            return heapq.heappop(q)
+        reserved = set()
+        memory_free = None
+        for i in _heap_order(q):
+            wi = q[i]
+            if self._is_capped(wi.key):
+                continue
+            names = set(wi.resources)
+            if wi.memory:
+                names.add(_MEMORY)
+            if reserved.intersection(names):
+                continue
+            fits = all(
+                self._resource_usages[k] + v <= self._resource_capacities[k]
+                for k, v in wi.resources.items()
+                if k in self._resource_capacities
+            )
+            if fits and wi.memory and self._n_running > 0:
+                if memory_free is None:
+                    memory_free = self._memory_free()
+                fits = wi.memory * (1 + self._memory_margin) <= memory_free
+            if fits:
+                return _heap_remove(q, i)
+            reserved.update(names)
+        return None
+
+    def _memory_free(self):
+        """
+        Return: the available memory minus the memory expected to be allocated by the running jobs.
+        """
+        return psutil.virtual_memory().available - sum(
+            max(0, wi.memory - wi.j.rss) for wi in self._memory_running
+        )
 
     def _worker(self):
         logger.debug("Start a new worker")
+        with self._cv:
+            self._n_starting -= 1
+        n_done = 0
         # No protection against BuildPy's internal error.
         while True:
-            if self._shutdown:
-                break
-            wi = None
             logger.debug("Try to get a work item")
-            if self._serial_queue_lock.acquire(blocking=False):
-                try:
-                    wi = self._serial_queue.get(block=False)
-                    assert wi.serial
-                except queue.Empty:
-                    self._serial_queue_lock.release()
-            if wi is None:
-                try:
-                    wi = self._queue.get(block=True, timeout=0.01)
-                except queue.Empty:
+            with self._cv:
+                wi = None
+                while not self._shutdown:
+                    wi = self._pop()
+                    if wi is not None:
+                        break
+                    self._n_idle += 1
+                    notified = self._cv.wait(timeout=self._idle_timeout)
+                    self._n_idle -= 1
+                    # A worker waiting for the resources or the pressure of the queued `_WorkItem`s is not idle.
+                    if not notified and self._n_queued() == 0:
+                        break
+                if wi is None:
+                    self._threads.remove(threading.current_thread())
+                    self._n_threads_retired += 1
                     break
+                if n_done > 0:
+                    self._n_threads_reused += 1
             logger.debug("Working on %s", wi)
-
-            if math.isfinite(self._load_average):
-                while (
-                    self._n_running.val() > 0
-                    and os.getloadavg()[0] > self._load_average
-                ):
-                    time.sleep(1)
-            self._n_running.inc()
             wi()
-            self._n_running.dec()
-            if wi.serial:
-                self._serial_queue_lock.release()
-        # todo: Do not discard idle threads immediately.
+            n_done += 1
+            with self._cv:
+                self._release(wi)
         logger.debug("Stopping a worker")
-        with self._threads_lock:
+
+    def _release(self, wi):
+        # Call this method with `self._cv` held.
+        self._n_running -= 1
+        self._stats_of_key[wi.key]["running"] -= 1
+        if self._fair_share:
+            self._cv.notify()
+        if wi.serial:
+            self._n_serial_running -= 1
+            self._cv.notify()
+        if wi.resources or wi.memory:
+            for k, v in wi.resources.items():
+                self._resource_usages[k] -= v
+            self._memory_running.discard(wi)
+            self._cv.notify_all()
+
+
+def _heap_order(q):
+    """
+    Yield: the indices of the heap `q` in the ascending order of the items.
+    Only the children of the yielded nodes are visited, so that taking the first k items costs O(k log k).
+
+    >>> q = [3, 1, 4, 1, 5, 9, 2, 6]
+    >>> heapq.heapify(q)
+    >>> [q[i] for i in _heap_order(q)]
+    [1, 1, 2, 3, 4, 5, 6, 9]
+    """
+    if not q:
+        return
+    frontier = [(q[0], 0)]
+    while frontier:
+        _, i = heapq.heappop(frontier)
+        yield i
+        for k in (2 * i + 1, 2 * i + 2):
+            if k < len(q):
+                heapq.heappush(frontier, (q[k], k))
+
+
+def _heap_remove(q, i):
+    """
+    Remove and return `q[i]` of the heap `q` in O(log n).
+
+    >>> q = [3, 1, 4, 1, 5, 9, 2, 6]
+    >>> heapq.heapify(q)
+    >>> _heap_remove(q, q.index(4))
+    4
+    >>> [heapq.heappop(q) for _ in range(len(q))]
+    [1, 1, 2, 3, 5, 6, 9]
+    """
+    x = q[i]
+    last = q.pop()
+    if i < len(q):
+        q[i] = last
+        # Move `last` down and then up from `i` with the sift functions of `heapq`.
+        heapq._siftup(q, i)
+        heapq._siftdown(q, 0, i)
+    return x
+
+
+class _WorkStealingExecutor(_ThreadPoolExecutor):
+    """
+    `_ThreadPoolExecutor` with a heap of ready `_WorkItem`s per worker thread to avoid the contention on `_cv`.
+    A `_WorkItem` is pushed to the heap of the worker that ran the last dependency of its job, and the worker is woken up if it is idle, so that a consumer tends to run on the worker that produced its input.
+    A worker pops its own heap (the newest first among the same priority) and steals the best `_WorkItem` of the other workers if its heap is empty.
+    Serial `_WorkItem`s and those with resources or memory go through the shared queues of `_ThreadPoolExecutor`.
+    """
+
+    def __init__(self, n_max, *args, **kwargs):
+        super().__init__(n_max, *args, **kwargs)
+        self._heaps = [_LockedHeap() for _ in range(n_max)]
+        self._wakeups = [threading.Event() for _ in range(n_max)]
+        self._running = [False] * n_max
+        # Counters written only by the owner worker.
+        self._n_reused = [0] * n_max
+        self._n_local = [0] * n_max
+        self._n_stolen = [0] * n_max
+        self._seq = itertools.count()
+        self._round_robin = itertools.count()
+        # `_cv` protects the attributes below.
+        self._free_indices = list(reversed(range(n_max)))
+        self._idle = set()
+
+    def submit(self, wi: _WorkItem):
+        if wi.serial or wi.resources or wi.memory:
+            return super().submit(wi)
+        logger.debug(wi)
+        self._pressure_monitor.start()
+        if self._shutdown:
+            return
+        index = _coalesce(wi.affinity, next(self._round_robin) % self._n_max)
+        self._heaps[index].push(
+            (wi.priority, -wi.j.critical_path, -next(self._seq)), wi
+        )
+        # Reading `_idle` and `_threads` without the lock is safe since a worker adds itself to `_idle` before checking the heaps.
+        if self._idle or len(self._threads) < self._n_max:
+            with self._cv:
+                if index in self._idle:
+                    self._wake_worker(index)
+                elif self._idle:
+                    self._wake_worker(next(iter(self._idle)))
+                else:
+                    self._spawn_if_needed()
+        return wi.future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        super().shutdown(wait=wait, cancel_futures=cancel_futures)
+        if cancel_futures:
+            for h in self._heaps:
+                for wi in h.clear():
+                    wi.future.cancel()
+        with self._cv:
+            for i in list(self._idle):
+                self._wake_worker(i)
+
+    def stats(self):
+        return dict(
+            super().stats(),
+            threads_reused=sum(self._n_reused),
+            n_local=sum(self._n_local),
+            n_stolen=sum(self._n_stolen),
+        )
+
+    def _wake(self):
+        with self._cv:
+            while self._spawn_if_needed():
+                pass
+            for i in list(self._idle):
+                self._wake_worker(i)
+            self._cv.notify_all()
+
+    def _release(self, wi):
+        # Call this method with `self._cv` held.
+        super()._release(wi)
+        # Idle workers wait for `_wakeups` instead of `_cv`.
+        for i in list(self._idle):
+            self._wake_worker(i)
+
+    def has_idle_slot(self):
+        with self._cv:
+            return self._n_queued() == 0 and sum(self._running) < self._n_max
+
+    def _wake_worker(self, i):
+        # Call this method with `self._cv` held.
+        self._idle.discard(i)
+        self._n_idle -= 1
+        self._wakeups[i].set()
+
+    def _n_queued(self):
+        return super()._n_queued() + sum(len(h) for h in self._heaps)
+
+    def _new_thread(self):
+        return threading.Thread(
+            target=self._worker, args=(self._free_indices.pop(),), daemon=True
+        )
+
+    def _take(self, i):
+        if self._shutdown:
+            return None
+        if not self._pressure_monitor.is_low() and any(
+            r for k, r in enumerate(self._running) if k != i
+        ):
+            return None
+        if self._serial_queue or self._resource_queue:
+            with self._cv:
+                wi = self._pop()
+            if wi is not None:
+                return wi
+        wi = self._heaps[i].pop()
+        if wi is not None:
+            self._n_local[i] += 1
+            return wi
+        return self._steal(i)
+
+    def _steal(self, i):
+        while True:
+            best = None
+            for k, h in enumerate(self._heaps):
+                key = h.peek_key()
+                if key is not None and (best is None or key < best[0]):
+                    best = (key, k)
+            if best is None:
+                return None
+            wi = self._heaps[best[1]].pop()
+            if wi is not None:
+                self._n_stolen[i] += 1
+                return wi
+
+    def _worker(self, i):
+        logger.debug("Start a new worker %s", i)
+        with self._cv:
+            self._n_starting -= 1
+        wakeup = self._wakeups[i]
+        n_done = 0
+        while True:
+            wi = self._take(i)
+            if wi is None:
+                with self._cv:
+                    if self._shutdown:
+                        break
+                    wakeup.clear()
+                    self._idle.add(i)
+                    self._n_idle += 1
+                if self._has_work(i):
+                    notified = True
+                else:
+                    notified = wakeup.wait(timeout=self._idle_timeout)
+                with self._cv:
+                    if i in self._idle:
+                        self._idle.remove(i)
+                        self._n_idle -= 1
+                if notified:
+                    continue
+                wi = self._take(i)
+                if wi is None:
+                    with self._cv:
+                        # Waiting for the resources or the pressure of the queued `_WorkItem`s.
+                        waiting = self._n_queued() > 0 and not self._shutdown
+                    if waiting:
+                        continue
+                    break
+            if n_done > 0:
+                self._n_reused[i] += 1
+            logger.debug("Working on %s", wi)
+            self._running[i] = True
+            for j in wi.jobs():
+                j.worker = (next(self._seq), i)
+            wi()
+            self._running[i] = False
+            n_done += 1
+            if wi.serial or wi.resources or wi.memory:
+                with self._cv:
+                    self._release(wi)
+        with self._cv:
+            if i in self._idle:
+                self._idle.remove(i)
+                self._n_idle -= 1
             self._threads.remove(threading.current_thread())
+            self._free_indices.append(i)
+            self._n_threads_retired += 1
+            # A `_WorkItem` may have been submitted after the last `_take`.
+            if not self._shutdown:
+                self._spawn_if_needed()
+        logger.debug("Stopping a worker %s", i)
+
+    def _has_work(self, i):
+        if not self._pressure_monitor.is_low() and any(
+            r for k, r in enumerate(self._running) if k != i
+        ):
+            return False
+        return bool(self._serial_queue or self._resource_queue) or any(
+            len(h) for h in self._heaps
+        )
+
+
+class _LockedHeap:
+    __slots__ = ["lock", "heap"]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.heap = []
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, key, x):
+        with self.lock:
+            heapq.heappush(self.heap, (key, x))
+
+    def pop(self):
+        with self.lock:
+            if not self.heap:
+                return None
+            return heapq.heappop(self.heap)[1]
+
+    def clear(self):
+        with self.lock:
+            xs = [x for _, x in self.heap]
+            self.heap.clear()
+        return xs
+
+    def peek_key(self):
+        try:
+            return self.heap[0][0]
+        except IndexError:
+            return None
+
+
+class _PressureMonitor:
+    """
+    Sample the load average and the pressure stall information (PSI) of Linux in a background thread.
+    No new job should be started while any of the sampled values exceeds its threshold and other jobs are running.
+    Listeners are called as soon as all the values become lower than their thresholds again.
+    """
+
+    def __init__(
+        self, load_average, pressure_cpu, pressure_memory, pressure_io, interval
+    ):
+        self._thresholds = dict(
+            load_average=load_average,
+            cpu=pressure_cpu,
+            memory=pressure_memory,
+            io=pressure_io,
+        )
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._started = False
+        self._is_low = True
+        self._sample = dict()
+        self._n_samples = 0
+        self._n_high_samples = 0
+
+    def add_listener(self, f):
+        with self._lock:
+            self._listeners.append(f)
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        if not any(math.isfinite(v) for v in self._thresholds.values()):
+            return
+        # Sample synchronously not to admit jobs with an unknown pressure.
+        self._update()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def is_low(self):
+        return self._is_low
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                last_sample=dict(self._sample),
+                n_samples=self._n_samples,
+                n_high_samples=self._n_high_samples,
+            )
+
+    def _run(self):
+        while True:
+            time.sleep(self._interval)
+            was_low = self.is_low()
+            # Notify only on the transition from high to low not to wake up the workers at every sample.
+            if self._update() and not was_low:
+                with self._lock:
+                    listeners = list(self._listeners)
+                for f in listeners:
+                    f()
+
+    def _update(self):
+        sample = dict()
+        for k, threshold in self._thresholds.items():
+            if not math.isfinite(threshold):
+                continue
+            if k == "load_average":
+                # `os.getloadavg` reads /proc/loadavg on Linux.
+                v = os.getloadavg()[0]
+            else:
+                v = _psi_of(k)
+            if v is not None:
+                sample[k] = v
+        is_low = all(v <= self._thresholds[k] for k, v in sample.items())
+        with self._lock:
+            self._sample = sample
+            self._n_samples += 1
+            if not is_low:
+                self._n_high_samples += 1
+            self._is_low = is_low
+        return is_low
+
+
+class _RSSSampler:
+    """
+    Sample the RSS of the processes started by running jobs in a background thread to record their peak RSS.
+    With `interval=None`, no thread is started and only the running jobs are tracked.
+    """
+
+    def __init__(self, interval):
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._jobs = set()
+        self._thread = None
+
+    def sampling(self, j):
+        return _Sampling(self, j)
+
+    def add(self, j):
+        with self._lock:
+            self._jobs.add(j)
+            if self._thread is None and self._interval is not None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def discard(self, j):
+        with self._lock:
+            self._jobs.discard(j)
+
+    def running_jobs(self):
+        """
+        Return: the jobs being executed.
+        """
+        with self._lock:
+            return list(self._jobs)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                jobs = list(self._jobs)
+            for j in jobs:
+                self._sample(j)
+            time.sleep(self._interval)
+
+    def _sample(self, j):
+        rss = 0
+        processes = _processes_of(j)
+        for p in processes:
+            try:
+                pp = psutil.Process(p.pid)
+                rss += pp.memory_info().rss
+                for c in pp.children(recursive=True):
+                    try:
+                        rss += c.memory_info().rss
+                    except psutil.Error:
+                        pass
+            except psutil.Error:
+                pass
+        j.rss = rss
+        if processes:
+            j.peak_rss = max(rss, _coalesce(j.peak_rss, 0))
+
+
+def _processes_of(j):
+    """
+    Return: the processes started by `sh` or `ash` in `j` and its speculative copies.
+    """
+    race = getattr(j, "race", None)
+    ret = list(j.processes)
+    if race is not None:
+        ret.extend(p for c in list(race.copies) for p in list(c.processes))
+    return ret
+
+
+class _Timeout:
+    """
+    Call `j._time_out` in a background thread if the block takes longer than `j.timeout` seconds.
+    """
+
+    __slots__ = ["j", "timer"]
+
+    def __init__(self, j):
+        self.j = j
+        self.timer = None
+
+    def __enter__(self):
+        if self.j.timeout is not None:
+            self.timer = threading.Timer(self.j.timeout, self.j._time_out)
+            self.timer.daemon = True
+            self.timer.start()
+        return self
+
+    def __exit__(self, *_):
+        if self.timer is not None:
+            self.timer.cancel()
+            # Wait for the processes to be killed.
+            self.timer.join()
+
+
+class _Sampling:
+    __slots__ = ["sampler", "j"]
+
+    def __init__(self, sampler, j):
+        self.sampler = sampler
+        self.j = j
+
+    def __enter__(self):
+        self.sampler.add(self.j)
+        return self
+
+    def __exit__(self, *_):
+        self.sampler.discard(self.j)
+
+
+def _psi_of(resource):
+    """
+    Return: the `avg10` value of the `some` line of /proc/pressure/`resource` or `None` if unavailable.
+    """
+    try:
+        with open(f"/proc/pressure/{resource}") as fp:
+            for l in fp:
+                if l.startswith("some "):
+                    for field in l.split()[1:]:
+                        k, _, v = field.partition("=")
+                        if k == "avg10":
+                            return float(v)
+    except OSError:
+        pass
+    return None
+
+
+class _ProcessPool:
+    """
+    A pool of forked worker processes to run the functions of `@file(executor="process")` jobs.
+    Functions are not pickled: a worker process looks up the job inherited from the parent process by its ID.
+    The worker processes are forked once by `start` before the build runs any job, so that no lock is held by a running job at the fork.
+    Jobs declared after the fork are unknown to the worker processes and rejected.
+    """
+
+    def __init__(self, n_max):
+        self._n_max = n_max
+        self._lock = threading.Lock()
+        self._jobs = []
+        self._started = False
+        self._pool = None
+
+    def register(self, j):
+        """
+        Return: the ID of `j` in the worker processes.
+        """
+        with self._lock:
+            if self._started:
+                raise exception.Err(
+                    f"A job with executor=\"process\" is declared after the worker processes are forked: {j}"
+                )
+            self._jobs.append(j)
+            return len(self._jobs) - 1
+
+    def start(self):
+        """
+        Fork the worker processes if a job is registered.
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            if self._jobs:
+                # `multiprocessing.Pool` forks all the workers in the constructor.
+                self._pool = multiprocessing.get_context("fork").Pool(
+                    self._n_max, _init_process_worker, (self._jobs,)
+                )
+
+    def run(self, j):
+        with self._lock:
+            pool = self._pool
+        if pool is None:
+            raise exception.Err(f"The worker processes are not forked: {j}")
+        return pool.apply(_run_process_job, (j._process_job_id, j.ts, j.ds, j.data))
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
+
+
+_process_jobs = None
+
+
+def _init_process_worker(jobs):
+    # This function runs in a worker process of `_ProcessPool`.
+    global _process_jobs
+    _process_jobs = jobs
+
+
+def _run_process_job(process_job_id, ts, ds, data):
+    # This function runs in a worker process of `_ProcessPool`.
+    j = _process_jobs[process_job_id]
+    j.ts, j.ds, j.data = ts, ds, data
+    j.f(j)
 
 
 class _WithMeta:
@@ -787,6 +3108,110 @@ def _parse_argv(argv, buildpy_dir=".buildpy"):
         default=float("inf"),
         help="No new job is started if there are other running jobs and the load average is higher than the specified value.",
     )
+    parser.add_argument(
+        "--resource",
+        action="append",
+        default=[],
+        metavar="NAME=CAPACITY",
+        help="Capacity of a resource consumed by jobs declared with `resources=`. You can specify --resource multiple times.",
+    )
+    parser.add_argument(
+        "--fair_share",
+        type=_bool_of_str,
+        default=False,
+        help="Share worker threads among the `key`s of ready jobs in proportion to --key_weight, instead of running the jobs in the order of their priorities only.",
+    )
+    parser.add_argument(
+        "--key_weight",
+        action="append",
+        default=[],
+        metavar="KEY=WEIGHT",
+        help="Weight of the jobs declared with `key=KEY` for --fair_share. The default weight is 1. You can specify --key_weight multiple times.",
+    )
+    parser.add_argument(
+        "--key_cap",
+        action="append",
+        default=[],
+        metavar="KEY=N",
+        help="Maximum number of running jobs declared with `key=KEY` for --fair_share. You can specify --key_cap multiple times.",
+    )
+    parser.add_argument(
+        "--work_stealing",
+        type=_bool_of_str,
+        default=False,
+        help="Use a heap of ready jobs per worker thread with work stealing instead of a shared queue. A job tends to run on the worker that ran its last dependency.",
+    )
+    parser.add_argument(
+        "--worker_idle_timeout",
+        type=float,
+        default=10.0,
+        help="Seconds for which an idle worker thread waits for a new job before exiting.",
+    )
+    parser.add_argument(
+        "--pressure_cpu",
+        type=float,
+        default=float("inf"),
+        help="No new job is started if there are other running jobs and the `some avg10` value of /proc/pressure/cpu is higher than the specified percentage.",
+    )
+    parser.add_argument(
+        "--pressure_memory",
+        type=float,
+        default=float("inf"),
+        help="Same as --pressure_cpu but for /proc/pressure/memory.",
+    )
+    parser.add_argument(
+        "--pressure_io",
+        type=float,
+        default=float("inf"),
+        help="Same as --pressure_cpu but for /proc/pressure/io.",
+    )
+    parser.add_argument(
+        "--pressure_interval",
+        type=float,
+        default=0.5,
+        help="Interval in seconds to sample the load average and the pressure.",
+    )
+    parser.add_argument(
+        "--memory_admission",
+        type=_bool_of_str,
+        default=False,
+        help="Start a job only if the available memory covers its estimated peak RSS (see `memory` of `DSL.file`), unless no other job is running. The peak RSS of the jobs is sampled and recorded in executed.jsonl only with this option.",
+    )
+    parser.add_argument(
+        "--memory_margin",
+        type=float,
+        default=0.1,
+        help="Fraction of the estimated peak RSS of a job to add for the memory-aware admission.",
+    )
+    parser.add_argument(
+        "--rss_interval",
+        type=float,
+        default=0.5,
+        help="Interval in seconds to sample the RSS of the processes started by jobs for --memory_admission.",
+    )
+    parser.add_argument(
+        "--async_subprocesses",
+        type=int,
+        default=None,
+        help="Number of parallel subprocesses started by `DSL.ash` in `async def` jobs. Defaults to --jobs.",
+    )
+    parser.add_argument(
+        "--coordinator",
+        default=None,
+        metavar="HOST:PORT",
+        help=f"Listen to workers ({os.path.basename(sys.executable)} -m {__name__} worker HOST:PORT) to run shell commands of `@file(remote=True)` jobs. Each remote command occupies a job slot of --jobs while it runs. Workers must present the token of --coordinator_token_file. Do not expose the port outside of a trusted network since commands are sent in plaintext.",
+    )
+    parser.add_argument(
+        "--coordinator_token_file",
+        default=None,
+        help=f"File of the token shared with workers. Defaults to ${_remote.TOKEN_ENV}.",
+    )
+    parser.add_argument(
+        "--remote_env",
+        nargs="*",
+        default=list(_remote.ENV_NAMES),
+        help="Environment variables forwarded to workers for shell commands of `@file(remote=True)` jobs.",
+    )
     parser.add_argument(
         "-k",
         "--keep-going",
@@ -825,15 +3250,102 @@ def _parse_argv(argv, buildpy_dir=".buildpy"):
         help=f"Print dependencies in the JSON format, then exit. {os.path.basename(sys.executable)} build.py -J | jq .",
     )
     parser.add_argument(
-        "-n", "--dry-run", action="store_true", default=False, help="Dry-run."
+        "--dependencies-ndjson",
+        type=str,
+        const="/dev/stdout",
+        nargs="?",
+        help=f"Print dependencies in the newline-delimited JSON format, a job per line, then exit. {os.path.basename(sys.executable)} build.py --dependencies-ndjson | jq -c .ts_unique",
+    )
+    parser.add_argument(
+        "--affected-by",
+        nargs="+",
+        metavar="PATH",
+        help="Print the targets that would be remade if PATHs were modified, then exit.",
+    )
+    parser.add_argument(
+        "--why",
+        metavar="TARGET",
+        help="Print why TARGET would be remade by following the dependencies that would be made down to the job whose timestamps are stale, then exit.",
+    )
+    parser.add_argument(
+        "--check-graph",
+        action="store_true",
+        default=False,
+        help="Check that there is no circular dependency, then exit.",
+    )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        default=False,
+        help="Print the jobs that would run in a topological order without running them. Only the timestamps are checked, in parallel by --stat_threads threads.",
+    )
+    parser.add_argument(
+        "--stat_threads",
+        type=int,
+        default=16,
+        help="Number of threads to check the timestamps for --dry-run and to prefetch them by --prefetch_mtimes.",
+    )
+    parser.add_argument(
+        "--prefetch_mtimes",
+        type=_bool_of_str,
+        default=False,
+        help="Check the timestamps of the source files reachable from the targets by listing their directories in parallel before running the jobs or --dry-run. This pays off on a network file system with many source files per directory.",
+    )
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        default=False,
+        help="Print why each job would run before the job for --dry-run.",
     )
     parser.add_argument(
         "--cut",
         action="append",
-        help="Cut the DAG at the job of the specified resource. You can specify --cut=target multiple times.",
+        help="Cut the DAG at the job of the specified resource, which is treated as a given leaf: the job and the jobs upstream of it are neither checked nor run. You can specify --cut=target multiple times.",
     )
     parser.add_argument("--use_hash", type=_bool_of_str, default=True)
-    parser.add_argument("--terminate_subprocesses", type=_bool_of_str, default=True)
+    parser.add_argument(
+        "--terminate_subprocesses",
+        type=_bool_of_str,
+        default=True,
+        help="On an error or an interrupt, send SIGTERM to the processes started by `sh` and `ash` in the running jobs (with their process groups or descendants) and SIGKILL after --kill_grace_period, and then SIGTERM to the other subprocesses.",
+    )
+    parser.add_argument(
+        "--process_group",
+        type=_bool_of_str,
+        default=False,
+        help="Start each command of `sh` and `ash` in its own process group, which is killed as a whole with its background processes. Ctrl-C is forwarded to the groups, but the commands should not read the terminal.",
+    )
+    parser.add_argument(
+        "--speculate",
+        type=_bool_of_str,
+        default=False,
+        help="Start a second copy of a slow job declared with `idempotent=True` (see `DSL.file`).",
+    )
+    parser.add_argument(
+        "--speculate_factor",
+        type=float,
+        default=3.0,
+        help="A speculative copy starts if an idempotent job runs longer than this factor times its median duration in the previous runs.",
+    )
+    parser.add_argument(
+        "--speculate_interval",
+        type=float,
+        default=0.5,
+        help="Interval in seconds to check for an idle worker thread to start a speculative copy.",
+    )
+    parser.add_argument(
+        "--retry_backoff",
+        type=float,
+        default=1.0,
+        help="Seconds to wait before the first retry of a job declared with `retries=`. The wait doubles for each retry.",
+    )
+    parser.add_argument(
+        "--kill_grace_period",
+        type=float,
+        default=5.0,
+        help="Seconds to wait for the processes to exit after SIGTERM.",
+    )
     parser.add_argument(
         "--id",
         default=(
@@ -855,21 +3367,72 @@ def _parse_argv(argv, buildpy_dir=".buildpy"):
         default=_convenience.jp(buildpy_dir, "resource_hash"),
         help="Directory to store resource hash values.",
     )
+    parser.add_argument(
+        "--resource_hash_backend",
+        default="files",
+        choices=["files", "sqlite"],
+        help="files: a JSON file per resource under --resource_hash_dir. sqlite: a single SQLite database in --resource_hash_dir (see `python -m buildpy.vx migrate-hash-cache`).",
+    )
     parser.add_argument(
         "--auto_prefix",
         default=_convenience.jp(buildpy_dir, "auto"),
         help="Directory to store automatically named resources.",
     )
+    parser.add_argument(
+        "--engine",
+        default="coroutine",
+        choices=["coroutine", "counter"],
+        help="How to walk the dependency graph. `coroutine` waits for the dependencies of each job in a coroutine. `counter` computes the subgraph reachable from the targets once and starts a job when the counter of its unfinished dependencies reaches zero, which is faster for large graphs with shared dependencies.",
+    )
+    parser.add_argument(
+        "--schedule",
+        default="priority",
+        choices=["priority", "critical-path"],
+        help="Order of ready jobs. `critical-path` runs jobs on the longest remaining path first (ties of `priority` only), estimating durations from the previous execution logs.",
+    )
+    parser.add_argument(
+        "--schedule_fallback_duration",
+        type=float,
+        default=1.0,
+        help="Estimated duration in seconds of a job that has not been executed before.",
+    )
+    parser.add_argument(
+        "--history_runs",
+        type=int,
+        default=10,
+        help="Number of the previous runs in the parent directory of the execution log directory to estimate job statistics.",
+    )
     parser.add_argument("--message", default="", help="Message.")
     args = parser.parse_args(argv)
     assert args.jobs > 0
     assert args.n_serial > 0
     assert args.load_average > 0
+    assert args.worker_idle_timeout >= 0
+    assert args.pressure_cpu >= 0
+    assert args.pressure_memory >= 0
+    assert args.pressure_io >= 0
+    assert args.pressure_interval > 0
+    assert args.memory_margin >= 0
+    assert args.rss_interval > 0
+    assert args.kill_grace_period >= 0
+    assert args.retry_backoff >= 0
+    assert args.speculate_factor > 0
+    assert args.speculate_interval > 0
+    assert args.schedule_fallback_duration >= 0
+    assert args.history_runs >= 0
+    if args.async_subprocesses is None:
+        args.async_subprocesses = args.jobs
+    assert args.async_subprocesses > 0
     if not args.targets:
         args.targets.append("all")
     if args.cut is None:
         args.cut = set()
     args.cut = sorted(set(args.cut))
+    args.resource = _capacities_of_strs(args.resource)
+    args.key_weight = _capacities_of_strs(args.key_weight)
+    assert all(w > 0 for w in args.key_weight.values()), args.key_weight
+    args.key_cap = _capacities_of_strs(args.key_cap)
+    assert not (args.fair_share and args.work_stealing)
     if args.execution_log_dir is None:
         args.execution_log_dir = _convenience.jp(buildpy_dir, "log", args.id)
     return args
@@ -883,68 +3446,208 @@ def _print_descriptions(jobs):
                 print("\t", l, sep="")
 
 
+def _path_key(uri):
+    """
+    Return: `uri` with a normalized path if it is a local path.
+
+    >>> _path_key("./src/../a")
+    'a'
+    >>> _path_key("s3://bucket/a")
+    's3://bucket/a'
+    """
+    if "://" in uri:
+        return uri
+    return os.path.normpath(uri)
+
+
+def _str_of_cycles(cycles):
+    """
+    >>> _str_of_cycles([dict(path=["a", "b", "a"], targets=["a", "b", "c"])]).splitlines()
+    ['Circular dependencies detected in 1 groups of jobs:', 'a -> b -> a', '\\ta', '\\tb', '\\tc']
+    """
+    lines = [f"Circular dependencies detected in {len(cycles)} groups of jobs:"]
+    for cycle in cycles:
+        lines.append(" -> ".join(cycle["path"]))
+        lines.extend("\t" + t for t in cycle["targets"])
+    return "\n".join(lines)
+
+
 def _print_dependencies(jobs):
-    # sorted(j.ts_unique) is used to make the output deterministic
-    for j in sorted(jobs, key=lambda j: j.ts_unique):
+    for j in _sorted_jobs(jobs):
         j.write()
 
 
-def _dependencies_dot_of(jobs):
-    data = json.loads(_dependencies_json_of(jobs))
-    fp = io.StringIO()
-    node_of_name = dict()
-    i = 0
-    i_cluster = 0
-
+def _write_dependencies_dot(jobs, fp):
+    """
+    Jobs are written one by one, and a resource is named by its escaped name not to keep a table of the resources.
+
+    >>> _write_dependencies_dot([types.SimpleNamespace(ts_unique=["a", "b"], ds_unique=["c"])], sys.stdout)
+    digraph G{
+    n1[label="○"]
+    "r:a"[label="a"]
+    "r:a" -> n1
+    "r:b"[label="b"]
+    "r:b" -> n1
+    subgraph cluster_1{
+    "r:a"
+    "r:b"
+    }
+    "r:c"[label="c"]
+    n1 -> "r:c"
+    }
+    """
     print("digraph G{", file=fp)
-    for datum in data:
-        i += 1
-        i_cluster += 1
+    for i, j in enumerate(_sorted_jobs(jobs), 1):
         action_node = "n" + str(i)
         print(action_node + '[label="○"]', file=fp)
-
-        for name in sorted(datum["ts_unique"]):
-            node, i = _node_of(name, node_of_name, i)
+        for name in j.ts_unique:
+            node = _node_of(name)
             print(node + "[label=" + _escape(name) + "]", file=fp)
             print(node + " -> " + action_node, file=fp)
-
-        if len(datum["ts_unique"]) > 1:
-            print(f"subgraph cluster_{i_cluster}" "{", file=fp)
-            for name in sorted(datum["ts_unique"]):
-                print(node_of_name[name], file=fp)
+        if len(j.ts_unique) > 1:
+            print(f"subgraph cluster_{i}" "{", file=fp)
+            for name in j.ts_unique:
+                print(_node_of(name), file=fp)
             print("}", file=fp)
-
-        for name in sorted(datum["ds_unique"]):
-            node, i = _node_of(name, node_of_name, i)
+        for name in j.ds_unique:
+            node = _node_of(name)
             print(node + "[label=" + _escape(name) + "]", file=fp)
             print(action_node + " -> " + node, file=fp)
     print("}", end="", file=fp)
-    return fp.getvalue()
 
 
-def _dependencies_json_of(jobs):
+def _write_dependencies_json(jobs, fp):
+    """
+    Same as `json.dumps` of the list of the jobs without making the whole string.
+
+    >>> _write_dependencies_json([types.SimpleNamespace(ts_unique=["a"], ds_unique=["b"])], sys.stdout)
+    [{"ds_unique": ["b"], "ts_unique": ["a"]}]
+    """
+    fp.write("[")
+    sep = ""
+    for j in _sorted_jobs(jobs):
+        fp.write(sep)
+        fp.write(_json_of_job(j))
+        sep = ", "
+    fp.write("]")
+
+
+def _write_dependencies_ndjson(jobs, fp):
+    """
+    >>> _write_dependencies_ndjson([types.SimpleNamespace(ts_unique=["c"], ds_unique=[]), types.SimpleNamespace(ts_unique=["a"], ds_unique=["b"])], sys.stdout)
+    {"ds_unique": ["b"], "ts_unique": ["a"]}
+    {"ds_unique": [], "ts_unique": ["c"]}
+    """
+    for j in _sorted_jobs(jobs):
+        fp.write(_json_of_job(j))
+        fp.write("\n")
+
+
+def _sorted_jobs(jobs):
+    # sorted(j.ts_unique) is used to make the output deterministic
+    return sorted(jobs, key=lambda j: j.ts_unique)
+
+
+def _json_of_job(j):
     return json.dumps(
-        [
-            dict(ts_unique=j.ts_unique, ds_unique=j.ds_unique)
-            for j in sorted((j for j in jobs), key=lambda j: j.ts_unique)
-        ],
+        dict(ts_unique=j.ts_unique, ds_unique=j.ds_unique),
         ensure_ascii=False,
         sort_keys=True,
     )
 
 
-def _node_of(name, node_of_name, i):
-    if name in node_of_name:
-        node = node_of_name[name]
-    else:
-        i += 1
-        node = "n" + str(i)
-        node_of_name[name] = node
-    return node, i
+def _node_of(name):
+    # The prefix distinguishes the resources from the action nodes `n1`, `n2`, ...
+    return _escape("r:" + name)
+
+
+def _output_of(path):
+    """
+    Return: a context manager of the file object to write to `path`, which does not close `sys.stdout`.
+    """
+    if path == "/dev/stdout":
+        return contextlib.nullcontext(sys.stdout)
+    return open(path, "w")
 
 
 def _escape(s: str):
-    return '"' + "".join('\\"' if x == '"' else x for x in s) + '"'
+    r"""
+    Quote `s` as an ID or a label of DOT.
+
+    >>> print(_escape('a"b\\c\nd'))
+    "a\"b\\c\nd"
+    """
+    return (
+        '"'
+        + s.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        + '"'
+    )
+
+
+def _uses_history(args):
+    return args.schedule == "critical-path" or args.memory_admission or args.speculate
+
+
+def _history_dirs_of(execution_log_dir, n):
+    """
+    Return: at most `n` execution log directories sharing the parent directory with `execution_log_dir` (including itself), the newest last.
+    """
+    if not execution_log_dir:
+        return []
+    parent = _convenience.dirname(os.path.normpath(execution_log_dir))
+    ts_dirs = []
+    try:
+        it = os.scandir(parent)
+    except OSError:
+        return []
+    with it:
+        for entry in it:
+            try:
+                if entry.is_dir():
+                    t = os.path.getmtime(_convenience.jp(entry.path, "executed.jsonl"))
+                    ts_dirs.append((t, entry.path))
+            except OSError:
+                pass
+    return [d for _, d in sorted(ts_dirs)[-n:]] if n > 0 else []
+
+
+def _set_critical_paths(jobs, history, fallback_duration):
+    """
+    Set `j.critical_path` to the estimated duration of the longest path from the start of `j` to the end of the run.
+    """
+    consumers_of = {j: [] for j in jobs}
+    for j in jobs:
+        for d in j.ds_unique:
+            try:
+                consumers_of[j.dsl.job_of_target[d]].append(j)
+            except KeyError:
+                pass
+    duration_of = dict()
+    for j in jobs:
+        dt = history.duration_of(j)
+        duration_of[j] = fallback_duration if dt is None else dt
+    # Iterative post-order DFS to support deep DAGs.
+    path_of = dict()
+    for root in jobs:
+        if root in path_of:
+            continue
+        stack = [(root, iter(consumers_of[root]))]
+        path_of[root] = None  # In progress.
+        while stack:
+            j, it = stack[-1]
+            for c in it:
+                if c not in path_of:
+                    path_of[c] = None
+                    stack.append((c, iter(consumers_of[c])))
+                    break
+            else:
+                stack.pop()
+                # `None` means a circular dependency, which is reported by `DSL.cycles`.
+                path_of[j] = duration_of[j] + max(
+                    (path_of[c] or 0.0 for c in consumers_of[j]), default=0.0
+                )
+    for j, path in path_of.items():
+        j.critical_path = path
 
 
 def _mtime_of(uri, use_hash, credential, resource_hash_dir):
@@ -989,6 +3692,25 @@ def _event_loop_of():
 
 
 def _prepend_prefix(prefix, x):
+    return _map_leaves(functools.partial(_convenience.jp, prefix), x)
+
+
+def _speculative_path_of(path, i):
+    """
+    >>> _speculative_path_of("a/b.txt", 1)
+    'a/.b.txt.buildpy-speculative-1'
+    """
+    return os.path.join(
+        os.path.dirname(path), f".{os.path.basename(path)}.buildpy-speculative-{i}"
+    )
+
+
+def _map_leaves(f, x):
+    """
+    >>> _map_leaves(str.upper, dict(a=["b", argparse.Namespace(c="d")]))
+    {'a': ['B', Namespace(c='D')]}
+    """
+
     def impl(x):
         if isinstance(x, _WithMeta):
             return _WithMeta(impl(x.val), **x.meta)
@@ -999,16 +3721,23 @@ def _prepend_prefix(prefix, x):
         elif isinstance(x, argparse.Namespace):
             return argparse.Namespace(**impl(vars(x)))
         else:
-            return _convenience.jp(prefix, x)
+            return f(x)
 
     return impl(x)
 
 
 def _de_with_meta(metadata, x):
+    """
+    Strip `_WithMeta` from `x` recording the metadata to `metadata`.
+    Strings are interned to share a target with the dependencies referring to it.
+    """
+
     def impl(x):
         if isinstance(x, _WithMeta):
             metadata[x.val] = x.meta
-            return x.val
+            return impl(x.val)
+        elif type(x) is str:
+            return sys.intern(x)
         elif isinstance(x, list):
             return [impl(v) for v in x]
         elif isinstance(x, dict):
@@ -1044,11 +3773,105 @@ def _coalesce(x: typing.Optional[T1], default: T1):
     return default if x is None else x
 
 
-def _contains(v, c):
-    if c:
-        return (c[0] == v) or _contains(v, c[1])
-    else:
-        return False
+def _exists(uri):
+    """
+    Return: `False` if `uri` is a local file that does not exist.
+    Other resources are assumed to exist.
+    """
+    puri = _convenience.uriparse(uri)
+    return puri.scheme != "file" or os.path.lexists(puri.path)
+
+
+def _strongly_connected_components(nodes, children_of):
+    """
+    Tarjan's algorithm without recursion.
+    Return: the strongly connected components in the reverse topological order.
+
+    >>> g = dict(a=["b"], b=["c", "d"], c=["a"], d=[], e=["e", "a"])
+    >>> _strongly_connected_components(g, g.__getitem__)
+    [['d'], ['c', 'b', 'a'], ['e']]
+    """
+    index_of = dict()
+    low_of = dict()
+    stack = []
+    on_stack = set()
+    ret = []
+    for root in nodes:
+        if root in index_of:
+            continue
+        index_of[root] = low_of[root] = len(index_of)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(children_of(root)))]
+        while work:
+            v, it = work[-1]
+            for w in it:
+                if w not in index_of:
+                    index_of[w] = low_of[w] = len(index_of)
+                    stack.append(w)
+                    on_stack.add(w)
+                    work.append((w, iter(children_of(w))))
+                    break
+                elif w in on_stack and index_of[w] < low_of[v]:
+                    low_of[v] = index_of[w]
+            else:
+                work.pop()
+                low = low_of[v]
+                if work:
+                    u = work[-1][0]
+                    if low < low_of[u]:
+                        low_of[u] = low
+                if low == index_of[v]:
+                    component = []
+                    while True:
+                        w = stack.pop()
+                        on_stack.discard(w)
+                        component.append(w)
+                        if w == v:
+                            break
+                    ret.append(component)
+    return ret
+
+
+def _cycle_in(component, children_of):
+    """
+    Return: a cycle `[v, ..., v]` through the first node of a strongly connected component.
+
+    >>> g = dict(a=["b"], b=["c", "a"], c=["a"])
+    >>> _cycle_in(["a", "b", "c"], g.__getitem__)
+    ['a', 'b', 'a']
+    """
+    v = component[0]
+    members = set(component)
+    parent_of = {v: None}
+    q = collections.deque([v])
+    while q:
+        u = q.popleft()
+        for w in children_of(u):
+            if w == v:
+                path = [v]
+                while u is not None:
+                    path.append(u)
+                    u = parent_of[u]
+                return path[::-1]
+            if w in members and w not in parent_of:
+                parent_of[w] = u
+                q.append(w)
+    raise ValueError(f"No cycle in {component}")
+
+
+def _median_of(xs):
+    """
+    >>> _median_of([3, 1, 2])
+    2
+    >>> _median_of([4, 1, 2, 3])
+    2.5
+    """
+    xs = sorted(xs)
+    n = len(xs)
+    if n % 2 == 1:
+        return xs[n // 2]
+    return (xs[n // 2 - 1] + xs[n // 2]) / 2
 
 
 def _set_unique(d: typing.MutableMapping[TK, TV], k: TK, v: TV):
@@ -1064,6 +3887,21 @@ def _cdotify(xs):
     return xs
 
 
+def _capacities_of_strs(xs):
+    """
+    >>> _capacities_of_strs(["mem_gb=256", "db=4", "mem_gb=128"])
+    {'mem_gb': 128.0, 'db': 4.0}
+    """
+    ret = dict()
+    for x in xs:
+        k, sep, v = x.partition("=")
+        if not (k and sep):
+            raise ValueError(f"Unsupported NAME=VALUE: {x}")
+        ret[k] = float(v)
+        assert ret[k] >= 0, x
+    return ret
+
+
 def _bool_of_str(x):
     if x == "True":
         return True
@@ -0,0 +1,90 @@
+import argparse
+import os
+import sys
+
+from . import _remote
+from . import resource
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog=f"{os.path.basename(sys.executable)} -m {__package__}",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    worker_parser = subparsers.add_parser(
+        "worker",
+        help="Run shell commands of `@file(remote=True)` jobs for a coordinator (`build.py --coordinator=HOST:PORT`).",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    worker_parser.add_argument("address", help="HOST:PORT of the coordinator.")
+    worker_parser.add_argument(
+        "--slots",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of commands to run in parallel.",
+    )
+    worker_parser.add_argument(
+        "--name", default=None, help="Name of the worker. Defaults to HOSTNAME:PID."
+    )
+    worker_parser.add_argument(
+        "--token_file",
+        default=None,
+        help=f"File of the token shared with the coordinator. Defaults to ${_remote.TOKEN_ENV}.",
+    )
+    worker_parser.add_argument(
+        "--connect_timeout",
+        type=float,
+        default=60.0,
+        help="Seconds to retry connecting to the coordinator.",
+    )
+
+    migrate_parser = subparsers.add_parser(
+        "migrate-hash-cache",
+        help="Copy the JSON files of hash caches under RESOURCE_HASH_DIR into the SQLite database of `build.py --resource_hash_backend=sqlite`.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    migrate_parser.add_argument(
+        "resource_hash_dir",
+        nargs="?",
+        default=os.path.join(".buildpy", "resource_hash"),
+        help="--resource_hash_dir of `build.py`.",
+    )
+    migrate_parser.add_argument(
+        "--remove",
+        action="store_true",
+        help="Remove the JSON files after the migration.",
+    )
+    migrate_parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=10000,
+        help="Number of records committed in a transaction.",
+    )
+
+    args = parser.parse_args(argv[1:])
+    if args.command == "worker":
+        assert args.slots > 0
+        host, port = _remote.address_of(args.address)
+        _remote.worker_main(
+            host,
+            port,
+            args.slots,
+            _remote.token_of(args.token_file),
+            name=args.name,
+            connect_timeout=args.connect_timeout,
+        )
+    elif args.command == "migrate-hash-cache":
+        path = resource.sqlite_path_of(args.resource_hash_dir)
+        n = resource.migrate_hash_time_cache(
+            args.resource_hash_dir,
+            resource.SQLiteHashTimeCache(path, batch_size=args.batch_size),
+            remove=args.remove,
+        )
+        print(f"Migrated {n} hash caches to {path}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -1,4 +1,6 @@
 import argparse
+import asyncio
+import contextvars
 import dataclasses
 import hashlib
 import inspect
@@ -6,13 +8,22 @@ import io
 import itertools
 import os
 import shutil
+import signal
 import subprocess
 import sys
+import threading
+import time
 import urllib
 
+import psutil
+
 from .. import exception
 from .._log import logger
 
+_tls = threading.local()
+_processes = contextvars.ContextVar("processes", default=None)
+_new_process_group = contextvars.ContextVar("new_process_group", default=False)
+
 
 @dataclasses.dataclass
 class _URI:
@@ -152,7 +163,7 @@ def sh(
 ):
     if not quiet:
         print(s, file=sys.stderr)
-    return subprocess.run(
+    return _run(
         s,
         check=check,
         encoding=encoding,
@@ -164,6 +175,239 @@ def sh(
     )
 
 
+async def ash(
+    s,
+    check=True,
+    encoding="utf-8",
+    env=None,
+    executable="/bin/bash",
+    input=None,
+    capture_output=False,
+    cwd=None,
+    quiet=False,
+):
+    """
+    Coroutine version of `sh` based on `asyncio.create_subprocess_shell`.
+    """
+    if not quiet:
+        print(s, file=sys.stderr)
+    pipe = asyncio.subprocess.PIPE
+    p = await asyncio.create_subprocess_shell(
+        s,
+        stdin=None if input is None else pipe,
+        stdout=pipe if capture_output else None,
+        stderr=pipe if capture_output else None,
+        env=env,
+        cwd=cwd,
+        executable=executable,
+        **(_process_group_kwargs() if _new_process_group.get() else dict()),
+    )
+    processes = _processes.get()
+    if processes is not None:
+        processes.add(p)
+    try:
+        if input is not None and encoding:
+            input = input.encode(encoding)
+        stdout, stderr = await p.communicate(input)
+    except BaseException:  # Includes `asyncio.CancelledError`.
+        p.kill()
+        raise
+    finally:
+        if processes is not None:
+            processes.discard(p)
+    if encoding:
+        if stdout is not None:
+            stdout = stdout.decode(encoding)
+        if stderr is not None:
+            stderr = stderr.decode(encoding)
+    if check and p.returncode:
+        raise subprocess.CalledProcessError(
+            p.returncode, s, output=stdout, stderr=stderr
+        )
+    return subprocess.CompletedProcess(s, p.returncode, stdout, stderr)
+
+
+class observe_processes:
+    """
+    Add processes started by `sh` or `ash` in the current context (a thread or an asyncio task) to `processes` (a `set`) while they are running.
+    With `new_process_group`, each process is started in its own process group, which does not receive SIGINT from the terminal and should not read the terminal.
+    """
+
+    __slots__ = ["token", "token_new_process_group", "processes", "new_process_group"]
+
+    def __init__(self, processes, new_process_group=False):
+        self.token = None
+        self.token_new_process_group = None
+        self.processes = processes
+        self.new_process_group = new_process_group
+
+    def __enter__(self):
+        self.token = _processes.set(self.processes)
+        self.token_new_process_group = _new_process_group.set(self.new_process_group)
+        return self
+
+    def __exit__(self, *_):
+        _new_process_group.reset(self.token_new_process_group)
+        _processes.reset(self.token)
+
+
+class run_remotely:
+    """
+    Run commands of `sh` in the current thread by `run`, which has the same interface as `subprocess.run`.
+    """
+
+    __slots__ = ["old", "run"]
+
+    def __init__(self, run):
+        self.old = None
+        self.run = run
+
+    def __enter__(self):
+        self.old = getattr(_tls, "run", None)
+        _tls.run = self.run
+        return self
+
+    def __exit__(self, *_):
+        _tls.run = self.old
+
+
+def _run(
+    *popenargs, input=None, capture_output=False, timeout=None, check=False, **kwargs
+):
+    """
+    `subprocess.run` that reports the started process to `observe_processes`.
+    """
+    run = getattr(_tls, "run", None)
+    if run is not None:
+        return run(
+            *popenargs,
+            input=input,
+            capture_output=capture_output,
+            timeout=timeout,
+            check=check,
+            **kwargs,
+        )
+    if input is not None:
+        kwargs["stdin"] = subprocess.PIPE
+    if capture_output:
+        kwargs["stdout"] = subprocess.PIPE
+        kwargs["stderr"] = subprocess.PIPE
+    processes = _processes.get()
+    if _new_process_group.get() and not (
+        "start_new_session" in kwargs or "process_group" in kwargs
+    ):
+        kwargs.update(_process_group_kwargs())
+    with subprocess.Popen(*popenargs, **kwargs) as process:
+        if processes is not None:
+            processes.add(process)
+        try:
+            stdout, stderr = process.communicate(input, timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            process.kill()
+            e.stdout, e.stderr = process.communicate()
+            raise
+        except:
+            process.kill()
+            raise
+        finally:
+            if processes is not None:
+                processes.discard(process)
+        retcode = process.poll()
+        if check and retcode:
+            raise subprocess.CalledProcessError(
+                retcode, process.args, output=stdout, stderr=stderr
+            )
+    return subprocess.CompletedProcess(process.args, retcode, stdout, stderr)
+
+
+def _process_group_kwargs():
+    """
+    Return: keyword arguments of `subprocess.Popen` to start a process in its own process group, which is killed by `kill_process_groups`.
+    """
+    if sys.version_info >= (3, 11):
+        return dict(process_group=0)
+    return dict(start_new_session=True)
+
+
+def kill_process_groups(processes, grace_period):
+    """
+    Send SIGTERM to `processes`, and then SIGKILL to those remaining after `grace_period` seconds.
+    A process leading its own process group is signaled with the group, and the other processes with their descendants.
+    """
+    pgids = set()
+    trees = []
+    for p in processes:
+        if _leads_process_group(p.pid):
+            try:
+                os.killpg(p.pid, signal.SIGTERM)
+            except OSError:
+                continue
+            pgids.add(p.pid)
+        else:
+            try:
+                root = psutil.Process(p.pid)
+                tree = [root] + root.children(recursive=True)
+            except psutil.Error:
+                continue
+            for x in tree:
+                try:
+                    x.terminate()
+                except psutil.Error:
+                    pass
+            trees.extend(tree)
+    t_limit = time.time() + grace_period
+    while (pgids or trees) and time.time() < t_limit:
+        time.sleep(0.05)
+        pgids = {pgid for pgid in pgids if _process_group_exists(pgid)}
+        trees = [x for x in trees if _is_alive(x)]
+    for pgid in pgids:
+        logger.warning("Kill the process group %s", pgid)
+        try:
+            os.killpg(pgid, signal.SIGKILL)
+        except OSError:
+            pass
+    for x in trees:
+        logger.warning("Kill the process %s", x.pid)
+        try:
+            x.kill()
+        except psutil.Error:
+            pass
+
+
+def signal_process_groups(processes, signum):
+    """
+    Send `signum` to the process groups led by `processes`.
+    """
+    for p in processes:
+        if _leads_process_group(p.pid):
+            try:
+                os.killpg(p.pid, signum)
+            except OSError:
+                pass
+
+
+def _leads_process_group(pid):
+    try:
+        return os.getpgid(pid) == pid
+    except OSError:
+        return False
+
+
+def _process_group_exists(pgid):
+    try:
+        os.killpg(pgid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def _is_alive(p):
+    try:
+        return p.status() != psutil.STATUS_ZOMBIE
+    except psutil.Error:
+        return False
+
+
 def let(f):
     return f()
 
@@ -0,0 +1,344 @@
+"""
+Distributed execution of shell commands.
+
+A coordinator runs inside the event loop of a `DSL` instance and workers connect to it over TCP.
+Messages are JSON objects separated by newlines:
+
+    worker -> coordinator: {"type": "hello", "name": ..., "slots": ..., "token": ...}
+    coordinator -> worker: {"type": "run", "id": ..., "cmd": ..., "cwd": ..., "env": ..., "inherit_env": ..., "executable": ..., "timeout": ..., "ts": ..., "ds": ...}
+    worker -> coordinator: {"type": "done", "id": ..., "returncode": ..., "stdout": ..., "stderr": ..., "timed_out": ...}
+
+Resources are expected to be on a file system shared by the coordinator and the workers.
+
+A worker is accepted only if its hello has the token shared with the coordinator (`$BUILDPY_REMOTE_TOKEN` or a token file).
+Messages are neither encrypted nor authenticated after the hello, and a worker runs any command it is sent.
+Do not expose the port of the coordinator outside of a trusted network.
+Only the environment variables in `env_names` are forwarded to workers unless `env` is given explicitly.
+"""
+
+import asyncio
+import collections
+import hmac
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from .._log import logger
+from .. import exception
+
+
+TOKEN_ENV = "BUILDPY_REMOTE_TOKEN"
+ENV_NAMES = ("PATH", "HOME", "LANG", "LC_ALL", "TZ", "SHELL", "SHELLOPTS")
+
+
+def token_of(token_file=None):
+    """
+    Return: the shared secret in `token_file` or, if it is not given, `$BUILDPY_REMOTE_TOKEN`.
+    """
+    if token_file:
+        with open(token_file) as fp:
+            token = fp.read().strip()
+    else:
+        token = os.environ.get(TOKEN_ENV, "")
+    if not token:
+        raise exception.Err(
+            f"A token shared by the coordinator and the workers is required: set ${TOKEN_ENV} or give a token file"
+        )
+    return token
+
+
+class Coordinator:
+    def __init__(self, loop, host, port, token, env_names=ENV_NAMES):
+        self._loop = loop
+        self._token = token
+        self._env_names = env_names
+        self._ids = itertools.count(1)
+        self._pending = collections.deque()
+        self._workers = []
+        self._stats_of_name = dict()
+        self._server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self._handle, host, port), loop
+        ).result()
+
+    def address(self):
+        return self._server.sockets[0].getsockname()[:2]
+
+    def run(
+        self,
+        args,
+        input=None,
+        capture_output=False,
+        timeout=None,
+        check=False,
+        env=None,
+        cwd=None,
+        executable="/bin/bash",
+        shell=True,
+        encoding="utf-8",
+        universal_newlines=True,
+        j=None,
+        **kwargs,
+    ):
+        """
+        Run `args` on a worker.
+        This method has the same interface as `subprocess.run` and is called from a thread other than the event loop.
+        """
+        if not (shell and isinstance(args, str)):
+            raise NotImplementedError(
+                f"Only shell commands are supported for a remote execution: {args}"
+            )
+        if input is not None or kwargs:
+            raise NotImplementedError(
+                f"Unsupported arguments for a remote execution: input={input}, {kwargs}"
+            )
+        msg = dict(
+            type="run",
+            cmd=args,
+            cwd=os.path.abspath(os.getcwd() if cwd is None else cwd),
+            env=(
+                {k: os.environ[k] for k in self._env_names if k in os.environ}
+                if env is None
+                else dict(env)
+            ),
+            inherit_env=env is None,
+            executable=executable,
+            timeout=timeout,
+            ts=None if j is None else j.ts_unique,
+            ds=None if j is None else j.ds_unique,
+        )
+        result = asyncio.run_coroutine_threadsafe(
+            self._submit(msg), self._loop
+        ).result()
+        if result.get("timed_out"):
+            raise subprocess.TimeoutExpired(
+                args, timeout, output=result["stdout"], stderr=result["stderr"]
+            )
+        stdout, stderr = result["stdout"], result["stderr"]
+        if not capture_output:
+            sys.stdout.write(stdout)
+            sys.stderr.write(stderr)
+            stdout, stderr = None, None
+        elif not (universal_newlines or encoding):
+            stdout, stderr = stdout.encode(), stderr.encode()
+        if check and result["returncode"]:
+            raise subprocess.CalledProcessError(
+                result["returncode"], args, output=stdout, stderr=stderr
+            )
+        return subprocess.CompletedProcess(args, result["returncode"], stdout, stderr)
+
+    def close(self):
+        async def impl():
+            self._close()
+
+        asyncio.run_coroutine_threadsafe(impl(), self._loop).result()
+
+    def close_soon(self):
+        """
+        `close` without waiting for the event loop, which may be stopping.
+        """
+        self._loop.call_soon_threadsafe(self._close)
+
+    def _close(self):
+        self._server.close()
+        for w in self._workers:
+            w.writer.close()
+
+    def stats(self):
+        async def impl():
+            t_now = time.time()
+            ret = dict()
+            for name, st in self._stats_of_name.items():
+                t_end = t_now if st["t_disconnected"] is None else st["t_disconnected"]
+                busy = st["busy"] + sum(
+                    t_now - t_start for _, _, t_start in st["running"].values()
+                )
+                capacity = st["slots"] * (t_end - st["t_connected"])
+                ret[name] = dict(
+                    slots=st["slots"],
+                    n_done=st["n_done"],
+                    busy_seconds=busy,
+                    utilization=busy / capacity if capacity > 0 else 0.0,
+                )
+            return ret
+
+        return asyncio.run_coroutine_threadsafe(impl(), self._loop).result()
+
+    async def _submit(self, msg):
+        msg["id"] = next(self._ids)
+        future = self._loop.create_future()
+        self._pending.append((msg, future))
+        if not self._workers:
+            logger.warning("No worker is connected to run %s", msg["cmd"])
+        self._dispatch()
+        return await future
+
+    def _dispatch(self):
+        while self._pending:
+            w = max(self._workers, key=lambda w: w.n_free(), default=None)
+            if w is None or w.n_free() < 1:
+                return
+            msg, future = self._pending.popleft()
+            if future.cancelled():
+                continue
+            w.running[msg["id"]] = (msg, future, time.time())
+            w.writer.write(_encode(msg))
+
+    async def _handle(self, reader, writer):
+        try:
+            hello = json.loads(await reader.readline())
+            authenticated = (
+                hello["type"] == "hello"
+                and isinstance(hello.get("token"), str)
+                and hmac.compare_digest(hello["token"].encode(), self._token.encode())
+            )
+        except (ValueError, TypeError, KeyError):
+            authenticated = False
+        if not authenticated:
+            logger.warning(
+                "Rejected a worker from %s without a valid token",
+                writer.get_extra_info("peername"),
+            )
+            writer.close()
+            return
+        w = _Worker(hello["name"], hello["slots"], writer)
+        logger.info("Worker %s connected with %s slots", w.name, w.slots)
+        self._stats_of_name[w.name] = w.stats
+        self._workers.append(w)
+        self._dispatch()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                msg = json.loads(line)
+                assert msg["type"] == "done", msg
+                _, future, t_start = w.running.pop(msg["id"])
+                w.stats["busy"] += time.time() - t_start
+                w.stats["n_done"] += 1
+                if not future.cancelled():
+                    future.set_result(msg)
+                self._dispatch()
+        finally:
+            logger.info("Worker %s disconnected", w.name)
+            w.stats["t_disconnected"] = time.time()
+            self._workers.remove(w)
+            # Re-run the commands of the lost worker on other workers.
+            for msg, future, _ in reversed(list(w.running.values())):
+                self._pending.appendleft((msg, future))
+            w.running.clear()
+            self._dispatch()
+
+
+class _Worker:
+    def __init__(self, name, slots, writer):
+        self.name = name
+        self.slots = slots
+        self.writer = writer
+        self.running = dict()
+        self.stats = dict(
+            slots=slots,
+            n_done=0,
+            busy=0.0,
+            t_connected=time.time(),
+            t_disconnected=None,
+            running=self.running,
+        )
+
+    def n_free(self):
+        return self.slots - len(self.running)
+
+
+def worker_main(host, port, slots, token, name=None, connect_timeout=60.0):
+    name = f"{socket.gethostname()}:{os.getpid()}" if name is None else name
+    asyncio.run(_worker(host, port, slots, token, name, connect_timeout))
+
+
+async def _worker(host, port, slots, token, name, connect_timeout):
+    t_limit = time.time() + connect_timeout
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            break
+        except OSError:
+            if time.time() > t_limit:
+                raise
+            await asyncio.sleep(0.1)
+    writer.write(_encode(dict(type="hello", name=name, slots=slots, token=token)))
+    await writer.drain()
+    tasks = set()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            msg = json.loads(line)
+            assert msg["type"] == "run", msg
+            task = asyncio.ensure_future(_run(msg, writer, name))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        for task in tasks:
+            task.cancel()
+        writer.close()
+
+
+async def _run(msg, writer, name):
+    logger.info("%s", msg["cmd"])
+    p = await asyncio.create_subprocess_shell(
+        msg["cmd"],
+        cwd=msg["cwd"],
+        env={
+            **(os.environ if msg["inherit_env"] else dict()),
+            **msg["env"],
+            "BUILDPY_WORKER": name,
+        },
+        executable=msg["executable"],
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,
+    )
+    timed_out = False
+    try:
+        try:
+            stdout, stderr = await asyncio.wait_for(p.communicate(), msg["timeout"])
+        except asyncio.TimeoutError:
+            timed_out = True
+            p.kill()
+            stdout, stderr = await p.communicate()
+    except asyncio.CancelledError:
+        p.kill()
+        raise
+    writer.write(
+        _encode(
+            dict(
+                type="done",
+                id=msg["id"],
+                returncode=p.returncode,
+                stdout=stdout.decode(errors="replace"),
+                stderr=stderr.decode(errors="replace"),
+                timed_out=timed_out,
+            )
+        )
+    )
+    await writer.drain()
+
+
+def _encode(msg):
+    return (json.dumps(msg, ensure_ascii=False) + "\n").encode()
+
+
+def address_of(s):
+    """
+    >>> address_of("localhost:8080")
+    ('localhost', 8080)
+    >>> address_of("[::1]:8080")
+    ('::1', 8080)
+    """
+    host, _, port = s.rpartition(":")
+    if host.startswith("[") and host.endswith("]"):
+        host = host[1:-1]
+    return host, int(port)
@@ -97,6 +97,19 @@ class Cache:
                 self._data[k] = val
                 return val
 
+    def setdefault(self, k, val):
+        """
+        Set `val` to `k` unless `k` already has a value.
+        Return: the value of `k`.
+
+        >>> c = Cache()
+        >>> c.setdefault("a", 1)
+        1
+        >>> c.setdefault("a", 2)
+        1
+        """
+        return self.get(k, lambda: val)
+
 
 class TInt(TVal):
     def __init__(self, val):
@@ -118,6 +131,29 @@ class NonOverwritableDict(TDict):
                 raise Err(f"Tried to overwrite {k} with {v} for {self}")
             self.data[k] = v
 
+    def update_new(self, kvs):
+        """
+        Insert all `(k, v)` pairs of `kvs` with a single acquisition of the lock.
+        Nothing is inserted if any of the keys already exists.
+
+        >>> d = NonOverwritableDict()
+        >>> d.update_new([("a", 1), ("b", 2)])
+        >>> d.update_new([("c", 3), ("a", 4)])
+        Traceback (most recent call last):
+          ...
+        buildpy.vx._tval.Err: Tried to overwrite a with 4 for NonOverwritableDict({'a': 1, 'b': 2})
+        >>> d
+        NonOverwritableDict({'a': 1, 'b': 2})
+        """
+        kvs = list(kvs)
+        with self.lock:
+            new = dict()
+            for k, v in kvs:
+                if k in self.data or k in new:
+                    raise Err(f"Tried to overwrite {k} with {v} for {self}")
+                new[k] = v
+            self.data.update(new)
+
 
 class TListOf:
     def __init__(self):
@@ -151,6 +187,22 @@ class TListOf:
             else:
                 self.data[k] = [v]
 
+    def extend(self, kvs):
+        """
+        Append all `(k, v)` pairs of `kvs` with a single acquisition of the lock.
+
+        >>> l = TListOf()
+        >>> l.extend([("a", 1), ("b", 2), ("a", 3)])
+        >>> l
+        TListOf({'a': [1, 3], 'b': [2]})
+        """
+        with self.lock:
+            for k, v in kvs:
+                if k in self.data:
+                    self.data[k].append(v)
+                else:
+                    self.data[k] = [v]
+
     def get(self, k, default=None):
         with self.lock:
             return self.data.get(k, default)
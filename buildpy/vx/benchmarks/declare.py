@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+
+"""
+Benchmark of the declaration of a large number of file jobs.
+
+    PYTHONPATH=. python3 buildpy/vx/benchmarks/declare.py -n 10000 100000
+
+file: `DSL.file` called for each job.
+files: `DSL.files` called once for all jobs.
+Bytes per job are measured by the increase of the RSS of the process.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("-n", "--n_jobs", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--execution_log_dir", default="")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv[1:])
+    if args.child:
+        return child(args.child[0], int(args.child[1]), args)
+
+    print("method", "n_jobs", "seconds", "jobs/s", "bytes/job", sep="\t")
+    for n in args.n_jobs:
+        for method in ["file", "files"]:
+            results = [
+                json.loads(
+                    subprocess.run(
+                        [
+                            sys.executable,
+                            __file__,
+                            "--execution_log_dir",
+                            args.execution_log_dir,
+                            "--child",
+                            method,
+                            str(n),
+                        ],
+                        check=True,
+                        stdout=subprocess.PIPE,
+                        universal_newlines=True,
+                    ).stdout
+                )
+                for _ in range(args.repeat)
+            ]
+            r = min(results, key=lambda r: r["dt"])
+            print(
+                method,
+                n,
+                f"{r['dt']:.3f}",
+                f"{n / r['dt']:.0f}",
+                f"{r['rss'] / n:.0f}",
+                sep="\t",
+            )
+            sys.stdout.flush()
+
+
+def child(method, n, args):
+    import psutil
+
+    import buildpy.vx
+
+    dsl = buildpy.vx.DSL(
+        ["benchmark", "--execution_log_dir", args.execution_log_dir]
+    )
+    process = psutil.Process()
+
+    def f(j):
+        pass
+
+    rss1 = process.memory_info().rss
+    t1 = time.time()
+    if method == "file":
+        for i in range(n):
+            dsl.file([f"t{i}"], [f"t{i - 1}"] if i > 0 else [])(f)
+    elif method == "files":
+        dsl.files(
+            (
+                dict(targets=[f"t{i}"], deps=[f"t{i - 1}"] if i > 0 else [])
+                for i in range(n)
+            ),
+            f=f,
+        )
+    else:
+        raise ValueError(method)
+    dt = time.time() - t1
+    rss = process.memory_info().rss - rss1
+    dsl._join_execution_loggers()
+    json.dump(dict(dt=dt, rss=rss), sys.stdout)
+    sys.stdout.flush()
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+
+"""
+Benchmark of `--dry-run` of an up-to-date tree.
+
+    PYTHONPATH=. python3 buildpy/vx/benchmarks/dry_run.py -n 10000 100000
+
+`--n_jobs` file jobs, each of which depends on a source file and on the target of its parent in a binary tree, are made in a temporary directory.
+Then `--dry-run` is timed with `-j` threads for the timestamps.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("-n", "--n_jobs", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("-j", "--stat_threads", type=int, nargs="+", default=[1, 16])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args, rest = parser.parse_known_args(argv[1:])
+    if args.child is not None:
+        return child(args.child, rest)
+
+    print("n_jobs", "stat_threads", "seconds", "jobs/s", sep="\t")
+    for n in args.n_jobs:
+        with tempfile.TemporaryDirectory() as dir_:
+            cmd = [sys.executable, os.path.abspath(__file__), "--child", str(n)]
+            subprocess.run(
+                cmd + ["--use_hash", "False", "-j", "16"],
+                check=True,
+                cwd=dir_,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            for stat_threads in args.stat_threads:
+                dts = []
+                for _ in range(args.repeat):
+                    t1 = time.time()
+                    out = subprocess.run(
+                        cmd
+                        + [
+                            "--use_hash",
+                            "False",
+                            "--dry-run",
+                            "--stat_threads",
+                            str(stat_threads),
+                        ],
+                        check=True,
+                        cwd=dir_,
+                        stdout=subprocess.PIPE,
+                        universal_newlines=True,
+                    ).stdout
+                    dts.append(time.time() - t1)
+                    # Only the phony job would run.
+                    assert out.startswith("all\n") and out.count("\n\n") == 1, out
+                dt = min(dts)
+                print(n, stat_threads, f"{dt:.3f}", f"{n / dt:.0f}", sep="\t")
+                sys.stdout.flush()
+
+
+def child(n, argv):
+    import buildpy.vx
+
+    dsl = buildpy.vx.DSL(["benchmark"] + argv)
+
+    def f(j):
+        with open(j.ts[0], "w"):
+            pass
+
+    for i in range(n):
+        if not os.path.exists(f"s{i}"):
+            with open(f"s{i}", "w"):
+                pass
+    dsl.files(
+        (
+            dict(targets=[f"t{i}"], deps=[f"s{i}"] + ([f"t{(i - 1) // 2}"] if i else []))
+            for i in range(n)
+        ),
+        f=f,
+    )
+    dsl.phony("all", [f"t{i}" for i in range(n)])
+    dsl.run()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+
+"""
+Microbenchmark of `_ThreadPoolExecutor` and `_WorkStealingExecutor` for synthetic DAGs of no-op jobs.
+
+    PYTHONPATH=. python3 buildpy/vx/benchmarks/executor.py -j 1 4 16 64
+
+wide: `--width` independent jobs followed by a single job.
+deep: `--width` chains of `--depth` jobs.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("-j", "--jobs", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--width", type=int, default=2000)
+    parser.add_argument("--depth", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv[1:])
+    if args.child:
+        return child(args.child[0], int(args.child[1]), args.child[2], args)
+
+    print("dag", "jobs", "executor", "n_jobs", "seconds", "jobs/s", "stolen", sep="\t")
+    for dag in ["wide", "deep"]:
+        for n in args.jobs:
+            for work_stealing in ["False", "True"]:
+                results = [
+                    json.loads(
+                        subprocess.run(
+                            [
+                                sys.executable,
+                                __file__,
+                                "--width",
+                                str(args.width),
+                                "--depth",
+                                str(args.depth),
+                                "--child",
+                                dag,
+                                str(n),
+                                work_stealing,
+                            ],
+                            check=True,
+                            stdout=subprocess.PIPE,
+                            universal_newlines=True,
+                        ).stdout
+                    )
+                    for _ in range(args.repeat)
+                ]
+                r = min(results, key=lambda r: r["dt"])
+                print(
+                    dag,
+                    n,
+                    "work-stealing" if work_stealing == "True" else "thread-pool",
+                    r["n_jobs"],
+                    f"{r['dt']:.3f}",
+                    f"{r['n_jobs'] / r['dt']:.0f}",
+                    r["stats"].get("n_stolen", "-"),
+                    sep="\t",
+                )
+                sys.stdout.flush()
+
+
+def child(dag, n, work_stealing, args):
+    import buildpy.vx
+
+    dsl = buildpy.vx.DSL(
+        [
+            "benchmark",
+            f"-j{n}",
+            "--work_stealing",
+            work_stealing,
+            "--execution_log_dir",
+            "",
+        ]
+    )
+    if dag == "wide":
+        ts = [f"w{i}" for i in range(args.width)]
+        for t in ts:
+            dsl.phony(t, [])
+        dsl.phony("all", ts)
+    elif dag == "deep":
+        ts = []
+        for i in range(args.width // args.depth):
+            for k in range(args.depth):
+                dsl.phony(f"d{i}_{k}", [f"d{i}_{k - 1}"] if k > 0 else [])
+            ts.append(f"d{i}_{args.depth - 1}")
+        dsl.phony("all", ts)
+    else:
+        raise ValueError(dag)
+    n_jobs = len(set(dsl.job_of_target.values()))
+    t1 = time.time()
+    dsl.run()
+    dt = time.time() - t1
+    json.dump(dict(dt=dt, n_jobs=n_jobs, stats=dsl.stats()["executor"]), sys.stdout)
+    sys.stdout.flush()
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
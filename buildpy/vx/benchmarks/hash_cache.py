@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+"""
+Benchmark of the lookups of the hash caches of `--use_hash`.
+
+    PYTHONPATH=. python3 buildpy/vx/benchmarks/hash_cache.py -n 10000 100000
+
+`--n_files` empty files are made in directories of `--files_per_dir` files, and their hash caches are filled by the first `mtime_of` of each file.
+files: a JSON file per resource (`--resource_hash_backend=files`).
+sqlite: a single SQLite database (`--resource_hash_backend=sqlite`).
+fill/s: files per second for the first `mtime_of`, which hashes the file and writes the cache.
+lookups/s: files per second for `mtime_of` of each file in a random order, which reads the cache without hashing.
+batched/s: files per second for `LocalFile.mtimes_in_dir` of each directory.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("-n", "--n_files", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--files_per_dir", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv[1:])
+
+    from buildpy.vx import resource
+
+    print("backend", "n_files", "fill/s", "lookups/s", "batched/s", sep="\t")
+    for n in args.n_files:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths_of_dir = dict()
+            for i in range(n):
+                dir_ = os.path.join(tmp_dir, "src", str(i // args.files_per_dir))
+                if dir_ not in paths_of_dir:
+                    os.makedirs(dir_)
+                    paths_of_dir[dir_] = []
+                path = os.path.join(dir_, str(i))
+                open(path, "w").close()
+                paths_of_dir[dir_].append(path)
+            paths = [path for ps in paths_of_dir.values() for path in ps]
+            # Make the files older than the caches as after a build.
+            t = time.time() - 10
+            for path in paths:
+                os.utime(path, (t, t))
+
+            for backend in ["files", "sqlite"]:
+                resource_hash_dir = os.path.join(tmp_dir, backend)
+                if backend == "sqlite":
+                    resource.register_hash_time_cache(
+                        resource_hash_dir,
+                        resource.SQLiteHashTimeCache(
+                            resource.sqlite_path_of(resource_hash_dir)
+                        ),
+                    )
+
+                def mtime_of(path):
+                    return resource.LocalFile.mtime_of(
+                        path, None, True, resource_hash_dir
+                    )
+
+                dt_fill = _timeit(lambda: [mtime_of(path) for path in paths])
+                if backend == "sqlite":
+                    resource._hash_time_cache_of[resource_hash_dir].flush()
+                shuffled = random.sample(paths, len(paths))
+                dt_lookup = min(
+                    _timeit(lambda: [mtime_of(path) for path in shuffled])
+                    for _ in range(args.repeat)
+                )
+                dt_batched = min(
+                    _timeit(
+                        lambda: [
+                            resource.LocalFile.mtimes_in_dir(ps, True, resource_hash_dir)
+                            for ps in paths_of_dir.values()
+                        ]
+                    )
+                    for _ in range(args.repeat)
+                )
+                print(
+                    backend,
+                    n,
+                    f"{n / dt_fill:.0f}",
+                    f"{n / dt_lookup:.0f}",
+                    f"{n / dt_batched:.0f}",
+                    sep="\t",
+                )
+                sys.stdout.flush()
+
+
+def _timeit(f):
+    t1 = time.time()
+    f()
+    return time.time() - t1
+
+
+if __name__ == "__main__":
+    main(sys.argv)
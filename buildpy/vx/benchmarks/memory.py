@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+
+"""
+Benchmark of the memory used by declared jobs.
+
+    PYTHONPATH=. python3 buildpy/vx/benchmarks/memory.py -n 100000 --fan_in 0 1 4 16
+
+`--n_jobs` file jobs, each of which depends on `--fan_in` targets of the previous jobs, are declared and waited for by a phony job.
+Memory is measured by `tracemalloc` in a child process.
+bytes/job: bytes per job for the fan-in.
+bytes/edge: increase of bytes per job from the fan-in of 0 divided by the fan-in.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tracemalloc
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("-n", "--n_jobs", type=int, default=100000)
+    parser.add_argument("--fan_in", type=int, nargs="+", default=[0, 1, 4, 16])
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv[1:])
+    if args.child is not None:
+        return child(args.child, args)
+
+    print("n_jobs", "fan_in", "bytes/job", "bytes/edge", sep="\t")
+    bytes_per_job_0 = None
+    for fan_in in sorted(set([0] + args.fan_in)):
+        r = json.loads(
+            subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--n_jobs",
+                    str(args.n_jobs),
+                    "--child",
+                    str(fan_in),
+                ],
+                check=True,
+                stdout=subprocess.PIPE,
+                universal_newlines=True,
+            ).stdout
+        )
+        bytes_per_job = r["bytes"] / args.n_jobs
+        if fan_in == 0:
+            bytes_per_job_0 = bytes_per_job
+        print(
+            args.n_jobs,
+            fan_in,
+            f"{bytes_per_job:.0f}",
+            f"{(bytes_per_job - bytes_per_job_0) / fan_in:.0f}" if fan_in else "-",
+            sep="\t",
+        )
+        sys.stdout.flush()
+
+
+def child(fan_in, args):
+    import buildpy.vx
+
+    dsl = buildpy.vx.DSL(["benchmark"])
+    n = args.n_jobs
+
+    def f(j):
+        pass
+
+    tracemalloc.start()
+    dsl.files(
+        (
+            dict(targets=[f"t{i}"], deps=[f"t{i - k}" for k in range(1, fan_in + 1)])
+            for i in range(n)
+        ),
+        f=f,
+    )
+    dsl.phony("all", [f"t{i}" for i in range(n)])
+    json.dump(dict(bytes=tracemalloc.get_traced_memory()[0]), sys.stdout)
+    sys.stdout.flush()
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
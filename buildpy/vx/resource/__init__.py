@@ -1,9 +1,11 @@
 import abc
+import atexit
 import fcntl
 import functools
 import json
 import mmap
 import os
+import sqlite3
 import threading
 import time
 
@@ -57,6 +59,71 @@ class LocalFile(Resource):
             t_uri, functools.partial(_hash_of_path, puri.uri), puri, resource_hash_dir
         )
 
+    @classmethod
+    def mtimes_in_dir(cls, paths, use_hash, resource_hash_dir):
+        """
+        Batched `mtime_of` for the local `paths` in the same directory.
+        The directory is listed once by `os.scandir` instead of looking up each path, and so is the directory of the hash caches with `use_hash`.
+        == Returns
+        * A dict from a path to `mtime_of` of it. Paths that could not be checked are omitted.
+        """
+        name_of = {
+            path: os.path.basename(path)
+            for path in paths
+            if os.path.basename(path) not in ("", ".", "..")
+        }
+        if not name_of:
+            return dict()
+        dir_ = os.path.dirname(next(iter(name_of)))
+        t_uri_of = _mtimes_in(dir_, set(name_of.values()))
+        if not use_hash:
+            return {
+                path: t_uri_of[name]
+                for path, name in name_of.items()
+                if name in t_uri_of
+            }
+        hash_time_cache = _hash_time_cache_of.get(resource_hash_dir)
+        if hash_time_cache is not None:
+            key_of = {
+                path: _hash_time_cache_key_of(cls.scheme, "localhost", path)
+                for path, name in name_of.items()
+                if name in t_uri_of
+            }
+            record_of = hash_time_cache.get_many(list(key_of.values()))
+            ret = dict()
+            for path, key in key_of.items():
+                try:
+                    ret[path] = _min_of_t_uri_and_record(
+                        t_uri_of[name_of[path]],
+                        functools.partial(_hash_of_path, path),
+                        hash_time_cache,
+                        key,
+                        record_of.get(key),
+                    )
+                except cls.exceptions:
+                    pass
+            return ret
+        cache_dir = os.path.dirname(
+            _hash_time_cache_path_of(
+                cls._check_uri(next(iter(name_of))), resource_hash_dir
+            )
+        )
+        t_cache_path_of = _mtimes_in(cache_dir, set(name_of.values()))
+        ret = dict()
+        for path, name in name_of.items():
+            if name not in t_uri_of:
+                continue
+            try:
+                ret[path] = _min_of_t_uri_and_t_cache_at(
+                    t_uri_of[name],
+                    functools.partial(_hash_of_path, path),
+                    os.path.join(cache_dir, name),
+                    t_cache_path_of.get(name),
+                )
+            except cls.exceptions:
+                pass
+        return ret
+
     @classmethod
     def _check_uri(cls, uri):
         """
@@ -261,17 +328,192 @@ register(GoogleCloudStorage)
 register(S3)
 
 
+class SQLiteHashTimeCache:
+    """
+    Hash caches of resources in a single SQLite database in the WAL mode instead of a JSON file per resource.
+    A record is `(t, h, t_checked)`, where `t_checked` plays the role of the modification time of the JSON file.
+    Writes are buffered and committed in a transaction per `batch_size` records, by `flush`, and at exit.
+    """
+
+    _SQL_CHUNK_SIZE = 500
+
+    def __init__(self, path, batch_size=1000):
+        assert batch_size > 0, batch_size
+        self.path = path
+        self.batch_size = batch_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # key -> record not committed yet
+        self._pending = dict()
+        _convenience.mkdir(_convenience.dirname(path))
+        self._connection()
+        atexit.register(self.flush)
+
+    def get(self, key):
+        """
+        Return: the record of `key` or `None`.
+        """
+        with self._lock:
+            record = self._pending.get(key)
+        if record is not None:
+            return record
+        return (
+            self._connection()
+            .execute("SELECT t, h, t_checked FROM hash_time WHERE key = ?", (key,))
+            .fetchone()
+        )
+
+    def get_many(self, keys):
+        """
+        Return: a dict from the keys in `keys` found to their records.
+        """
+        ret = dict()
+        with self._lock:
+            for key in keys:
+                if key in self._pending:
+                    ret[key] = self._pending[key]
+        rest = [key for key in keys if key not in ret]
+        conn = self._connection()
+        for i in range(0, len(rest), self._SQL_CHUNK_SIZE):
+            chunk = rest[i : i + self._SQL_CHUNK_SIZE]
+            for key, t, h, t_checked in conn.execute(
+                f"SELECT key, t, h, t_checked FROM hash_time WHERE key IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            ):
+                ret[key] = (t, h, t_checked)
+        return ret
+
+    def put(self, key, t, h):
+        self.put_many([(key, (t, h, time.time()))])
+
+    def put_many(self, items):
+        """
+        Buffer `(key, record)` pairs in `items`.
+        """
+        with self._lock:
+            self._pending.update(items)
+            if len(self._pending) < self.batch_size:
+                return
+            pending, self._pending = self._pending, dict()
+        self._commit(pending)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, dict()
+        if pending:
+            self._commit(pending)
+
+    def _commit(self, pending):
+        logger.debug("%s %d", self.path, len(pending))
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO hash_time (key, t, h, t_checked) VALUES (?, ?, ?, ?)",
+                ((key,) + tuple(record) for key, record in pending.items()),
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _connection(self):
+        """
+        Return: the connection of the current thread since a connection is not shared among threads.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS hash_time (key TEXT PRIMARY KEY, t REAL NOT NULL, h TEXT NOT NULL, t_checked REAL NOT NULL) WITHOUT ROWID"
+            )
+            self._local.conn = conn
+        return conn
+
+
+_hash_time_cache_of = _tval.TDict(dict())
+
+
+def register_hash_time_cache(resource_hash_dir, hash_time_cache):
+    """
+    Use `hash_time_cache` instead of the JSON files under `resource_hash_dir`.
+    """
+    _hash_time_cache_of[resource_hash_dir] = hash_time_cache
+
+
+def sqlite_path_of(resource_hash_dir):
+    return _convenience.jp(resource_hash_dir, "hash_time.sqlite3")
+
+
+def migrate_hash_time_cache(resource_hash_dir, hash_time_cache, remove=False):
+    """
+    Copy the JSON files under `resource_hash_dir` into `hash_time_cache`.
+    Files directly under `resource_hash_dir`, such as the SQLite database, are not hash caches.
+    With `remove=True`, the copied files and the directories emptied by their removal are removed.
+    Return: the number of the hash caches copied.
+    """
+    paths = []
+    tops = []
+    for top in sorted(os.listdir(resource_hash_dir)):
+        top = os.path.join(resource_hash_dir, top)
+        if not os.path.isdir(top):
+            continue
+        tops.append(top)
+        for dir_, _, names in os.walk(top):
+            items = []
+            for name in names:
+                path = os.path.join(dir_, name)
+                try:
+                    t_checked = os.stat(path).st_mtime
+                    t, h = _load_hash_time_cache(path)
+                except (OSError, KeyError, ValueError) as e:
+                    logger.warning(f"Skipped a broken hash cache {path}: {e}")
+                    continue
+                items.append(
+                    (os.path.relpath(path, resource_hash_dir), (t, h, t_checked))
+                )
+                paths.append(path)
+            hash_time_cache.put_many(items)
+    hash_time_cache.flush()
+    if remove:
+        for path in paths:
+            os.remove(path)
+        for top in tops:
+            for dir_, _, _ in os.walk(top, topdown=False):
+                try:
+                    os.rmdir(dir_)
+                except OSError:
+                    # Broken hash caches are kept.
+                    pass
+    return len(paths)
+
+
 def _min_of_t_uri_and_t_cache(t_uri, force_hash, puri, resource_hash_dir):
     """
     min(uri_time, cache_time)
     """
     assert puri.uri, puri
-    cache_path = _convenience.jp(
-        resource_hash_dir, puri.scheme, puri.netloc, os.path.abspath(puri.uri)
-    )
+    hash_time_cache = _hash_time_cache_of.get(resource_hash_dir)
+    if hash_time_cache is not None:
+        key = _hash_time_cache_key_of(puri.scheme, puri.netloc, puri.uri)
+        return _min_of_t_uri_and_record(
+            t_uri, force_hash, hash_time_cache, key, hash_time_cache.get(key)
+        )
+    cache_path = _hash_time_cache_path_of(puri, resource_hash_dir)
     try:
-        cache_path_stat = os.stat(cache_path)
+        t_cache_path = os.stat(cache_path).st_mtime
     except OSError:
+        t_cache_path = None
+    return _min_of_t_uri_and_t_cache_at(t_uri, force_hash, cache_path, t_cache_path)
+
+
+def _min_of_t_uri_and_t_cache_at(t_uri, force_hash, cache_path, t_cache_path):
+    """
+    `_min_of_t_uri_and_t_cache` with the modification time of the cache, which is `None` if the cache does not exist.
+    """
+    if t_cache_path is None:
         h_path = force_hash()
         _dump_hash_time_cache(cache_path, t_uri, h_path)
         return t_uri
@@ -283,7 +525,7 @@ def _min_of_t_uri_and_t_cache(t_uri, force_hash, puri, resource_hash_dir):
         _dump_hash_time_cache(cache_path, t_uri, h_path)
         return t_uri
 
-    if cache_path_stat.st_mtime > t_uri:
+    if t_cache_path > t_uri:
         return t_cache
     else:
         h_path = force_hash()
@@ -296,6 +538,66 @@ def _min_of_t_uri_and_t_cache(t_uri, force_hash, puri, resource_hash_dir):
             return t_uri
 
 
+def _min_of_t_uri_and_record(t_uri, force_hash, hash_time_cache, key, record):
+    """
+    `_min_of_t_uri_and_t_cache_at` for a registered hash time cache, where `record` is `None` if `key` is not cached.
+    """
+    if record is None:
+        hash_time_cache.put(key, t_uri, force_hash())
+        return t_uri
+    t_cache, h_cache, t_checked = record
+    if t_checked > t_uri:
+        return t_cache
+    h_path = force_hash()
+    if h_path == h_cache:
+        hash_time_cache.put(key, t_cache, h_cache)
+        return t_cache
+    hash_time_cache.put(key, t_uri, h_path)
+    return t_uri
+
+
+def _hash_time_cache_path_of(puri, resource_hash_dir):
+    return _convenience.jp(
+        resource_hash_dir, _hash_time_cache_key_of(puri.scheme, puri.netloc, puri.uri)
+    )
+
+
+def _hash_time_cache_key_of(scheme, netloc, path):
+    """
+    Return: the key of a hash cache, which is also the path of the JSON file relative to the resource hash directory.
+    >>> _hash_time_cache_key_of("file", "localhost", "/a/b")
+    'file/localhost/a/b'
+    """
+    return _convenience.jp(scheme, netloc, os.path.abspath(path))
+
+
+def _mtimes_in(dir_, names):
+    """
+    Return: a dict from the names in `names` found in `dir_` to their modification times.
+    Symbolic links are followed as `os.path.getmtime` does.
+    A single name is looked up directly not to list a large directory for it.
+    """
+    ret = dict()
+    if len(names) == 1:
+        for name in names:
+            try:
+                ret[name] = os.path.getmtime(os.path.join(dir_, name))
+            except OSError:
+                pass
+        return ret
+    try:
+        with os.scandir(dir_ or ".") as it:
+            for entry in it:
+                if entry.name in names:
+                    try:
+                        ret[entry.name] = entry.stat().st_mtime
+                    except OSError:
+                        pass
+    except OSError:
+        pass
+    return ret
+
+
 def _dump_hash_time_cache(cache_path, t_path, h_path):
     logger.debug(cache_path)
     _convenience.mkdir(_convenience.dirname(cache_path))
@@ -0,0 +1,107 @@
+#!/bin/bash
+# @(#) async def jobs and DSL.ash
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import os
+import sys
+import time
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+file = dsl.file
+phony = dsl.phony
+loop = dsl.loop
+sh = dsl.sh
+
+
+n = 200
+phony("all", ["sum"])
+
+
+@loop(range(n))
+def _(i):
+    @file(f"x{i}", [])
+    async def _(j):
+        await dsl.ash(f"sleep 1 ; echo {i} > {j.ts}", quiet=True)
+
+
+@file("sum", [f"x{i}" for i in range(n)])
+def _(j):
+    sh(f"cat {' '.join(j.ds)} | awk '{{s += \$1}} END {{print s}}' > {j.ts}")
+
+
+@file("captured", [])
+async def _(j):
+    r = await dsl.ash("echo captured", capture_output=True)
+    assert r.stdout == "captured\n", r
+    with open(j.ts, "w") as fp:
+        fp.write(r.stdout)
+
+
+@loop(range(4))
+def _(i):
+    @file(f"limited{i}", [])
+    async def _(j):
+        await dsl.ash(f"sleep 0.5 ; touch {j.ts}")
+
+
+@file("fail", [])
+async def _(j):
+    await dsl.ash("exit 1")
+
+
+if __name__ == '__main__':
+    t1 = time.time()
+    dsl.run()
+    dt = time.time() - t1
+    if "all" in dsl.args.targets:
+        # 200 one-second jobs with a single thread
+        assert dt < 10, dt
+        assert dsl.stats()["executor"]["threads_created"] == 1, dsl.stats()
+    if "limited0" in dsl.args.targets:
+        assert dt > 0.9, dt
+EOF
+
+"$PYTHON" build.py -j1 --async_subprocesses 200
+[[ "$(cat sum)" = 19900 ]]
+
+"$PYTHON" build.py captured
+[[ "$(cat captured)" = captured ]]
+
+"$PYTHON" build.py -j4 --async_subprocesses 2 limited0 limited1 limited2 limited3
+
+if "$PYTHON" build.py -k fail captured 2> err; then
+   echo should fail
+   exit 1
+fi
+grep -q CalledProcessError err
@@ -0,0 +1,79 @@
+#!/bin/bash
+# @(#) @file(batch=N)
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import json
+import os
+import sys
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+file = dsl.file
+phony = dsl.phony
+loop = dsl.loop
+
+
+n = 1000
+phony("all", [f"x{i}" for i in range(n)])
+
+
+@loop(range(n))
+def _(i):
+    @file(f"x{i}", [], batch=100)
+    def _(j):
+        if i == 7 and "fail" in os.environ:
+            raise Exception("x7 failed")
+        with open(j.ts, "w") as fp:
+            fp.write(str(i))
+
+
+if __name__ == '__main__':
+    dsl.run()
+    stats = dsl.stats()["batch"]
+    assert stats["n_jobs"] == n, stats
+    assert stats["n_batches"] == n // 100, stats
+EOF
+
+"$PYTHON" build.py -j4 --execution_log_dir log
+[[ "$(cat x999)" = 999 ]]
+[[ "$(wc -l < log/executed.jsonl)" = 1001 ]]
+[[ "$(wc -l < log/done.jsonl)" = 1001 ]]
+
+rm x*
+if fail=1 "$PYTHON" build.py -j4 -k 2> err; then
+   echo should fail
+   exit 1
+fi
+grep -q "x7 failed" err
+[[ ! -e x7 ]]
+[[ "$(cat x6 x8)" = 68 ]]
@@ -0,0 +1,92 @@
+#!/bin/bash
+# @(#) --schedule=critical-path
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+
+
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import os
+import sys
+import time
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+file = dsl.file
+phony = dsl.phony
+sh = dsl.sh
+
+
+phony("all", ["x", "y1", "b"])
+
+
+# While the serial job \`b\` is running, \`x\` and \`y2\` become ready.
+@file("b", [], serial=True)
+def _(j):
+    time.sleep(1)
+    sh(f"touch {j.ts}", quiet=True)
+
+
+@file("g", [])
+def _(j):
+    sh(f"touch {j.ts}", quiet=True)
+
+
+@file("x", ["g"], serial=True)
+def _(j):
+    sh(f"echo x >> order ; sleep 1 ; touch {j.ts}", quiet=True)
+
+
+@file("y2", ["g"], serial=True)
+def _(j):
+    sh(f"echo y2 >> order ; touch {j.ts}", quiet=True)
+
+
+@file("y1", ["y2"])
+def _(j):
+    sh(f"touch {j.ts}", quiet=True)
+
+
+if __name__ == '__main__':
+    dsl.run()
+EOF
+
+"$PYTHON" build.py -j2 --use_hash False
+
+# The slow \`x\` should be started first if the durations are known.
+rm -f order b g x y1 y2
+"$PYTHON" build.py -j2 --use_hash False --schedule critical-path
+[[ "$(head -n1 order)" = x ]]
+
+# The long chain \`y2\` -> \`y1\` should be started first if the durations are unknown.
+rm -f order b g x y1 y2
+"$PYTHON" build.py -j2 --use_hash False --schedule critical-path --execution_log_dir new/log
+[[ "$(head -n1 order)" = y2 ]]
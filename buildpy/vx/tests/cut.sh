@@ -0,0 +1,101 @@
+#!/bin/bash
+# @(#) --cut
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import os
+import sys
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+file = dsl.file
+phony = dsl.phony
+sh = dsl.sh
+
+
+phony("all", ["down"])
+
+
+@file(["down"], ["mid1"])
+def _(j):
+    sh(f"cat {j.ds[0]} >| {j.ts[0]} ; echo down >> log")
+
+
+@file(["mid1", "mid2"], ["up"])
+def _(j):
+    sh(f"cat {j.ds[0]} >| mid1 ; cat {j.ds[0]} >| mid2 ; echo mid >> log")
+
+
+@file(["up"], ["src"])
+def _(j):
+    if "fail" in os.environ:
+        raise Exception("up should not run")
+    sh(f"cat {j.ds[0]} >| {j.ts[0]} ; echo up >> log")
+
+
+if __name__ == '__main__':
+    dsl.run()
+EOF
+
+echo 1 > src
+"$PYTHON" build.py
+[[ "$(cat log)" = "up
+mid
+down" ]]
+
+for engine in coroutine counter; do
+   rm log
+   sleep 1.1
+   # The upstream of mid1 is stale and broken, but it is not checked.
+   echo 2 >| src
+   rm up
+   fail=1 "$PYTHON" build.py --engine "$engine" --cut=mid1
+   [[ ! -e log ]]
+   # Only the targets of the cut job are given.
+   echo 3 >| mid1
+   fail=1 "$PYTHON" build.py --engine "$engine" --cut=mid2
+   [[ "$(cat log)" = down ]]
+   # A target on the command line is skipped if it is cut.
+   fail=1 "$PYTHON" build.py --engine "$engine" --cut=up up
+   [[ ! -e up ]]
+   # A cut dependency is treated as a source file instead of a job.
+   rm src
+   fail=1 "$PYTHON" build.py --engine "$engine" --cut=src up mid1 2>| err || :
+   grep -q "No such file or directory: 'src'" err
+   if grep -q "No rule to make src" err; then
+      echo src should be cut
+      exit 1
+   fi
+   echo "$engine" > src
+   "$PYTHON" build.py --engine "$engine"
+   [[ "$(cat down)" = "$engine" ]]
+done
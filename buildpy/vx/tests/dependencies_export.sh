@@ -0,0 +1,72 @@
+#!/bin/bash
+# @(#) -Q, -J, and --dependencies-ndjson
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import sys
+
+import buildpy.vx
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+
+
+dsl.phony("all", ["a"])
+
+
+@dsl.file(["a", "b"], ["c", "d"])
+def _(j):
+    pass
+
+
+if __name__ == '__main__':
+    dsl.run()
+EOF
+
+cat <<EOF > expect.json
+[{"ds_unique": ["c", "d"], "ts_unique": ["a", "b"]}, {"ds_unique": ["a"], "ts_unique": ["all"]}]
+EOF
+cat <<EOF > expect.ndjson
+{"ds_unique": ["c", "d"], "ts_unique": ["a", "b"]}
+{"ds_unique": ["a"], "ts_unique": ["all"]}
+EOF
+
+"$PYTHON" build.py -J >| actual.json
+git diff --no-index expect.json actual.json
+"$PYTHON" build.py -J out.json >| stdout
+git diff --no-index expect.json out.json
+[[ ! -s stdout ]]
+
+"$PYTHON" build.py --dependencies-ndjson >| actual.ndjson
+git diff --no-index expect.ndjson actual.ndjson
+"$PYTHON" build.py --dependencies-ndjson out.ndjson
+git diff --no-index expect.ndjson out.ndjson
+
+"$PYTHON" build.py -Q out.dot
+"$PYTHON" build.py -Q >| actual.dot
+git diff --no-index out.dot actual.dot
+[[ "$(head -n 1 out.dot)" = "digraph G{" ]]
+[[ "$(tail -n 1 out.dot)" = "}" ]]
+[[ "$(grep -c -- ' -> ' out.dot)" = 6 ]]
@@ -0,0 +1,113 @@
+#!/bin/bash
+# @(#) --dry-run --explain
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import os
+import sys
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+file = dsl.file
+phony = dsl.phony
+sh = dsl.sh
+
+
+phony("all", ["b", "c"])
+phony("bad", ["d"])
+
+
+@file(["b"], ["a"])
+def _(j):
+    sh(f"cat {j.ds[0]} >| {j.ts[0]}")
+
+
+@file(["a"], ["src"])
+def _(j):
+    sh(f"cat {j.ds[0]} >| {j.ts[0]}")
+
+
+@file(["c"], ["src2"])
+def _(j):
+    sh(f"cat {j.ds[0]} >| {j.ts[0]}")
+
+
+@file(["d"], ["unknown://x"])
+def _(j):
+    pass
+
+
+if __name__ == '__main__':
+    dsl.run()
+EOF
+
+cat <<EOF > expect
+# src is newer than a
+a
+	src
+
+# a would be made
+b
+	a
+
+# b would be made
+all
+	b
+	c
+
+EOF
+
+echo 1 > src
+echo 1 > src2
+"$PYTHON" build.py
+"$PYTHON" build.py -n --explain >| actual
+[[ "$(cat actual)" = "# phony
+all
+	b
+	c" ]]
+
+sleep 1.1
+echo 2 >| src
+for threads in 1 4; do
+   "$PYTHON" build.py -n --explain --stat_threads "$threads" >| actual
+   git diff --no-index expect actual
+done
+# Nothing is run by a dry run.
+[[ "$(cat b)" = 1 ]]
+
+# A failed check is reported after the plan.
+if "$PYTHON" build.py -n bad 1>| actual 2>| err; then
+   echo a failed check should fail the dry run
+   exit 1
+fi
+grep -q "Execution failed." err
+[[ ! -s actual ]]
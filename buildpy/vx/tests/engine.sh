@@ -0,0 +1,128 @@
+#!/bin/bash
+# @(#) --engine counter
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import os
+import sys
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+file = dsl.file
+phony = dsl.phony
+loop = dsl.loop
+sh = dsl.sh
+
+
+n = 30
+phony("all", [f"top{i}" for i in range(n)] + ["chain"])
+
+
+# Every top depends on all the mids, which share a single base.
+@file(["base1", "base2"], ["src"])
+def _(j):
+    sh(f"cat {j.ds[0]} >| base1 ; cat {j.ds[0]} >| base2")
+
+
+@loop(range(n))
+def _(i):
+    @file(f"mid{i}", ["base1", "base2"])
+    def _(j):
+        if i == 7 and "fail" in os.environ:
+            raise Exception("mid7 failed")
+        sh(f"cat base1 >| {j.ts}")
+
+    @file(f"top{i}", [f"mid{k}" for k in range(n)] + ["base2"])
+    def _(j):
+        sh(f"touch {j.ts}")
+
+
+n_chain = 3000
+
+
+@loop(range(n_chain))
+def _(i):
+    @phony("chain" if i == n_chain - 1 else f"chain{i}", [f"chain{i - 1}"] if i > 0 else ["mid7"])
+    def _(j):
+        pass
+
+
+if "cycle" in os.environ:
+    phony("c1", ["c2"])
+    phony("c2", ["c3"])
+    phony("c3", ["c1"])
+    phony("all2", ["base1", "c1"])
+
+
+if __name__ == '__main__':
+    dsl.run()
+EOF
+
+echo 1 > src
+"$PYTHON" build.py -j4 --engine counter
+[[ "$(cat mid29)" = 1 ]]
+[[ -e top29 ]]
+
+# Dry-run propagation.
+sleep 1.1
+echo 2 >| src
+"$PYTHON" build.py -n --engine counter > counter.txt
+"$PYTHON" build.py -n --engine coroutine > coroutine.txt
+[[ "$(cat mid29)" = 1 ]]
+[[ "$(grep -c '^top' counter.txt)" = 30 ]]
+diff <(sort counter.txt) <(sort coroutine.txt)
+
+# --keep-going skips only the jobs depending on the failed one.
+rm top* mid*
+if fail=1 "$PYTHON" build.py -j4 -k --engine counter 2> err; then
+   echo should fail
+   exit 1
+fi
+grep -q "mid7 failed" err
+[[ "$(cat mid6 mid8)" = "2
+2" ]]
+[[ ! -e mid7 ]]
+[[ ! -e top0 ]]
+
+# A missing dependency fails.
+rm src
+if "$PYTHON" build.py --engine counter 2>| err; then
+   echo should fail
+   exit 1
+fi
+grep -q "No rule to make src" err
+
+if cycle=1 timeout 10 "$PYTHON" build.py --engine counter all2 2>| err; then
+   echo should fail
+   exit 1
+fi
+grep -q "c1 -> c2 -> c3 -> c1" err
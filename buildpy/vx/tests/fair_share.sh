@@ -0,0 +1,87 @@
+#!/bin/bash
+# @(#) --fair_share True
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import os
+import sys
+import time
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+file = dsl.file
+phony = dsl.phony
+loop = dsl.loop
+
+
+phony("all", [f"big{i}" for i in range(40)] + [f"small{i}" for i in range(4)])
+
+
+@loop(range(40))
+def _(i):
+    @phony(f"big{i}", [], key="big", priority=-1)
+    def _(j):
+        time.sleep(0.2)
+
+
+@phony("gate", [], priority=-2)
+def _(j):
+    time.sleep(0.1)
+
+
+@loop(range(4))
+def _(i):
+    # Enqueued after all the big jobs.
+    @phony(f"small{i}", ["gate"], key="small")
+    def _(j):
+        time.sleep(0.2)
+
+
+if __name__ == '__main__':
+    t1 = time.time()
+    dsl.run()
+    dt = time.time() - t1
+    keys = dsl.stats()["executor"]["keys"]
+    assert keys["big"]["n_started"] == 40, keys
+    assert keys["big"]["max_queued"] >= 36, keys
+    if dsl.args.fair_share:
+        assert keys["small"]["wait_seconds_max"] < 1, keys
+    else:
+        assert keys["small"]["wait_seconds_max"] > 1, keys
+    if dsl.args.key_cap:
+        # At most 2 big jobs run at a time.
+        assert dt > 3.8, dt
+EOF
+
+"$PYTHON" build.py -j4
+"$PYTHON" build.py -j4 --fair_share True
+"$PYTHON" build.py -j4 --fair_share True --key_weight small=2 --key_cap big=2
@@ -0,0 +1,97 @@
+#!/bin/bash
+# @(#) Cancel queued jobs and kill running process groups on an error
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import os
+import sys
+import time
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+file = dsl.file
+phony = dsl.phony
+loop = dsl.loop
+sh = dsl.sh
+
+
+# Targets are invoked in the sorted order, so that the x_queued jobs are submitted after the others.
+phony("all", ["fail", "stubborn", "slow"] + [f"x_queued{i}" for i in range(100)])
+
+
+@file("fail", [], priority=-1)
+def _(j):
+    time.sleep(0.5)
+    raise Exception("fail failed")
+
+
+@file("stubborn", [], priority=-1)
+def _(j):
+    sh("trap '' TERM ; sleep 31 ; touch stubborn")
+
+
+@file("slow", [], priority=-1)
+def _(j):
+    sh("sleep 32 & sleep 33 ; touch slow")
+
+
+@loop(range(100))
+def _(i):
+    @file(f"x_queued{i}", [])
+    def _(j):
+        sh(f"touch {j.ts}")
+
+
+if __name__ == '__main__':
+    dsl.run()
+EOF
+
+for process_group in True False; do
+   rm -f err
+   t1="$(date +%s)"
+   if "$PYTHON" build.py -j3 --kill_grace_period 1 --process_group "$process_group" 2> err; then
+      echo should fail
+      exit 1
+   fi
+   t2="$(date +%s)"
+   # Not waiting for the sleeps of 30 s.
+   (( t2 - t1 < 10 ))
+   grep -q "fail failed" err
+   sleep 0.5
+   if pgrep -f "sleep 3[123]"; then
+      echo should be killed
+      exit 1
+   fi
+   [[ ! -e stubborn ]]
+   [[ ! -e slow ]]
+   [[ ! -e x_queued0 ]]
+done
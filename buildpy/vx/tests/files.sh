@@ -0,0 +1,86 @@
+#!/bin/bash
+# @(#) dsl.files for bulk declaration
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import os
+import sys
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+file = dsl.file
+files = dsl.files
+phony = dsl.phony
+
+
+n = 1000
+phony("all", [f"y{i}" for i in range(n)])
+
+
+def copy(j):
+    with open(j.ds[0]) as fp:
+        x = fp.read()
+    with open(j.ts[0], "w") as fp:
+        fp.write(x + j.data)
+
+
+xs = files(
+    (dict(targets=[f"x{i}"], deps=[], data=str(i), key="x") for i in range(n)),
+    f=lambda j: open(j.ts[0], "w").write(j.data),
+)
+ys = files(
+    [dict(targets=[f"y{i}"], deps=[f"x{i}"], data="y") for i in range(n)]
+    + [dict(targets=["z"], deps=[], cut=True)],
+    f=copy,
+)
+assert len(xs) == n, xs
+assert ys[-1] is None, ys[-1]
+assert dsl.job_of_target["y7"] is ys[7], ys[7]
+assert len(dsl.jobs_of_key["x"]) == n, dsl.jobs_of_key
+
+try:
+    files([dict(targets=["w"], deps=[]), dict(targets=["x3"], deps=[])])
+except Exception as e:
+    assert str(e).startswith("Tried to overwrite x3 "), e
+else:
+    raise AssertionError("x3 should not be overwritten")
+assert "w" not in dsl.job_of_target, dsl.job_of_target
+
+
+if __name__ == '__main__':
+    dsl.run()
+EOF
+
+"$PYTHON" build.py -j4 --execution_log_dir log
+[[ "$(cat y999)" = 999y ]]
+[[ "$(wc -l < log/defined.jsonl)" = 2001 ]]
+[[ "$(wc -l < log/done.jsonl)" = 2001 ]]
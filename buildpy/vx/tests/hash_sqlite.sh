@@ -0,0 +1,134 @@
+#!/bin/bash
+# @(#) --resource_hash_backend=sqlite and migrate-hash-cache
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import os
+import sys
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+file = dsl.file
+phony = dsl.phony
+sh = dsl.sh
+
+
+phony("all", ["b"])
+
+
+@file(["b"], ["a", "y"])
+def _(j):
+    if "fail_b" in os.environ:
+        raise Exception("b failed")
+    sh(f"cat {' '.join(j.ds)} >| {j.ts[0]} ; echo b >> log")
+
+
+@file(["a"], ["x"])
+def _(j):
+    sh(f"cat {j.ds[0]} >| {j.ts[0]} ; echo a >> log")
+
+
+if __name__ == '__main__':
+    # Skip the handlers of \`atexit\` as a killed process with \`exit_now\`.
+    try:
+        dsl.run()
+    except Exception:
+        if "exit_now" in os.environ:
+            os._exit(1)
+        raise
+    if "exit_now" in os.environ:
+        os._exit(0)
+EOF
+
+echo x > x
+echo y > y
+"$PYTHON" build.py --resource_hash_backend sqlite
+[[ "$(cat log)" = "a
+b" ]]
+rm log
+[[ -s .buildpy/resource_hash/hash_time.sqlite3 ]]
+[[ -z "$(find .buildpy/resource_hash -mindepth 1 -type d)" ]]
+
+sleep 1.1
+touch x y
+"$PYTHON" build.py --resource_hash_backend sqlite
+[[ ! -e log ]]
+
+sleep 1.1
+echo y2 >| y
+"$PYTHON" build.py --resource_hash_backend sqlite
+[[ "$(cat log)" = "b" ]]
+rm log
+
+# Hash caches of the JSON files are carried over.
+rm -fr .buildpy a b
+"$PYTHON" build.py
+[[ "$(cat log)" = "a
+b" ]]
+rm log
+sleep 1.1
+touch x y
+"$PYTHON" -m buildpy.vx migrate-hash-cache --remove >| migrate.log
+[[ "$(cat migrate.log)" = "Migrated 3 hash caches to .buildpy/resource_hash/hash_time.sqlite3" ]]
+[[ -z "$(find .buildpy/resource_hash -type f -name 'x')" ]]
+[[ -z "$(find .buildpy/resource_hash -mindepth 1 -type d)" ]]
+"$PYTHON" build.py --resource_hash_backend sqlite
+[[ ! -e log ]]
+
+sleep 1.1
+echo x2 >| x
+"$PYTHON" build.py --resource_hash_backend sqlite
+[[ "$(cat log)" = "a
+b" ]]
+
+# The hash caches are committed by the end of the run, even if the run fails.
+rm -fr .buildpy a b log
+exit_now=1 "$PYTHON" build.py --resource_hash_backend sqlite
+[[ "$(cat log)" = "a
+b" ]]
+rm log
+sleep 1.1
+touch x y
+"$PYTHON" build.py --resource_hash_backend sqlite
+[[ ! -e log ]]
+rm -fr .buildpy a b
+if fail_b=1 exit_now=1 "$PYTHON" build.py --resource_hash_backend sqlite 2>| err; then
+   echo should fail
+   exit 1
+fi
+grep -q "b failed" err
+[[ "$(cat log)" = a ]]
+rm log
+sleep 1.1
+touch x
+"$PYTHON" build.py --resource_hash_backend sqlite
+[[ "$(cat log)" = b ]]
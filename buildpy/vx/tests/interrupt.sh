@@ -0,0 +1,77 @@
+#!/bin/bash
+# @(#) Ctrl-C reaches the commands of `sh` with and without --process_group
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+
+
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import os
+import sys
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+file = dsl.file
+sh = dsl.sh
+
+
+@file(["x"], [])
+def _(j):
+    sh("touch started ; sleep 41 ; touch x")
+
+
+if __name__ == '__main__':
+    dsl.run()
+EOF
+
+for process_group in True False; do
+   rm -f started
+   # Run buildpy in a new process group like a foreground job of a terminal, without SIGINT ignored as for a background job of a script.
+   "$PYTHON" -c 'import os, signal, sys; os.setpgid(0, 0); signal.signal(signal.SIGINT, signal.SIG_DFL); os.execv(sys.executable, sys.argv)' build.py x --process_group "$process_group" --terminate_subprocesses False 2> /dev/null &
+   pid="$!"
+   while [[ ! -e started ]]; do
+      sleep 0.1
+   done
+   sleep 0.2
+   # Ctrl-C of a terminal signals the foreground process group.
+   # The subprocesses are not terminated by buildpy, so they should exit by SIGINT.
+   kill -INT -- "-$pid"
+   if wait "$pid"; then
+      echo should fail
+      exit 1
+   fi
+   sleep 0.5
+   if pgrep -f "sleep 41"; then
+      echo should be interrupted
+      exit 1
+   fi
+   [[ ! -e x ]]
+done
@@ -0,0 +1,111 @@
+#!/bin/bash
+# @(#) Peak RSS recording and --memory_admission
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+
+
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import collections
+import os
+import sys
+import threading
+import time
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+file = dsl.file
+phony = dsl.phony
+loop = dsl.loop
+sh = dsl.sh
+
+
+mib = 2**20
+lock = threading.Lock()
+state = dict(n_running=0, max_n_running=0)
+VirtualMemory = collections.namedtuple("VirtualMemory", ["available"])
+buildpy.vx.psutil.virtual_memory = lambda: VirtualMemory(available=500 * mib)
+
+
+phony("all", ["big", "small1", "small2"])
+
+
+@file("big", [])
+def _(j):
+    sh(f"""
+    {sys.executable} -c 'x = bytearray(300 * 2**20); import time; time.sleep(1.5)'
+    touch {j.ts}
+    """, quiet=True)
+
+
+# The estimates are used only for the first run.
+@loop(["small1", "small2"])
+def _(t):
+    @file(t, [], memory=300 * mib)
+    def _(j):
+        with lock:
+            state["n_running"] += 1
+            state["max_n_running"] = max(state["max_n_running"], state["n_running"])
+        sh(f"sleep 1 ; touch {j.ts}", quiet=True)
+        with lock:
+            state["n_running"] -= 1
+
+
+if __name__ == '__main__':
+    dsl.run()
+    print(state["max_n_running"])
+EOF
+
+"$PYTHON" build.py -j3 --memory_admission True --rss_interval 0.1 > max_n_running.1
+[[ "$(cat max_n_running.1)" = 1 ]]
+cat .buildpy/log/*/executed.jsonl | "$PYTHON" -c '
+import json
+import sys
+for l in sys.stdin:
+    x = json.loads(l)
+    if x["ts"] == "big":
+        assert x["peak_rss"] > 300 * 2**20, x
+'
+
+# \`sleep\` does not use much memory.
+rm big small1 small2
+"$PYTHON" build.py -j3 --memory_admission True --rss_interval 0.1 > max_n_running.2
+[[ "$(cat max_n_running.2)" = 2 ]]
+
+# The RSS is not sampled without --memory_admission.
+rm big
+"$PYTHON" build.py big --rss_interval 0.1 --execution_log_dir no_admission
+find no_admission -name executed.jsonl -exec cat {} + | "$PYTHON" -c '
+import json
+import sys
+xs = [x for x in map(json.loads, sys.stdin) if x["ts"] == "big"]
+assert xs and all(x["peak_rss"] is None for x in xs), xs
+'
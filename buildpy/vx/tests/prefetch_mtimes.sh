@@ -0,0 +1,101 @@
+#!/bin/bash
+# @(#) --prefetch_mtimes
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import os
+import sys
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+file = dsl.file
+phony = dsl.phony
+sh = dsl.sh
+
+
+phony("all", ["out/b", "out/z"])
+
+
+@file(["out/b"], ["out/a", "src/2"])
+def _(j):
+    sh(f"cat {' '.join(j.ds)} >| {j.ts[0]} ; echo b >> log")
+
+
+@file(["out/a"], ["src/1", "src/2"])
+def _(j):
+    sh(f"mkdir -p out ; cat {' '.join(j.ds)} >| {j.ts[0]} ; echo a >> log")
+
+
+# Neither x nor y is prefetched since the job is rerun if one of them is missing.
+@file(["x", "y"], [])
+def _(j):
+    sh(f"cat src/1 >| x ; touch y ; echo x >> log")
+
+
+@file(["out/z"], ["x"])
+def _(j):
+    sh(f"mkdir -p out ; cat {j.ds[0]} >| {j.ts[0]} ; echo z >> log")
+
+
+if __name__ == '__main__':
+    dsl.run()
+EOF
+
+mkdir src
+echo 1 > src/1
+echo 2 > src/2
+for prefetch in True False; do
+   for use_hash in True False; do
+      rm -fr out x y log .buildpy
+      opts=(--prefetch_mtimes "$prefetch" --use_hash "$use_hash")
+      "$PYTHON" build.py "${opts[@]}"
+      [[ "$(sort log | tr '\n' ' ')" = "a b x z " ]]
+      rm log
+
+      "$PYTHON" build.py "${opts[@]}"
+      [[ ! -e log ]]
+
+      sleep 1.1
+      echo "$prefetch $use_hash" >| src/1
+      "$PYTHON" build.py "${opts[@]}"
+      [[ "$(cat log)" = "a
+b" ]]
+      [[ "$(head -n 1 out/b)" = "$prefetch $use_hash" ]]
+      rm log
+
+      rm y
+      "$PYTHON" build.py "${opts[@]}"
+      [[ "$(cat log)" = "x
+z" ]]
+      [[ "$(cat out/z)" = "$prefetch $use_hash" ]]
+   done
+done
@@ -0,0 +1,87 @@
+#!/bin/bash
+# @(#) --pressure_cpu
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+
+
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import os
+import sys
+import threading
+import time
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+phony = dsl.phony
+loop = dsl.loop
+
+
+n = 8
+dt = 0.4
+t_drop = 1.0
+lock = threading.Lock()
+state = dict(n_running=0, max_n_running_before_drop=0)
+
+
+def psi_of(resource):
+    return 50.0 if time.time() < t1 + t_drop else 0.0
+
+
+buildpy.vx._psi_of = psi_of
+
+
+phony("all", [f"x{i}" for i in range(n)])
+
+
+@loop(range(n))
+def _(i):
+    @phony(f"x{i}", [])
+    def _(j):
+        with lock:
+            state["n_running"] += 1
+            if time.time() < t1 + t_drop:
+                state["max_n_running_before_drop"] = max(state["max_n_running_before_drop"], state["n_running"])
+        time.sleep(dt)
+        with lock:
+            state["n_running"] -= 1
+
+
+if __name__ == '__main__':
+    t1 = time.time()
+    dsl.run()
+    t2 = time.time()
+    assert state["max_n_running_before_drop"] == 1, state
+    assert t2 - t1 < n * dt - 0.5, t2 - t1
+    assert dsl.stats()["pressure"]["n_high_samples"] > 0
+EOF
+
+"$PYTHON" build.py -j"$(( 8 ))" --pressure_cpu 10 --pressure_interval 0.1
@@ -0,0 +1,125 @@
+#!/bin/bash
+# @(#) @file(executor="process")
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+
+
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import os
+import sys
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+file = dsl.file
+phony = dsl.phony
+loop = dsl.loop
+
+
+phony("all", [f"x{i}" for i in range(4)])
+
+
+@loop(range(4))
+def _(i):
+    @file(f"x{i}", ["y"], data=dict(i=i), executor="process")
+    def _(j):
+        assert os.getpid() != main_pid
+        with open(j.ts, "w") as fp:
+            print(j.data["i"], open(j.ds[0]).read().strip(), file=fp)
+
+
+@file("z", ["y"], executor="process")
+def _(j):
+    raise Exception("z failed")
+
+
+main_pid = os.getpid()
+
+
+if __name__ == '__main__':
+    dsl.run()
+EOF
+
+echo y > y
+"$PYTHON" build.py -j2 --use_hash False
+[[ "$(cat x0 x3)" = "0 y
+3 y" ]]
+
+rm x0 x1 x2 x3
+if "$PYTHON" build.py -j2 --use_hash False -k all z 2> err; then
+   echo should fail
+   exit 1
+fi
+grep -q "z failed" err
+[[ "$(cat x1)" = "1 y" ]]
+
+# The worker processes are forked once for the jobs declared by rules, and a job declared after the fork is rejected.
+cat <<EOF2 > rule.py
+#!/usr/bin/python3
+
+import os
+import sys
+
+import buildpy.vx
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+
+
+@dsl.rule(["%.o"], ["%.c"], executor="process")
+def _(j):
+    with open(j.ts[0], "w") as fp:
+        print(os.getpid(), file=fp)
+
+
+dsl.phony("all", [f"{i}.o" for i in range(8)])
+
+
+@dsl.file(["late"], [])
+def _(j):
+    dsl.file(["later"], [], executor="process")(lambda j: None)
+
+
+if __name__ == '__main__':
+    dsl.run()
+EOF2
+
+touch {0..7}.c
+for engine in coroutine counter; do
+   rm -f ./*.o
+   "$PYTHON" rule.py -j2 --engine "$engine"
+   [[ "$(cat ./*.o | sort -u | wc -l)" -le 2 ]]
+done
+if "$PYTHON" rule.py late 2>| err; then
+   echo should fail
+   exit 1
+fi
+grep -q "is declared after the worker processes are forked" err
@@ -0,0 +1,93 @@
+#!/bin/bash
+# @(#) @file(remote=True) with workers on localhost
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   kill $(jobs -p) 2> /dev/null || :
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+
+
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import os
+import sys
+import time
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+# Not in --remote_env
+os.environ["BUILDPY_SECRET"] = "secret"
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+file = dsl.file
+phony = dsl.phony
+loop = dsl.loop
+sh = dsl.sh
+
+
+n = 8
+phony("all", [f"x{i}" for i in range(n)] + ["local"])
+
+
+@loop(range(n))
+def _(i):
+    @file(f"x{i}", [], remote=True)
+    def _(j):
+        sh(f"sleep 0.5 ; echo \$BUILDPY_WORKER \${{BUILDPY_SECRET:-}} > {j.ts}")
+        assert sh("echo captured", capture_output=True).stdout == "captured\n"
+
+
+@file("local", [])
+def _(j):
+    sh(f"echo \${{BUILDPY_WORKER:-local}} > {j.ts}")
+
+
+if __name__ == '__main__':
+    t1 = time.time()
+    dsl.run()
+    t2 = time.time()
+    # 2 workers x 2 slots
+    assert t2 - t1 < 0.5 * n / 2, t2 - t1
+    stats = dsl.stats()["remote"]
+    assert sorted(stats) == ["w1", "w2"], stats
+    assert sum(st["n_done"] for st in stats.values()) == 2 * n, stats
+    assert all(0 < st["utilization"] <= 1 for st in stats.values()), stats
+EOF
+
+export BUILDPY_REMOTE_TOKEN=token
+port="$("$PYTHON" -c 'import socket; s = socket.socket(); s.bind(("127.0.0.1", 0)); print(s.getsockname()[1])')"
+echo wrong >| wrong_token
+# Rejected by the coordinator, this worker exits without running commands.
+"$PYTHON" -m buildpy.vx worker "127.0.0.1:$port" --slots 2 --name w0 --token_file wrong_token &
+"$PYTHON" -m buildpy.vx worker "127.0.0.1:$port" --slots 2 --name w1 &
+"$PYTHON" -m buildpy.vx worker "127.0.0.1:$port" --slots 2 --name w2 &
+"$PYTHON" build.py -j4 --coordinator "127.0.0.1:$port"
+wait
+
+[[ "$(cat x* | sort -u)" = "w1
+w2" ]]
+[[ "$(cat local)" = local ]]
@@ -0,0 +1,93 @@
+#!/bin/bash
+# @(#) @file(resources=...) and --resource
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+
+
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import os
+import sys
+import threading
+import time
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+phony = dsl.phony
+file = dsl.file
+loop = dsl.loop
+
+
+lock = threading.Lock()
+usage = dict(mem=0, max_mem=0)
+
+
+def use(mem):
+    with lock:
+        usage["mem"] += mem
+        usage["max_mem"] = max(usage["max_mem"], usage["mem"])
+    time.sleep(0.5)
+    with lock:
+        usage["mem"] -= mem
+
+
+phony("all", [f"small{i}" for i in range(6)] + ["big", "huge"])
+
+
+@loop(range(6))
+def _(i):
+    @file(f"small{i}", [], resources=dict(mem=1, other=1))
+    def _(j):
+        use(1)
+
+
+@file("big", [], resources=dict(mem=3))
+def _(j):
+    use(3)
+
+
+# Exceeding the capacity should not cause a deadlock.
+@file("huge", [], resources=dict(mem=8))
+def _(j):
+    use(4)
+
+
+if __name__ == '__main__':
+    t1 = time.time()
+    dsl.run()
+    t2 = time.time()
+    assert usage["max_mem"] <= 4, usage
+    # 1 + 1 + 1 + 3 + 1 + 1 + 1 + 4 = 13
+    assert t2 - t1 > 0.5 * 13 / 4, t2 - t1
+    assert t2 - t1 < 0.5 * 7, t2 - t1
+EOF
+
+"$PYTHON" build.py -j8 --resource mem=4
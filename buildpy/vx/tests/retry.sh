@@ -0,0 +1,111 @@
+#!/bin/bash
+# @(#) @file(timeout=, retries=, retry_on=)
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+file = dsl.file
+phony = dsl.phony
+sh = dsl.sh
+
+
+phony("all", ["flaky", "other"])
+
+
+@file("flaky", [], retries=2, retry_on=(subprocess.CalledProcessError,))
+def _(j):
+    sh("echo x >> attempts")
+    sh(f"touch {j.ts}")
+    sh("[[ \$(wc -l < attempts) -ge 3 ]]")
+
+
+@file("other", [], priority=1)
+def _(j):
+    time.sleep(0.5)
+    sh(f"touch {j.ts}")
+
+
+@file("hang", [], timeout=0.5, retries=1)
+def _(j):
+    sh("sleep 35")
+
+
+@file("wrong", [], retries=3, retry_on=(subprocess.CalledProcessError,))
+def _(j):
+    raise ValueError("not retried")
+
+
+@file("ahang", [], timeout=0.5)
+async def _(j):
+    await dsl.ash("sleep 36")
+
+
+if __name__ == '__main__':
+    dsl.run()
+EOF
+
+"$PYTHON" build.py -j1 --retry_backoff 1 --execution_log_dir log
+[[ "$(wc -l < attempts)" = 3 ]]
+[[ -e flaky ]]
+"$PYTHON" - <<EOF
+import json
+xs = [json.loads(l) for l in open("log/executed.jsonl")]
+flaky = [x for x in xs if x["ts"] == "flaky"]
+assert [x["attempt"] for x in flaky] == [0, 1, 2], flaky
+assert [x["error"] is None for x in flaky] == [False, False, True], flaky
+# The backoff does not occupy the only worker thread.
+done = [json.loads(l)["ts"] for l in open("log/done.jsonl")]
+assert done.index("other") < done.index("flaky"), done
+EOF
+
+t1="$(date +%s)"
+if "$PYTHON" build.py -k --retry_backoff 0.1 --kill_grace_period 1 --execution_log_dir log hang wrong ahang 2> err; then
+   echo should fail
+   exit 1
+fi
+t2="$(date +%s)"
+(( t2 - t1 < 5 ))
+grep -q "TimeoutError" err
+grep -q "not retried" err
+[[ "$(grep -c '"hang"' log/executed.jsonl)" = 2 ]]
+[[ "$(grep -c '"wrong"' log/executed.jsonl)" = 1 ]]
+if pgrep -f "sleep 3[56]"; then
+   echo should be killed
+   exit 1
+fi
@@ -0,0 +1,228 @@
+#!/bin/bash
+# @(#) dsl.rule
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import os
+import sys
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+file = dsl.file
+phony = dsl.phony
+rule = dsl.rule
+sh = dsl.sh
+
+
+phony("all", ["src/a.o", "src/b.o", "src/p.tab.o"])
+
+
+@rule(["%.o"], ["%.c", "common.h"])
+def _(j):
+    sh(f"cat {j.ds[0]} {j.ds[1]} >| {j.ts[0]}")
+
+
+# Preferred to "%.o" for p.tab.o because of the shorter stem.
+@rule(["%.tab.o"], ["%.tab.c"])
+def _(j):
+    sh(f"(echo tab ; cat {j.ds[0]}) >| {j.ts[0]}")
+
+
+# A chain of rules.
+@rule(["%.tab.c", "%.tab.h"], ["%.y"])
+def _(j):
+    sh(f"cat {j.ds[0]} >| {j.ts[0]} ; touch {j.ts[1]}")
+
+
+# Not applicable since the dependency neither exists nor can be made.
+@rule(["%.o"], ["%.missing"])
+def _(j):
+    raise Exception("should not be used")
+
+
+@file("common.h", [])
+def _(j):
+    sh(f"echo h >| {j.ts}")
+
+
+if __name__ == '__main__':
+    dsl.run()
+    n = len(set(dsl.job_of_target.values()))
+    assert n == int(os.environ["n_jobs"]), n
+EOF
+
+mkdir src
+for i in $(seq 1000); do
+   echo "$i" > "src/f$i.c"
+done
+echo a > src/a.c
+echo b > src/b.c
+echo p > src/p.y
+
+for engine in coroutine counter; do
+   rm -f src/*.o src/*.tab.*
+   # all, common.h, a.o, b.o, p.tab.o, p.tab.c, and the sources a.c, b.c, and p.y.
+   n_jobs=9 "$PYTHON" build.py --engine "$engine"
+   [[ "$(cat src/a.o)" = "a
+h" ]]
+   [[ "$(cat src/p.tab.o)" = "tab
+p" ]]
+   [[ -e src/p.tab.h ]]
+   [[ ! -e src/f1.o ]]
+done
+
+# A target on the command line.
+n_jobs=4 "$PYTHON" build.py src/f7.o
+[[ "$(cat src/f7.o)" = "7
+h" ]]
+
+if n_jobs=0 "$PYTHON" build.py src/nothing.o 2> err; then
+   echo should fail
+   exit 1
+fi
+grep -q "KeyError: 'src/nothing.o'" err
+
+# Rules making each other are not used to make a target from itself.
+cat <<EOF > cycle.py
+#!/usr/bin/python3
+
+import os
+import sys
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+
+
+@dsl.rule(["%.x"], ["%.y"])
+def _(j):
+    dsl.sh(f"cat {j.ds[0]} >| {j.ts[0]}")
+
+
+@dsl.rule(["%.y"], ["%.x"])
+def _(j):
+    dsl.sh(f"cat {j.ds[0]} >| {j.ts[0]}")
+
+
+dsl.phony("all", ["a.x"])
+
+
+if __name__ == '__main__':
+    dsl.run()
+EOF
+
+echo y > a.y
+for engine in coroutine counter; do
+   rm -f a.x
+   timeout 10 "$PYTHON" cycle.py --engine "$engine"
+   [[ "$(cat a.x)" = y ]]
+done
+
+# A cycle through a job declared by a rule and declared jobs.
+cat <<EOF > mixed.py
+#!/usr/bin/python3
+
+import os
+import sys
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+
+
+@dsl.rule(["%.o"], ["%.c"])
+def _(j):
+    dsl.sh(f"cat {j.ds[0]} >| {j.ts[0]}")
+
+
+@dsl.file(["a.c"], ["b"])
+def _(j):
+    dsl.sh(f"cat {j.ds[0]} >| {j.ts[0]}")
+
+
+@dsl.file(["b"], ["a.o"])
+def _(j):
+    dsl.sh(f"cat {j.ds[0]} >| {j.ts[0]}")
+
+
+dsl.phony("all", ["b"])
+
+
+if __name__ == '__main__':
+    dsl.run()
+EOF
+
+for args in "--engine coroutine" "--engine counter" "-n" "--why b" "--check-graph"; do
+   if timeout 10 "$PYTHON" mixed.py $args 2>| err; then
+      echo should fail
+      exit 1
+   fi
+   grep -q "a.c -> b -> a.o -> a.c" err
+done
+
+cat <<EOF > invalid.py
+#!/usr/bin/python3
+
+import sys
+
+import buildpy.vx
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+if sys.argv[1] == "cut":
+    dsl.rule(["%.x"], ["%.y"], cut=True)
+else:
+    dsl.rule(["%.x"], ["%.y"])
+    dsl.phony("all", ["a.x"])
+    dsl.run()
+EOF
+
+if "$PYTHON" invalid.py cut 2>| err; then
+   echo should fail
+   exit 1
+fi
+grep -q "ValueError: cut is not supported for a rule" err
+if "$PYTHON" invalid.py no_function 2>| err; then
+   echo should fail
+   exit 1
+fi
+grep -q "No function is given to _Rule" err
@@ -13,6 +13,7 @@ def main(argv):
         buildpy.vx,
         buildpy.vx._convenience,
         buildpy.vx._log,
+        buildpy.vx._remote,
         buildpy.vx._tval,
         buildpy.vx.exception,
         buildpy.vx.resource,
@@ -0,0 +1,122 @@
+#!/bin/bash
+# @(#) @file(idempotent=True) with --speculate True
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import os
+import sys
+import time
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+file = dsl.file
+phony = dsl.phony
+loop = dsl.loop
+sh = dsl.sh
+
+
+phony("all", [f"x{i}" for i in range(4)])
+
+
+@loop(range(4))
+def _(i):
+    @file([f"d/x{i}"], [], idempotent=True)
+    def _(j):
+        sh(f"mkdir -p d ; echo {i} > {j.ts[0]}")
+        if os.path.exists("slow"):
+            # Targets are written to private temporary paths.
+            assert j.ts[0] != f"d/x{i}", j.ts
+            if i == 0 and j.ts[0].endswith("-0"):
+                # Only the first copy of x0 is a straggler.
+                sh(f"sleep 34 ; echo slow > {j.ts[0]}")
+
+    phony(f"x{i}", [f"d/x{i}"])
+
+
+if __name__ == '__main__':
+    t1 = time.time()
+    dsl.run()
+    dt = time.time() - t1
+    if os.path.exists("slow"):
+        assert dt < 5, dt
+        assert dsl.stats()["speculation"] == dict(n_started=1, n_won=1), dsl.stats()
+EOF
+
+"$PYTHON" build.py -j4 --speculate True --speculate_factor 2 --execution_log_dir log/1
+[[ "$(cat d/x0 d/x3)" = "0
+3" ]]
+rm -r d
+touch slow
+"$PYTHON" build.py -j4 --speculate True --speculate_factor 2 --execution_log_dir log/2 --kill_grace_period 1
+[[ "$(cat d/x0 d/x3)" = "0
+3" ]]
+[[ "$(ls -A d | wc -l)" = 4 ]]
+if pgrep -f "sleep 34"; then
+   echo should be killed
+   exit 1
+fi
+
+# The last copy to finish fails to rename its target, which it did not write.
+cat <<EOF > nothing.py
+#!/usr/bin/python3
+
+import os
+import sys
+import time
+
+import buildpy.vx
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+
+
+@dsl.file(["nothing"], [], idempotent=True)
+def _(j):
+    if os.path.exists("race"):
+        if j.ts[0].endswith("-0"):
+            time.sleep(1)
+            raise Exception("copy 0 failed")
+        time.sleep(2)
+
+
+if __name__ == '__main__':
+    dsl.run()
+EOF
+
+# The first run records the duration to speculate in the second run.
+"$PYTHON" nothing.py nothing --execution_log_dir log/3
+touch race
+if timeout 20 "$PYTHON" nothing.py nothing -j2 --speculate True --execution_log_dir log/3 2>| err; then
+   echo should fail
+   exit 1
+fi
+grep -q "copy 0 failed" err
@@ -0,0 +1,116 @@
+#!/bin/bash
+# @(#) --why and --affected-by
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import os
+import sys
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+file = dsl.file
+phony = dsl.phony
+sh = dsl.sh
+
+
+phony("all", ["c", "e"])
+
+
+@file(["c"], ["b1", "src2"])
+def _(j):
+    sh(f"cat {j.ds[0]} >| {j.ts[0]}")
+
+
+@file(["b1", "b2"], ["a"])
+def _(j):
+    sh(f"cat {j.ds[0]} >| b1 ; cat {j.ds[0]} >| b2")
+
+
+@file(["a"], ["src1"])
+def _(j):
+    sh(f"cat {j.ds[0]} >| {j.ts[0]}")
+
+
+@file(["e"], ["src2"])
+def _(j):
+    sh(f"cat {j.ds[0]} >| {j.ts[0]}")
+
+
+if __name__ == '__main__':
+    dsl.run()
+EOF
+
+echo 1 > src1
+echo 1 > src2
+"$PYTHON" build.py
+
+[[ "$("$PYTHON" build.py --affected-by src1)" = "a
+all
+b1
+b2
+c" ]]
+[[ "$("$PYTHON" build.py --affected-by src1 src2)" = "a
+all
+b1
+b2
+c
+e" ]]
+[[ "$("$PYTHON" build.py --affected-by src1 --cut b2)" = a ]]
+[[ -z "$("$PYTHON" build.py --affected-by all)" ]]
+
+[[ "$("$PYTHON" build.py --why c)" = "c is up to date" ]]
+rm b2
+[[ "$("$PYTHON" build.py --why c)" = "c: b1 would be made
+b1: b2 does not exist" ]]
+"$PYTHON" build.py
+
+sleep 1.1
+echo 2 >| src1
+[[ "$("$PYTHON" build.py --why c)" = "c: b1 would be made
+b1: a would be made
+a: src1 is newer than a" ]]
+[[ "$("$PYTHON" build.py --why e)" = "e is up to date" ]]
+# Nothing is run by the queries.
+[[ "$(cat c)" = 1 ]]
+
+# Paths are normalized as the declared targets.
+[[ "$("$PYTHON" build.py --affected-by ./src1 --cut b2)" = a ]]
+[[ "$("$PYTHON" build.py --why ./e)" = "e is up to date" ]]
+# Sources and unknown targets are reported as errors.
+if "$PYTHON" build.py --why src1 2>| err; then
+   exit 1
+fi
+grep -q "src1 is a source file" err
+if "$PYTHON" build.py --why nothing 2>| err; then
+   exit 1
+fi
+grep -q "No rule to make nothing" err
@@ -0,0 +1,89 @@
+#!/bin/bash
+# @(#) --work_stealing True
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import os
+import sys
+import time
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+file = dsl.file
+phony = dsl.phony
+loop = dsl.loop
+
+
+n = 20
+phony("all", [f"c{n - 1}", "wide", "s"])
+
+
+@loop(range(n))
+def _(i):
+    @file(f"c{i}", [f"c{i - 1}"] if i > 0 else [])
+    def _(j):
+        with open(j.ts, "w") as fp:
+            fp.write(str(i + (int(open(j.ds[0]).read()) if j.ds else 0)))
+
+
+@loop(range(100))
+def _(i):
+    @phony(f"w{i}", [])
+    def _(j):
+        time.sleep(0.01)
+
+
+phony("wide", [f"w{i}" for i in range(100)])
+
+
+@loop(range(4))
+def _(i):
+    @file(f"s{i}", [], serial=True)
+    def _(j):
+        time.sleep(0.2)
+        open(j.ts, "w").close()
+
+
+phony("s", [f"s{i}" for i in range(4)])
+
+
+if __name__ == '__main__':
+    t1 = time.time()
+    dsl.run()
+    dt = time.time() - t1
+    assert 0.8 < dt < 1.5, dt
+    stats = dsl.stats()["executor"]
+    assert stats["n_local"] + stats["n_stolen"] > 0, stats
+EOF
+
+"$PYTHON" build.py -j4 --work_stealing True
+[[ "$(cat c19)" = 190 ]]
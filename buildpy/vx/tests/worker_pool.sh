@@ -0,0 +1,65 @@
+#!/bin/bash
+# @(#) Idle worker threads should be reused
+
+# set -xv
+set -o nounset
+set -o errexit
+set -o pipefail
+set -o noclobber
+
+export IFS=$' \t\n'
+export LANG=en_US.UTF-8
+umask u=rwx,g=,o=
+
+
+readonly tmp_dir="$(mktemp -d)"
+
+finalize(){
+   rm -fr "$tmp_dir"
+}
+
+trap finalize EXIT
+
+
+cd "$tmp_dir"
+
+
+cat <<EOF > build.py
+#!/usr/bin/python3
+
+import json
+import os
+import sys
+
+import buildpy.vx
+
+
+os.environ["SHELL"] = "/bin/bash"
+os.environ["SHELLOPTS"] = "pipefail:errexit:nounset:noclobber"
+os.environ["PYTHON"] = sys.executable
+
+
+dsl = buildpy.vx.DSL(sys.argv)
+phony = dsl.phony
+loop = dsl.loop
+
+
+n = 500
+phony("all", [f"x{i}" for i in range(n)])
+
+
+@loop(range(n))
+def _(i):
+    phony(f"x{i}", [f"x{i + 1}"] if i % 100 < 99 else [])
+
+
+if __name__ == '__main__':
+    dsl.run()
+    stats = dsl.stats()["executor"]
+    assert stats["threads_created"] <= 4, stats
+    assert stats["threads_reused"] >= n - 4, stats
+    with open(os.path.join(dsl.execution_log_dir, "stats.json")) as fp:
+        assert json.load(fp)["executor"]["threads_created"] == stats["threads_created"]
+EOF
+
+"$PYTHON" build.py -j4
@@ -51,12 +51,14 @@ setup(
         "buildpy.v9",
         "buildpy.v9._convenience",
         "buildpy.v9._log",
+        "buildpy.v9._remote",
         "buildpy.v9._tval",
         "buildpy.v9.exception",
         "buildpy.v9.resource",
         "buildpy.vx",
         "buildpy.vx._convenience",
         "buildpy.vx._log",
+        "buildpy.vx._remote",
         "buildpy.vx._tval",
         "buildpy.vx.exception",
         "buildpy.vx.resource",